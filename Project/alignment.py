@@ -0,0 +1,86 @@
+'''
+	alignment.py
+
+	Objective: Line up the chapter level coref document with the sentence level dependency parses, using integer arrays
+	           instead of per word python loops.  Used by get_word_to_sentence_mapping_locations() and get_corrected_indices()
+	           in hp_narrative_chains.py.  The words of the dependency parses are interned into a vocab.Vocabulary, so the
+	           chapter document is an int32 array of word ids and its sentences are views into it.
+
+	Methods:	get_word_to_sentence_arrays(dependency_parses, vocabulary=None)
+				get_corrected_index_array(orig_doc, coref_doc, vocabulary=None)
+				report_mismatches(mismatches, max_shown=5)
+'''
+
+import itertools
+
+import numpy as np
+
+import vocab
+
+
+def get_word_to_sentence_arrays(dependency_parses, vocabulary=None):
+    '''
+        Input: Dependency Parses for each chapter.  Dependency parses are done at the sentence level.  The words are
+               interned into vocabulary (default: vocab.get_default_vocabulary()).
+        Return: original_document - int32 array, the word ids of the chapter level tokenized document from the dependency parser
+                original_sentences - the word ids of every sentence (views into original_document)
+                words_to_sentence_locations - int array, the sentence every word of original_document is in
+                sentence_starting_positions - int array, the index in original_document where each sentence starts
+                Each dependency parse also gets its 'word_offset', same as sentence_starting_positions.
+    '''
+
+    if vocabulary is None:
+        vocabulary = vocab.get_default_vocabulary()
+    sentence_words = [dep_parse['words'] for dep_parse in dependency_parses]
+
+    sentence_lengths = np.fromiter((len(words) for words in sentence_words), dtype=np.int64, count=len(sentence_words))
+    sentence_starting_positions = np.zeros(len(sentence_words), dtype=np.int64)
+    np.cumsum(sentence_lengths[:-1], out=sentence_starting_positions[1:])
+    words_to_sentence_locations = np.repeat(np.arange(len(sentence_words), dtype=np.int64), sentence_lengths)
+
+    original_document = vocabulary.encode(list(itertools.chain.from_iterable(sentence_words)))
+    original_sentences = [original_document[start:start + length] for start, length in zip(sentence_starting_positions.tolist(), sentence_lengths.tolist())]
+
+    for dep_parse, word_offset in zip(dependency_parses, sentence_starting_positions.tolist()):
+        dep_parse['word_offset'] = word_offset
+
+    return original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions
+
+def get_corrected_index_array(orig_doc, coref_doc, vocabulary=None):
+    '''
+        Input: orig_doc (the word ids of the chapter level words of the dependency parses), coref doc (strings), and the
+               vocabulary of the ids (default: vocab.get_default_vocabulary())
+        Output: corrected_indices - int array, for every position i in coref_doc, the offset that moves it to its word in
+                                    orig_doc.  Blank coref words don't exist in orig_doc, so every blank pushes the words
+                                    after it back by one: corrected_indices[i] is minus the number of blanks before i.
+                mismatches - (coref position, orig word, coref word) for every non blank coref word that isn't the word
+                             it lines up with in orig_doc
+    '''
+
+    if vocabulary is None:
+        vocabulary = vocab.get_default_vocabulary()
+    num_coref_words = len(coref_doc)
+    is_word = np.char.str_len(np.char.strip(np.asarray(coref_doc, dtype=str))) > 0
+
+    ## number of real words before each position = where that position lands in orig_doc
+    orig_positions = np.cumsum(is_word) - is_word
+    corrected_indices = orig_positions - np.arange(num_coref_words)
+
+    ## a coref word that isn't in the vocabulary can't be any dependency parse word
+    word_positions = np.flatnonzero(is_word)
+    aligned_orig_words = np.asarray(orig_doc)[orig_positions[word_positions]]
+    coref_words = vocabulary.lookup([coref_doc[position] for position in word_positions.tolist()])
+    mismatched = np.flatnonzero(aligned_orig_words != coref_words)
+    mismatches = [(int(word_positions[k]), vocabulary[aligned_orig_words[k]], coref_doc[word_positions[k]]) for k in mismatched.tolist()]
+
+    return corrected_indices, mismatches
+
+def report_mismatches(mismatches, max_shown=5):
+    '''
+        Prints one report for all the mismatches of a chapter from get_corrected_index_array()
+    '''
+    if not mismatches:
+        return
+    print('%d words of the coref document do not match the dependency parse words, first mismatch at %d' % (len(mismatches), mismatches[0][0]))
+    for position, orig_word, coref_word in mismatches[:max_shown]:
+        print('\t%d\t%r\t%r' % (position, orig_word, coref_word))
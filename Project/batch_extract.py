@@ -0,0 +1,440 @@
+'''
+	batch_extract.py
+
+	Objective: Dependency parse and semantic role events of a whole chapter (or any list of sentences) at once, with NumPy
+	           masks and gathers instead of a python walk over every word of every sentence.
+
+	           The sentences are laid out end to end, each one with the "<root>" slot in front of it the way
+	           get_narrative_chains_from_dep_parsing() in hp_narrative_chains.py pads them: one head array, one label list
+	           and one word list for each of the replaced versions (cluster nums and NNPs).  The words whose label is one
+	           of the relations are picked with one mask, their father and grandfather are two gathers through the heads
+	           (negative heads wrap around inside their sentence, like python list indexing), and the event tuples of
+	           every sentence are zipped together in one pass from columns gathered with operator.itemgetter.
+
+	           The relations are configurable (default_dp_relations are the target_tags the extraction always used).
+	           get_narrative_chains_from_dep_parsing() only ever returned the events of the chapter's last sentence (the
+	           append is outside its sentence loop).  DependencyExtractor keeps that by default so results stay comparable,
+	           and returns the events of every sentence with all_sentences=True.
+
+	           The semantic roles are decoded the same way.  The BIO tags of every verb frame of the chapter are encoded
+	           into one int array (ids of a small per process tag vocabulary, with a table of the B-/I- kind and the role
+	           of every tag), and whole argument spans come out of a few array comparisons: a span starts at every tag
+	           with a role that isn't the continuation (I- of the same role, same frame) of the tag before it, and ends
+	           at the next tag that isn't.  get_srl_records() turns the spans into (predicate, role, span, head entity)
+	           records, the head entity being the first cluster mention in the span (its last word if there is none).
+	           SemanticRoleExtractor gives the chains of get_narrative_chains_from_sem_roles() (only the B- words of the
+	           target tags, only the last sentence), or with spans=True one ('B-' + role, head entity) pair per span, so
+	           a multiword argument is represented by its entity instead of by its first word.
+
+	Methods:	get_dp_event_arrays(dependency_parses, relations=default_dp_relations, sentence_lengths=None)
+				get_dp_chains(dependency_parses, sentences_with_cluster_nums, sentences_with_NNPs, relations=default_dp_relations)
+				DependencyExtractor(relations=default_dp_relations, all_sentences=False)
+				get_default_dp_extractor()
+				set_default_dp_extractor(extractor)
+				TagTable()
+				get_srl_span_arrays(semantic_roles, tag_table, sentence_lengths=None)
+				get_srl_records(semantic_roles, sentences_with_cluster_nums, sentences_with_NNPs, roles=default_srl_roles, tag_table=None)
+				SemanticRoleExtractor(target_tags=default_srl_tags, roles=default_srl_roles, all_sentences=False, spans=False)
+				get_default_srl_extractor()
+				set_default_srl_extractor(extractor)
+
+	Usage:	extractor = batch_extract.get_default_dp_extractor()
+			dp_chains_with_clusters, dp_chains_with_NNPs = extractor.extract(dependency_parses, sentences_with_cluster_nums, sentences_with_NNPs)
+			records_with_clusters, records_with_NNPs = batch_extract.get_srl_records(semantic_roles, sentences_with_cluster_nums, sentences_with_NNPs)
+'''
+
+import itertools
+import operator
+
+import numpy as np
+
+import vocab
+
+default_dp_relations = ('nn', 'nsubj', 'nsubjpass', 'amod', 'advcl', 'poss', 'conj', 'dobj')
+
+## the tags get_narrative_chains_from_sem_roles() keeps, and the roles of the spans that are kept.  ('ARGM-GOL' never
+## matched a BIO tag as a target tag; as a role it picks up the B-ARGM-GOL spans.)
+default_srl_tags = ('B-ARG0', 'B-V', 'B-ARG1', 'ARGM-GOL')
+default_srl_roles = ('ARG0', 'V', 'ARG1', 'ARGM-GOL')
+
+cluster_prefix = 'COREF_CLUSTER'
+
+root = '<root>'
+
+
+def _pad(sentences, value):
+    ## the sentences end to end, each one after a root slot holding value
+    padded = []
+    for sentence in sentences:
+        padded.append(value)
+        padded.extend(sentence)
+    return padded
+
+def _gather(values, indices):
+    ## [values[i] for i in indices], in C
+    if len(indices) > 1:
+        return list(operator.itemgetter(*indices)(values))
+    return [values[i] for i in indices]
+
+def get_dp_event_arrays(dependency_parses, relations=default_dp_relations, sentence_lengths=None):
+    '''
+        Input:  the dependency parses of a list of sentences, the dependency labels that make an event, and optionally
+                the lengths of the sentences the events are read from (default: the parses' words)
+        Output: None if a sentence doesn't have as many heads and labels as words (it can't be laid out), otherwise a dict of
+                    'sentence'  - int array, the sentence of every event
+                    'positions' - (events, 3) int array, the entity, father and grandfather positions in the sentence, as
+                                  get_narrative_chains_from_dep_parsing() reports them (-1 is the root)
+                    'slots'     - (events, 3) int array, where the entity, father and grandfather are in the padded layout
+                                  (every sentence after a root slot, see _pad())
+                    'labels'    - the padded list of dependency labels
+                Raises IndexError for a head that points outside its sentence, as the per sentence walk does.
+    '''
+    labels = [dep_parse['predicted_dependencies'] for dep_parse in dependency_parses]
+    heads = [dep_parse['predicted_heads'] for dep_parse in dependency_parses]
+    if sentence_lengths is None:
+        sentence_lengths = [len(dep_parse['words']) for dep_parse in dependency_parses]
+    for sentence_labels, sentence_heads, length in zip(labels, heads, sentence_lengths):
+        if len(sentence_labels) != length or len(sentence_heads) != length:
+            return None
+
+    ## every sentence takes its length + 1 slots, the first one for the root
+    padded_lengths = np.fromiter(sentence_lengths, dtype=np.int64, count=len(labels)) + 1
+    starts = np.zeros(len(labels), dtype=np.int64)
+    np.cumsum(padded_lengths[:-1], out=starts[1:])
+    num_slots = int(padded_lengths.sum())
+
+    padded_labels = _pad(labels, root)
+    head_slots = np.fromiter(_pad(heads, -1), dtype=np.int64, count=num_slots)
+    is_entity = np.fromiter(map(frozenset(relations).__contains__, padded_labels), dtype=bool, count=num_slots)
+    is_entity[starts] = False
+    entities = np.flatnonzero(is_entity)
+    sentence = np.repeat(np.arange(len(labels)), padded_lengths)[entities]
+    sentence_starts = starts[sentence]
+    lengths = padded_lengths[sentence]
+
+    def follow(slots):
+        ## the head of every slot, as a raw head and as the slot it is in
+        raw_heads = head_slots[slots]
+        if np.any((raw_heads < -lengths) | (raw_heads >= lengths)):
+            raise IndexError('list index out of range')
+        return raw_heads, sentence_starts + np.where(raw_heads < 0, raw_heads + lengths, raw_heads)
+
+    fathers, father_slots = follow(entities)
+    grandfathers, grandfather_slots = follow(father_slots)
+
+    return {'sentence': sentence,
+            'positions': np.stack([entities - sentence_starts, fathers, grandfathers], axis=1) - 1,
+            'slots': np.stack([entities, father_slots, grandfather_slots], axis=1),
+            'labels': padded_labels}
+
+def get_dp_chains(dependency_parses, sentences_with_cluster_nums, sentences_with_NNPs, relations=default_dp_relations):
+    '''
+        Input:  the dependency parses of a list of sentences, the same sentences with cluster nums and with NNPs (as
+                replace_cluster_spans() returns them) and the relations
+        Output: the event chains of every sentence that has events, with cluster nums and with NNPs, in the format of
+                get_narrative_chains_from_dep_parsing().  None if the sentences can't be laid out (see get_dp_event_arrays()).
+    '''
+    events = get_dp_event_arrays(dependency_parses, relations, [len(sentence) for sentence in sentences_with_cluster_nums])
+    if events is None:
+        return None
+
+    slots = events['slots'].T.tolist()
+    ## the position tuples and labels are shared by both versions of an event
+    positions = list(zip(*events['positions'].T.tolist()))
+    labels = [_gather(events['labels'], column) for column in slots]
+    counts = [count for count in np.bincount(events['sentence'], minlength=len(dependency_parses)).tolist() if count]
+
+    chains = []
+    for sentences in (sentences_with_cluster_nums, sentences_with_NNPs):
+        padded_words = _pad(sentences, root)
+        words = [_gather(padded_words, column) for column in slots]
+        event_tuples = zip(positions, zip(words[0], labels[0]), zip(words[1], labels[1]), zip(words[2], labels[2]))
+        chains.append([list(itertools.islice(event_tuples, count)) for count in counts])
+    return chains[0], chains[1]
+
+
+class DependencyExtractor(object):
+    '''
+        The dependency parse extraction of hp_narrative_chains.get_chapter_narrative_chains().
+
+        relations - the dependency labels that make an event
+        all_sentences - return the events of every sentence of the chapter, instead of only the last sentence's
+                        like get_narrative_chains_from_dep_parsing() does
+    '''
+
+    def __init__(self, relations=default_dp_relations, all_sentences=False):
+        self.relations = tuple(relations)
+        self.all_sentences = all_sentences
+
+    def extract(self, dependency_parses, sentences_with_cluster_nums, sentences_with_NNPs):
+        '''
+            Input:  a chapter's dependency parses and its sentences with cluster nums and with NNPs, the same arguments
+                    as get_narrative_chains_from_dep_parsing()
+            Output: (dp chains with cluster nums, dp chains with NNPs), ['<none>'] each if there are no events.  None if the
+                    chapter can't be laid out in arrays; use get_narrative_chains_from_dep_parsing() for it instead.
+        '''
+        if not self.all_sentences:
+            dependency_parses = dependency_parses[-1:]
+            sentences_with_cluster_nums = sentences_with_cluster_nums[-1:]
+            sentences_with_NNPs = sentences_with_NNPs[-1:]
+
+        for dep_parse in dependency_parses:
+            if len(dep_parse['predicted_dependencies']) == 0:
+                print('there are no predicted dependencies for: ', dep_parse['words'])
+
+        chains = get_dp_chains(dependency_parses, sentences_with_cluster_nums, sentences_with_NNPs, self.relations)
+        if chains is None:
+            return None
+        if not chains[0]:
+            return ['<none>'], ['<none>']
+        return chains
+
+
+_default_dp_extractor = None
+
+def get_default_dp_extractor():
+    global _default_dp_extractor
+    if _default_dp_extractor is None:
+        _default_dp_extractor = DependencyExtractor()
+    return _default_dp_extractor
+
+def set_default_dp_extractor(extractor):
+    '''
+        Input: the DependencyExtractor get_default_dp_extractor() returns from now on (hp_narrative_chains.imap_stories() hands it to its workers)
+    '''
+    global _default_dp_extractor
+    _default_dp_extractor = extractor
+
+
+class TagTable(object):
+    '''
+        The ids of the SRL tags, and for every tag id its kind (0 outside, 1 begin, 2 inside) and role id.  A tag other
+        than 'O' without a B-/I- prefix begins a span of its own name.
+
+        tags - vocab.Vocabulary of the tags
+        roles - vocab.Vocabulary of the roles (the tags without their prefix)
+    '''
+
+    def __init__(self):
+        self.tags = vocab.Vocabulary()
+        self.roles = vocab.Vocabulary()
+        self.kinds = np.zeros(0, dtype=np.int8)
+        self.tag_roles = np.zeros(0, dtype=vocab.id_dtype)
+
+    def encode(self, tags):
+        '''
+            Output: int32 array of the ids of a list of tags, extending the table for the new ones
+        '''
+        tag_ids = self.tags.encode(tags)
+        if len(self.tags) > len(self.kinds):
+            kinds = []
+            tag_roles = []
+            for tag in self.tags.strings[len(self.kinds):]:
+                if tag == 'O':
+                    kinds.append(0)
+                    tag_roles.append(-1)
+                elif tag[:2] in ('B-', 'I-'):
+                    kinds.append(1 if tag[0] == 'B' else 2)
+                    tag_roles.append(self.roles.intern(tag[2:]))
+                else:
+                    kinds.append(1)
+                    tag_roles.append(self.roles.intern(tag))
+            self.kinds = np.concatenate([self.kinds, np.array(kinds, dtype=np.int8)])
+            self.tag_roles = np.concatenate([self.tag_roles, np.array(tag_roles, dtype=vocab.id_dtype)])
+        return tag_ids
+
+
+def _get_frame_arrays(semantic_roles, tag_table, sentence_lengths):
+    ## the tags of every verb frame end to end, see get_srl_span_arrays()
+    frame_tags = [verb['tags'] for sentence in semantic_roles for verb in sentence['verbs']]
+    frame_sentence = np.repeat(np.arange(len(semantic_roles)), [len(sentence['verbs']) for sentence in semantic_roles])
+    frame_lengths = np.fromiter(map(len, frame_tags), dtype=np.int64, count=len(frame_tags))
+    frame_starts = np.zeros(len(frame_tags), dtype=np.int64)
+    np.cumsum(frame_lengths[:-1], out=frame_starts[1:])
+    word_offsets = np.zeros(len(semantic_roles), dtype=np.int64)
+    np.cumsum(sentence_lengths[:-1], out=word_offsets[1:])
+
+    tags = list(itertools.chain.from_iterable(frame_tags))
+    frame = np.repeat(np.arange(len(frame_tags)), frame_lengths)
+    position = np.arange(len(tags)) - frame_starts[frame]
+    return {'tags': tags,
+            'tag_ids': tag_table.encode(tags),
+            'frame': frame,
+            'position': position,
+            'in_sentence': position < np.asarray(sentence_lengths, dtype=np.int64)[frame_sentence[frame]],
+            'frame_starts': frame_starts,
+            'frame_lengths': frame_lengths,
+            'frame_sentence': frame_sentence,
+            'word_offsets': word_offsets}
+
+def get_srl_span_arrays(semantic_roles, tag_table, sentence_lengths=None):
+    '''
+        Input:  the semantic roles of a list of sentences, the TagTable to encode their tags with, and optionally the
+                lengths of the sentences the words are read from (default: the semantic roles' words)
+        Output: dict of the tags of every verb frame laid out end to end
+                    'tags'           - the tags, a list
+                    'tag_ids'        - int array of their ids
+                    'frame'          - int array, the frame of every tag
+                    'position'       - int array, the position of every tag in its sentence
+                    'in_sentence'    - bool array, whether the position is inside the sentence
+                    'frame_starts', 'frame_lengths' - int arrays, where the tags of every frame start and how many there are
+                    'frame_sentence' - int array, the sentence of every frame
+                    'word_offsets'   - int array, where each sentence starts in the sentences laid out end to end
+                and of the argument spans (a B- tag and the I- tags of the same role after it, in the same frame)
+                    'span_frame', 'span_role', 'span_start', 'span_end' - int arrays, the frame and role id of every span,
+                                     and its first and one past last position in the sentence.  Tags past the end of
+                                     their sentence are left out of the spans.
+    '''
+    if sentence_lengths is None:
+        sentence_lengths = [len(sentence['words']) for sentence in semantic_roles]
+    arrays = _get_frame_arrays(semantic_roles, tag_table, sentence_lengths)
+    tag_ids = arrays['tag_ids']
+    frame_starts = arrays['frame_starts']
+
+    ## a tag continues a span if it is I- of the role of the tag before it in the same frame
+    role = np.where(arrays['in_sentence'], tag_table.tag_roles[tag_ids], -1)
+    previous_role = np.concatenate([[-1], role[:-1]])
+    previous_role[frame_starts[arrays['frame_lengths'] > 0]] = -1
+    continues = (tag_table.kinds[tag_ids] == 2) & (role >= 0) & (role == previous_role)
+    span_start = np.flatnonzero((role >= 0) & ~continues)
+    breaks = np.append(np.flatnonzero(~continues), len(tag_ids))
+    span_end = breaks[np.searchsorted(breaks, span_start, side='right')]
+    span_frame = arrays['frame'][span_start]
+
+    arrays['span_frame'] = span_frame
+    arrays['span_role'] = role[span_start]
+    arrays['span_start'] = span_start - frame_starts[span_frame]
+    arrays['span_end'] = span_end - frame_starts[span_frame]
+    return arrays
+
+def _get_srl_records(spans, sentences_with_cluster_nums, sentences_with_NNPs, roles, tag_table):
+    ## the first V span of every frame is its predicate
+    verb_spans = np.flatnonzero(spans['span_role'] == tag_table.roles.ids.get('V', -2))
+    frame_verb = np.full(len(spans['frame_sentence']), -1, dtype=np.int64)
+    frame_verb[spans['span_frame'][verb_spans[::-1]]] = verb_spans[::-1]
+
+    ## span positions in the words of all the sentences end to end; the head is the first cluster mention, found by
+    ## counting the mentions before every word
+    sentence_offsets = spans['word_offsets'][spans['frame_sentence'][spans['span_frame']]]
+    starts = sentence_offsets + spans['span_start']
+    ends = sentence_offsets + spans['span_end']
+    cluster_words = list(itertools.chain.from_iterable(sentences_with_cluster_nums))
+    is_cluster = np.fromiter(map(operator.methodcaller('startswith', cluster_prefix), cluster_words), dtype=bool, count=len(cluster_words))
+    mentions_before = np.concatenate([[0], np.cumsum(is_cluster)])
+    heads = np.where(mentions_before[ends] > mentions_before[starts], np.searchsorted(mentions_before, mentions_before[starts] + 1) - 1, ends - 1)
+    verb_slots = frame_verb[spans['span_frame']]
+    predicates = np.where(verb_slots >= 0, starts[verb_slots], -1)
+
+    kept = np.flatnonzero(np.isin(spans['span_role'], tag_table.roles.lookup(roles)))
+    role_names = _gather(tag_table.roles.strings, spans['span_role'][kept].tolist())
+    columns = [column[kept].tolist() for column in (predicates, starts, ends, heads)]
+
+    records = []
+    for words in (cluster_words, list(itertools.chain.from_iterable(sentences_with_NNPs))):
+        records.append([(words[predicate] if predicate >= 0 else None, role_name, tuple(words[start:end]), words[head])
+                        for predicate, role_name, start, end, head in zip(columns[0], role_names, *columns[1:])])
+    return records[0], records[1], spans['span_frame'][kept]
+
+def get_srl_records(semantic_roles, sentences_with_cluster_nums, sentences_with_NNPs, roles=default_srl_roles, tag_table=None):
+    '''
+        Input:  the semantic roles of a list of sentences, the same sentences with cluster nums and with NNPs, the roles
+                of the spans to keep and the TagTable (default: the default SemanticRoleExtractor's)
+        Output: (records with cluster nums, records with NNPs), lists of (predicate, role, span, head entity) for every
+                kept span of every verb frame, in order.  The predicate is the first word of the frame's V span (None if
+                it has none), span the tuple of the span's words and head entity the first cluster mention in the span,
+                or its last word if there is none.
+    '''
+    if tag_table is None:
+        tag_table = get_default_srl_extractor().tag_table
+    num_sentences = min(len(semantic_roles), len(sentences_with_cluster_nums), len(sentences_with_NNPs))
+    spans = get_srl_span_arrays(semantic_roles[:num_sentences], tag_table, [len(sentence) for sentence in sentences_with_cluster_nums[:num_sentences]])
+    return _get_srl_records(spans, sentences_with_cluster_nums[:num_sentences], sentences_with_NNPs[:num_sentences], roles, tag_table)[:2]
+
+
+class SemanticRoleExtractor(object):
+    '''
+        The semantic role extraction of hp_narrative_chains.get_chapter_narrative_chains().
+
+        target_tags - the tags whose words make up a chain
+        roles - the roles of the spans that make up a chain, with spans=True
+        all_sentences - return the chains of every sentence, instead of only the last sentence's like
+                        get_narrative_chains_from_sem_roles() does
+        spans - a chain is a ('B-' + role, head entity) pair for each whole span of the frame, instead of a (tag, word)
+                pair for each target tag
+        tag_table - the TagTable the tags are encoded with
+    '''
+
+    def __init__(self, target_tags=default_srl_tags, roles=default_srl_roles, all_sentences=False, spans=False):
+        self.target_tags = tuple(target_tags)
+        self.roles = tuple(roles)
+        self.all_sentences = all_sentences
+        self.spans = spans
+        self.tag_table = TagTable()
+
+    def extract(self, semantic_roles, sentences_with_cluster_nums, sentences_with_NNPs):
+        '''
+            Input:  a chapter's semantic roles and its sentences with cluster nums and with NNPs, the same arguments as
+                    get_narrative_chains_from_sem_roles()
+            Output: (sr chains with cluster nums, sr chains with NNPs), a chain for every verb frame that has a target tag
+                    (or kept span)
+        '''
+        ## like zip(), only the sentences that are in all three
+        num_sentences = min(len(semantic_roles), len(sentences_with_cluster_nums), len(sentences_with_NNPs))
+        first = 0 if self.all_sentences else max(num_sentences - 1, 0)
+        semantic_roles = semantic_roles[first:num_sentences]
+        sentences_with_cluster_nums = sentences_with_cluster_nums[first:num_sentences]
+        sentences_with_NNPs = sentences_with_NNPs[first:num_sentences]
+        sentence_lengths = [len(sentence) for sentence in sentences_with_cluster_nums]
+
+        if self.spans:
+            spans = get_srl_span_arrays(semantic_roles, self.tag_table, sentence_lengths)
+            records_with_clusters, records_with_NNPs, chain_frames = _get_srl_records(spans, sentences_with_cluster_nums, sentences_with_NNPs, self.roles, self.tag_table)
+            pairs = [(('B-' + role, head) for _, role, _, head in records) for records in (records_with_clusters, records_with_NNPs)]
+        else:
+            spans = _get_frame_arrays(semantic_roles, self.tag_table, sentence_lengths)
+            is_target = np.zeros(len(self.tag_table.tags), dtype=bool)
+            is_target[[self.tag_table.tags.ids[tag] for tag in self.target_tags if tag in self.tag_table.tags]] = True
+            picked = np.flatnonzero(is_target[spans['tag_ids']])
+            past_end = ~spans['in_sentence'][picked]
+            if np.any(past_end):
+                self._print_mismatches(spans, picked[past_end], semantic_roles, sentences_with_cluster_nums, sentences_with_NNPs)
+                picked = picked[~past_end]
+            chain_frames = spans['frame'][picked]
+            tags = _gather(spans['tags'], picked.tolist())
+            word_slots = (spans['word_offsets'][spans['frame_sentence'][chain_frames]] + spans['position'][picked]).tolist()
+            pairs = [zip(tags, _gather(list(itertools.chain.from_iterable(sentences)), word_slots))
+                     for sentences in (sentences_with_cluster_nums, sentences_with_NNPs)]
+
+        ## the pairs are in frame order, cut them into one chain per frame
+        counts = [count for count in np.bincount(chain_frames, minlength=len(spans['frame_sentence'])).tolist() if count]
+        return tuple([list(itertools.islice(version_pairs, count)) for count in counts] for version_pairs in pairs)
+
+    def _print_mismatches(self, spans, tag_slots, semantic_roles, sentences_with_cluster_nums, sentences_with_NNPs):
+        ## the report get_narrative_chains_from_sem_roles() prints for a target tag past the end of its sentence
+        verbs = [verb for sentence in semantic_roles for verb in sentence['verbs']]
+        for tag_slot in tag_slots.tolist():
+            frame = int(spans['frame'][tag_slot])
+            sentence = int(spans['frame_sentence'][frame])
+            print('\n\n')
+            print("Index mismatched:")
+            print('verb[\'tags\']: ', verbs[frame]['tags'])
+            print('tag:', spans['tags'][tag_slot])
+            print('mod_words: ', sentences_with_cluster_nums[sentence], sentences_with_NNPs[sentence])
+            print('index: ', int(spans['position'][tag_slot]))
+            print('\n\n')
+
+
+_default_srl_extractor = None
+
+def get_default_srl_extractor():
+    global _default_srl_extractor
+    if _default_srl_extractor is None:
+        _default_srl_extractor = SemanticRoleExtractor()
+    return _default_srl_extractor
+
+def set_default_srl_extractor(extractor):
+    '''
+        Input: the SemanticRoleExtractor get_default_srl_extractor() returns from now on (hp_narrative_chains.imap_stories() hands it to its workers)
+    '''
+    global _default_srl_extractor
+    _default_srl_extractor = extractor
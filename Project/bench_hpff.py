@@ -0,0 +1,268 @@
+'''
+	bench_hpff.py
+
+	Objective: Benchmark of the narrative chain extraction on synthetic corpora, so performance work can be measured on
+	           any machine without the HPFF data.
+
+	           write_corpus() writes a gzip file of story lines in the schema run_hpff_chains() reads: chapters with
+	           nlp.dependency_parses (words, predicted_dependencies, predicted_heads), nlp.coref (clusters over a chapter
+	           level document with blank tokens in it) and nlp.semantic_roles (BIO tags per verb).  Corpus size and cluster
+	           density are set with the arguments of make_chapter().
+
+	           Each extraction function of hp_narrative_chains.py is timed over every chapter of the corpus (best of
+	           repeats, in chapters per second), then run_hpff_chains() end to end (stories per second), with the peak
+	           python allocation of the end to end run (tracemalloc) and the peak RSS of the process.  Results can be
+	           saved as json and compared against a saved baseline: a metric more than threshold worse fails the run.
+
+	           The mention tagger loads the nltk perceptron tagger.  --simple-tagger tags mentions with a capitalization
+	           rule instead, for machines without the nltk data (cluster naming times are then not comparable).
+
+	Methods:	make_chapter(rng, num_sentences=40, words_per_sentence=20, num_clusters=10, mentions_per_cluster=6, verbs_per_sentence=2, blank_rate=0.02)
+				make_story(rng, num_chapters=5, **chapter_args)
+				write_corpus(filename, num_stories=50, seed=5, num_chapters=5, **chapter_args)
+				run_benchmark(filename, num_workers=1, repeats=3, prefetch=True)
+				compare_results(results, baseline, threshold=0.2)
+
+	Usage:	python bench_hpff.py [--stories N] [--chapters N] [--sentences N] [--clusters N] [--mentions N] [--workers N]
+			                     [--repeats N] [--no-prefetch] [--corpus FILE] [--save FILE] [--baseline FILE] [--threshold FRACTION] [--simple-tagger]
+	Example:python bench_hpff.py --stories 200 --save bench.json
+			python bench_hpff.py --stories 200 --baseline bench.json --threshold 0.1
+'''
+
+import contextlib
+import gzip
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import batch_extract
+import hp_narrative_chains
+import instrumentation
+import mention_tagger
+
+names = ['Harry', 'Hermione', 'Ron', 'Draco', 'Snape', 'Dumbledore', 'Ginny', 'Neville', 'Luna', 'Voldemort']
+pronouns = ['he', 'she', 'him', 'her', 'they', 'his']
+verbs = ['said', 'looked', 'walked', 'cast', 'saw', 'ran', 'took', 'grabbed', 'smiled', 'whispered']
+other_words = ['the', 'a', 'wand', 'castle', 'at', 'to', 'and', 'quickly', 'door', 'book', ',', '.']
+dependencies = ['nsubj', 'dobj', 'amod', 'poss', 'conj', 'advcl', 'nn', 'nsubjpass', 'det', 'prep', 'pobj', 'punct', 'root', 'aux']
+
+## metrics where a smaller value is better, everything else is a rate
+memory_metrics = ['end_to_end_peak_alloc_bytes', 'peak_rss_bytes']
+
+
+def _make_sem_roles(rng, words):
+    sentence_verbs = []
+    verb_positions = [i for i, word in enumerate(words) if word in verbs]
+    for position in verb_positions:
+        tags = ['O'] * len(words)
+        tags[position] = 'B-V'
+        if position > 0:
+            start = rng.randrange(0, position)
+            tags[start] = 'B-ARG0'
+            for i in range(start + 1, position):
+                tags[i] = 'I-ARG0'
+        if position + 1 < len(words):
+            end = rng.randrange(position + 1, len(words))
+            tags[position + 1] = 'B-ARG1'
+            for i in range(position + 2, end + 1):
+                tags[i] = 'I-ARG1'
+        sentence_verbs.append({'verb': words[position], 'description': '', 'tags': tags})
+    return {'verbs': sentence_verbs, 'words': words}
+
+def make_chapter(rng, num_sentences=40, words_per_sentence=20, num_clusters=10, mentions_per_cluster=6, verbs_per_sentence=2, blank_rate=0.02):
+    '''
+        Output: one chapter, {'nlp': {'dependency_parses', 'coref', 'semantic_roles'}}.  Sentence lengths vary around
+                words_per_sentence, every coref mention is a name or pronoun span over real (non blank) words.
+    '''
+    dependency_parses = []
+    semantic_roles = []
+    for _ in range(num_sentences):
+        length = max(3, rng.randint(words_per_sentence // 2, words_per_sentence * 3 // 2))
+        words = [rng.choice(names + pronouns + other_words) for _ in range(length)]
+        for _ in range(verbs_per_sentence):
+            words[rng.randrange(length)] = rng.choice(verbs)
+        dependency_parses.append({'words': words,
+                                  'predicted_dependencies': [rng.choice(dependencies) for _ in range(length)],
+                                  'predicted_heads': [rng.randint(0, length) for _ in range(length)]})
+        semantic_roles.append(_make_sem_roles(rng, words))
+
+    document = []
+    word_positions = []
+    for parse in dependency_parses:
+        for word in parse['words']:
+            word_positions.append(len(document))
+            document.append(word)
+            if rng.random() < blank_rate:
+                document.append('  ')
+
+    clusters = []
+    for _ in range(num_clusters):
+        cluster = []
+        for _ in range(mentions_per_cluster):
+            start = rng.randrange(len(word_positions))
+            end = min(len(word_positions) - 1, start + rng.choice([0, 0, 0, 1, 2]))
+            cluster.append([word_positions[start], word_positions[end]])
+        clusters.append(cluster)
+
+    return {'nlp': {'dependency_parses': dependency_parses,
+                    'coref': {'clusters': clusters, 'document': document},
+                    'semantic_roles': semantic_roles}}
+
+def make_story(rng, num_chapters=5, **chapter_args):
+    return {'chapters': {str(chapter_num): make_chapter(rng, **chapter_args) for chapter_num in range(1, num_chapters + 1)}}
+
+def write_corpus(filename, num_stories=50, seed=5, num_chapters=5, **chapter_args):
+    '''
+        Writes num_stories synthetic stories, one json line each, to the gzip file filename.  The same arguments always
+        give the same corpus.
+    '''
+    rng = random.Random(seed)
+    with gzip.open(filename, 'wt') as fout:
+        for _ in range(num_stories):
+            fout.write(json.dumps(make_story(rng, num_chapters, **chapter_args)) + '\n')
+
+
+def simple_tag_sents(sentences):
+    ## capitalized mentions are proper nouns, the rest pronouns or nouns
+    return [[(word, 'NNP' if word[:1].isupper() else ('PRP' if word in pronouns else 'NN')) for word in sentence] for sentence in sentences]
+
+def _load_chapters(filename):
+    chapters = []
+    with gzip.open(filename, 'rt') as fin:
+        for line in fin:
+            story = json.loads(line)
+            for chapter in story['chapters']:
+                chapters.append((story, chapter))
+    return chapters
+
+def _best_rate(function, items, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for item in items:
+            function(*item)
+        best = min(best, time.perf_counter() - start)
+    return len(items) / best if best > 0 else float('inf')
+
+def run_benchmark(filename, num_workers=1, repeats=3, prefetch=True):
+    '''
+        Input:  a corpus from write_corpus(), the number of workers for the end to end run, and how many times each
+                function is timed (the best time is kept).  prefetch is passed on to run_hpff_chains().
+        Output: dict of metric -> value.  *_chapters_per_second for every extraction function, end_to_end_stories_per_second,
+                end_to_end_peak_alloc_bytes and peak_rss_bytes.
+    '''
+    chapters = _load_chapters(filename)
+    num_stories = len(set(id(story) for story, chapter in chapters))
+
+    ## the inputs of every stage, worked out once so each function is timed on its own
+    inputs = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for story, chapter in chapters:
+            nlp = story['chapters'][chapter]['nlp']
+            story_copy = {'chapters': {chapter: {}}}
+            original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, _ = hp_narrative_chains.get_word_to_sentence_mapping_locations(nlp['dependency_parses'], chapter, story_copy)
+            corrected_indices = hp_narrative_chains.get_corrected_indices(original_document, nlp['coref']['document'])
+            cluster_num_to_NNP_map = hp_narrative_chains.get_cluster_num_to_NNP_map(nlp['coref']['clusters'], nlp['coref']['document'])
+            replaced = hp_narrative_chains.replace_cluster_spans(original_document, original_sentences, sentence_starting_positions, nlp['coref']['clusters'], corrected_indices, cluster_num_to_NNP_map)
+            inputs.append((nlp, chapter, story_copy, original_document, original_sentences, sentence_starting_positions, corrected_indices, cluster_num_to_NNP_map, replaced))
+
+    results = {}
+    results['word_to_sentence_chapters_per_second'] = _best_rate(hp_narrative_chains.get_word_to_sentence_mapping_locations,
+        [(x[0]['dependency_parses'], x[1], x[2]) for x in inputs], repeats)
+    results['index_correction_chapters_per_second'] = _best_rate(hp_narrative_chains.get_corrected_indices,
+        [(x[3], x[0]['coref']['document']) for x in inputs], repeats)
+    results['cluster_naming_chapters_per_second'] = _best_rate(hp_narrative_chains.get_cluster_num_to_NNP_map,
+        [(x[0]['coref']['clusters'], x[0]['coref']['document']) for x in inputs], repeats)
+    results['span_replacement_chapters_per_second'] = _best_rate(hp_narrative_chains.replace_cluster_spans,
+        [(x[3], x[4], x[5], x[0]['coref']['clusters'], x[6], x[7]) for x in inputs], repeats)
+    results['dp_extraction_chapters_per_second'] = _best_rate(batch_extract.get_default_dp_extractor().extract,
+        [(x[0]['dependency_parses'], x[8][0], x[8][1]) for x in inputs], repeats)
+    results['srl_extraction_chapters_per_second'] = _best_rate(batch_extract.get_default_srl_extractor().extract,
+        [(x[0]['semantic_roles'], x[8][0], x[8][1]) for x in inputs], repeats)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            hp_narrative_chains.run_hpff_chains(filename, num_workers, prefetch=prefetch)
+            best = min(best, time.perf_counter() - start)
+        results['end_to_end_stories_per_second'] = num_stories / best
+
+        tracemalloc.start()
+        hp_narrative_chains.run_hpff_chains(filename, num_workers, prefetch=prefetch)
+        results['end_to_end_peak_alloc_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    results['peak_rss_bytes'] = instrumentation.get_peak_rss()
+    return results
+
+def compare_results(results, baseline, threshold=0.2):
+    '''
+        Output: a list of (metric, value, baseline value) for every metric more than threshold (a fraction) worse than
+                the baseline: rates that dropped below baseline * (1 - threshold), memory above baseline * (1 + threshold)
+    '''
+    regressions = []
+    for metric, value in results.items():
+        if value is None or baseline.get(metric) is None:
+            continue
+        if metric in memory_metrics:
+            worse = value > baseline[metric] * (1 + threshold)
+        else:
+            worse = value < baseline[metric] * (1 - threshold)
+        if worse:
+            regressions.append((metric, value, baseline[metric]))
+    return regressions
+
+
+if __name__ == '__main__' :
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the narrative chain extraction on a synthetic HPFF corpus.')
+    parser.add_argument('--stories', type=int, default=50, help='number of stories in the synthetic corpus')
+    parser.add_argument('--chapters', type=int, default=5, help='chapters per story')
+    parser.add_argument('--sentences', type=int, default=40, help='sentences per chapter')
+    parser.add_argument('--clusters', type=int, default=10, help='coref clusters per chapter')
+    parser.add_argument('--mentions', type=int, default=6, help='mentions per cluster')
+    parser.add_argument('--seed', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=1, help='worker processes for the end to end run')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--no-prefetch', action='store_true', help='read the corpus in the main thread in the end to end run')
+    parser.add_argument('--corpus', help='write the synthetic corpus here and keep it (default: a temporary file)')
+    parser.add_argument('--save', help='write the results as json to this file')
+    parser.add_argument('--baseline', help='results json of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='fraction a metric may be worse than the baseline')
+    parser.add_argument('--simple-tagger', action='store_true', help='tag mentions with a capitalization rule instead of the nltk tagger')
+    args = parser.parse_args()
+
+    if args.simple_tagger:
+        mention_tagger.set_default_tagger(mention_tagger.MentionTagger(tag_sents=simple_tag_sents))
+
+    corpus = args.corpus
+    if corpus is None:
+        fd, corpus = tempfile.mkstemp(suffix='.json.gz')
+        os.close(fd)
+    try:
+        write_corpus(corpus, args.stories, args.seed, args.chapters, num_sentences=args.sentences,
+                     num_clusters=args.clusters, mentions_per_cluster=args.mentions)
+        results = run_benchmark(corpus, args.workers, args.repeats, not args.no_prefetch)
+    finally:
+        if args.corpus is None:
+            os.remove(corpus)
+
+    for metric, value in results.items():
+        print('%-42s %14.1f' % (metric, value if value is not None else float('nan')))
+    if args.save:
+        with open(args.save, 'w') as fout:
+            json.dump(results, fout, indent=4)
+    if args.baseline:
+        with open(args.baseline) as fin:
+            regressions = compare_results(results, json.load(fin), args.threshold)
+        for metric, value, baseline_value in regressions:
+            print('REGRESSION %s: %.1f (baseline %.1f)' % (metric, value, baseline_value))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,76 @@
+'''
+	bench_imports.py
+
+	Objective: Startup benchmark.  Every worker process and notebook kernel imports the project modules before doing any
+	           work, so this times the import of each module in a fresh interpreter (nothing cached in sys.modules), and the
+	           time to start a pool of worker processes that import hp_narrative_chains.
+
+	           Nothing is downloaded at import (see util.provision_nltk_data()), so these numbers don't depend on the network.
+
+	Methods:	time_import(module, repeats=5)
+				time_pool_startup(num_workers=4, repeats=3)
+				run_benchmark(modules=default_modules, repeats=5, num_workers=4)
+
+	Usage:	python bench_imports.py [NUM_WORKERS]
+'''
+
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+default_modules = ['util', 'vocab', 'alignment', 'mention_tagger', 'batch_extract', 'hpff_reader', 'hpff_json', 'event_store', 'chain_aggregator', 'hp_narrative_chains']
+
+project_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_import(module, repeats=5):
+    '''
+        Output: the best of repeats import times of module in seconds, each in a new interpreter
+    '''
+    code = 'import time; start = time.perf_counter(); import %s; print(time.perf_counter() - start)' % (module)
+    best = float('inf')
+    for _ in range(repeats):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=project_dir)
+        best = min(best, float(output.decode().strip().splitlines()[-1]))
+    return best
+
+def _import_in_worker(module):
+    __import__(module)
+    return os.getpid()
+
+def time_pool_startup(num_workers=4, repeats=3):
+    '''
+        Output: the best of repeats times in seconds to spawn num_workers processes and have each import hp_narrative_chains
+                (spawn, not fork, so every worker really starts from an empty interpreter)
+    '''
+    context = multiprocessing.get_context('spawn')
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pool = context.Pool(num_workers)
+        pool.map(_import_in_worker, ['hp_narrative_chains'] * num_workers, chunksize=1)
+        best = min(best, time.perf_counter() - start)
+        pool.close()
+        pool.join()
+    return best
+
+def run_benchmark(modules=default_modules, repeats=5, num_workers=4):
+    '''
+        Output: {module: import seconds, ..., 'pool startup': seconds}
+    '''
+    results = {}
+    for module in modules:
+        results[module] = time_import(module, repeats)
+    results['pool startup'] = time_pool_startup(num_workers)
+    return results
+
+
+if __name__ == '__main__' :
+
+    num_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    sys.path.insert(0, project_dir)
+    results = run_benchmark(num_workers=num_workers)
+    for name, seconds in results.items():
+        print('%-22s %8.1f ms' % (name, seconds * 1000))
@@ -0,0 +1,137 @@
+'''
+	bench_replace_clusters.py
+
+	Objective: Micro-benchmark of the coref cluster replacement that runs for every chapter in run_hpff_chains().
+	           Compares the old replacement (deep copies of the document and sentences, then one write per word of every span)
+	           with hp_narrative_chains.replace_cluster_spans(), checks that both give the same output, and reports chapters per second.
+
+	           The corrected indices and the cluster name map are computed once up front, so only the replacement is timed
+	           (and the POS tagger isn't needed).  replace_cluster_spans() is given the document as word ids, the way
+	           get_word_to_sentence_mapping_locations() hands it on, and the encoding is not timed.
+
+	Methods:	make_chapter(rng, num_sentences=40, num_clusters=30, spans_per_cluster=8)
+				replace_cluster_spans_deepcopy(original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, clusters, corrected_indices, cluster_num_to_NNP_map)
+				run_benchmark(num_chapters=200, repeats=5, seed=5)
+
+	Usage:	python bench_replace_clusters.py [NUM_CHAPTERS]
+'''
+
+import copy
+import random
+import sys
+import time
+
+import numpy as np
+
+import hp_narrative_chains
+import vocab
+
+words = ['Harry', 'Hermione', 'Ron', 'Draco', 'he', 'she', 'said', 'looked', 'at', 'the', 'wand', 'and', '.', ',']
+
+
+def make_chapter(rng, num_sentences=40, num_clusters=30, spans_per_cluster=8):
+    '''
+        Output: the arguments replace_cluster_spans() takes for a random chapter, with blank tokens in the coref
+                document so the corrected indices aren't all zero
+    '''
+    original_sentences = [[rng.choice(words) for _ in range(rng.randint(5, 30))] for _ in range(num_sentences)]
+    original_document = [word for sentence in original_sentences for word in sentence]
+    words_to_sentence_locations = [sent_num for sent_num, sentence in enumerate(original_sentences) for _ in sentence]
+    sentence_starting_positions = []
+    word_offset = 0
+    for sentence in original_sentences:
+        sentence_starting_positions.append(word_offset)
+        word_offset += len(sentence)
+
+    coref_document = []
+    for word in original_document:
+        coref_document.append(word)
+        if rng.random() < 0.02:
+            coref_document.append(' ')
+    corrected_indices = []
+    j = 0
+    for i, word in enumerate(coref_document):
+        corrected_indices.append(j - i)
+        if word.strip() != '':
+            j += 1
+
+    ## mentions start and end on real words, like the allennlp coref spans do
+    word_positions = [i for i, word in enumerate(coref_document) if word.strip() != '']
+    clusters = []
+    for cluster_num in range(num_clusters):
+        cluster = []
+        for _ in range(spans_per_cluster):
+            start = rng.randrange(len(word_positions))
+            end = min(len(word_positions) - 1, start + rng.randint(0, 3))
+            cluster.append([word_positions[start], word_positions[end]])
+        clusters.append(cluster)
+    cluster_num_to_NNP_map = {cluster_num: rng.choice(words[:4]) for cluster_num in range(num_clusters)}
+
+    return original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, clusters, corrected_indices, cluster_num_to_NNP_map
+
+def replace_cluster_spans_deepcopy(original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, clusters, corrected_indices, cluster_num_to_NNP_map):
+    ## the replacement get_sentences_replaced_with_clusters() used to do, kept here as the baseline
+    doc_replaced_with_cluster_nums = copy.deepcopy(original_document)
+    doc_replaced_with_NNPs = copy.deepcopy(original_document)
+    sentences_replaced_with_cluster_nums = copy.deepcopy(original_sentences)
+    sentences_replaced_with_NNPs = copy.deepcopy(original_sentences)
+
+    for cluster_num, cluster in enumerate(clusters):
+        for [i, j] in cluster:
+            corrected_i = i + corrected_indices[i]
+            corrected_j = j + corrected_indices[j]
+            for position_in_doc in range(corrected_i, corrected_j+1):
+                doc_replaced_with_cluster_nums[position_in_doc] = "COREF_CLUSTER_" + str(cluster_num)
+                doc_replaced_with_NNPs[position_in_doc] = cluster_num_to_NNP_map[cluster_num]
+                curr_sentence_location_of_this_word = words_to_sentence_locations[position_in_doc]
+                position_of_word_in_the_sentence = position_in_doc - sentence_starting_positions[curr_sentence_location_of_this_word]
+                sentences_replaced_with_cluster_nums[curr_sentence_location_of_this_word][position_of_word_in_the_sentence] = "COREF_CLUSTER_" + str(cluster_num)
+                sentences_replaced_with_NNPs[curr_sentence_location_of_this_word][position_of_word_in_the_sentence] = cluster_num_to_NNP_map[cluster_num]
+
+    return sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs, doc_replaced_with_cluster_nums, doc_replaced_with_NNPs
+
+def encode_chapter(vocabulary, original_document, original_sentences, sentence_starting_positions):
+    ## the word id document, sentence views and starting position array replace_cluster_spans() takes
+    document_ids = vocabulary.encode(original_document)
+    sentence_starting_positions = np.asarray(sentence_starting_positions, dtype=np.int64)
+    sentence_ids = [document_ids[start:start + len(sentence)] for start, sentence in zip(sentence_starting_positions.tolist(), original_sentences)]
+    return document_ids, sentence_ids, sentence_starting_positions
+
+def run_benchmark(num_chapters=200, repeats=5, seed=5):
+    '''
+        Output: {'deepcopy': chapters per second, 'label_array': chapters per second}, the best of repeats runs each
+    '''
+    rng = random.Random(seed)
+    chapters = [make_chapter(rng) for _ in range(num_chapters)]
+    vocabulary = vocab.Vocabulary()
+    encoded_chapters = []
+
+    for (original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, clusters, corrected_indices, cluster_num_to_NNP_map) in chapters:
+        document_ids, sentence_ids, starting_positions = encode_chapter(vocabulary, original_document, original_sentences, sentence_starting_positions)
+        encoded_chapters.append((document_ids, sentence_ids, starting_positions, clusters, corrected_indices, cluster_num_to_NNP_map, vocabulary))
+        before = replace_cluster_spans_deepcopy(original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, clusters, corrected_indices, cluster_num_to_NNP_map)
+        after = hp_narrative_chains.replace_cluster_spans(*encoded_chapters[-1])
+        after = after[:2] + (vocabulary.decode(after[2]), vocabulary.decode(after[3]))
+        assert before == after, 'replace_cluster_spans() does not match the deepcopy replacement'
+
+    def time_it(replace):
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            replace()
+            best = min(best, time.perf_counter() - start)
+        return num_chapters / best
+
+    results = {}
+    results['deepcopy'] = time_it(lambda: [replace_cluster_spans_deepcopy(*chapter) for chapter in chapters])
+    results['label_array'] = time_it(lambda: [hp_narrative_chains.replace_cluster_spans(*chapter) for chapter in encoded_chapters])
+    return results
+
+
+if __name__ == '__main__' :
+
+    num_chapters = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    results = run_benchmark(num_chapters)
+    print('deepcopy replacement:    %10.1f chapters/s' % (results['deepcopy']))
+    print('label array replacement: %10.1f chapters/s' % (results['label_array']))
+    print('speedup: %.1fx' % (results['label_array'] / results['deepcopy']))
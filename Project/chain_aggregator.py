@@ -0,0 +1,153 @@
+'''
+	chain_aggregator.py
+
+	Objective: Group narrative chains by the entity they are about, incrementally.  hpff_analysis() in hp_narrative_chains.py
+	           is a thin wrapper around ChainAggregator.  Chains can be consumed a chapter at a time as they are extracted,
+	           partial aggregates from worker processes or shards can be merged (in order, so the grouped chains come out in
+	           the same order as a single pass), and the state can be saved and reloaded.
+
+	           With counts_only=True only the number of times each entity takes part in each event is kept instead of copies
+	           of the whole chains.  An event is (verb, dependency) as in Chambers and Jurafsky:
+	                dp chains:  (the word the entity depends on, the entity's dependency label)
+	                sr chains:  (the B-V word, the entity's role), for chains that have a B-V
+
+	Methods:	get_entity(chain, is_dp_chains=True)
+				get_event(chain, is_dp_chains=True)
+				event_to_string(event)
+				ChainAggregator(is_dp_chains=True, with_clusters=True, counts_only=False)
+				aggregate_pickle_shards(name, is_dp_chains=True, with_clusters=True, counts_only=False, num_workers=1)
+'''
+
+from collections import Counter, defaultdict
+
+import util
+
+
+def get_entity(chain, is_dp_chains=True):
+    '''
+        Output: the entity (cluster mention or NNP) a chain is grouped under.  For dp chains, chain is a single event tuple.
+    '''
+    if is_dp_chains:
+        return chain[1][0]
+    return chain[0][1]
+
+def get_event(chain, is_dp_chains=True):
+    '''
+        Output: the (verb, dependency) event of the chain's entity, or None if a sem role chain has no verb
+    '''
+    if is_dp_chains:
+        return (chain[2][0], chain[1][1])
+    for tag, word in chain:
+        if tag == 'B-V':
+            return (word, chain[0][0])
+    return None
+
+def event_to_string(event):
+    ## json keys have to be strings
+    return '%s|%s' % event
+
+
+class ChainAggregator(object):
+    '''
+        Usage:
+            aggregator = ChainAggregator(is_dp_chains=False, with_clusters=False)
+            for record in hp_narrative_chains.iter_hpff_chapter_chains(filename):
+                aggregator.consume(record[5])
+            aggregator.merge(other_aggregator)
+            aggregator.save('hpff_sr_aggregate_NNPs.pkl')
+            narrative_chain_counts = aggregator.get_result()
+    '''
+
+    def __init__(self, is_dp_chains=True, with_clusters=True, counts_only=False):
+        self.is_dp_chains = is_dp_chains
+        self.with_clusters = with_clusters
+        self.counts_only = counts_only
+        if counts_only:
+            self.groups = defaultdict(Counter)
+        else:
+            self.groups = defaultdict(list)
+
+    def _add(self, chain):
+        entity = get_entity(chain, self.is_dp_chains)
+        if self.with_clusters and not entity.startswith('COREF_CLUSTER'):
+            return
+        if self.counts_only:
+            event = get_event(chain, self.is_dp_chains)
+            if event is not None:
+                self.groups[entity][event] += 1
+        else:
+            self.groups[entity].append(chain)
+
+    def consume(self, narrative_chains):
+        '''
+            Input: narrative chains in the shape run_hpff_chains() returns them (or any part of that list, such as one chapter's chains)
+        '''
+        if self.is_dp_chains:
+            for chapter_chains in narrative_chains:
+                if chapter_chains == '<none>':
+                    continue
+                for narrative_chain in chapter_chains:
+                    self._add(narrative_chain)
+        else:
+            for chain in narrative_chains:
+                self._add(chain)
+
+    def merge(self, other):
+        '''
+            Input: an aggregator of the same kind, over the chains that come after the ones this one has seen
+        '''
+        if (other.is_dp_chains, other.with_clusters, other.counts_only) != (self.is_dp_chains, self.with_clusters, self.counts_only):
+            raise ValueError('can only merge aggregators of the same kind')
+        for entity, group in other.groups.items():
+            if self.counts_only:
+                self.groups[entity].update(group)
+            else:
+                self.groups[entity].extend(group)
+
+    def get_result(self):
+        '''
+            Output: entity -> list of chains, the same as hpff_analysis() returns.  With counts_only, entity -> {event string: count}
+                    (see event_to_string()), ready for util.write_json()
+        '''
+        if self.counts_only:
+            return {entity: {event_to_string(event): count for event, count in counts.items()} for entity, counts in self.groups.items()}
+        return self.groups
+
+    def save(self, filename):
+        util.pickle_dump({'is_dp_chains': self.is_dp_chains,
+                          'with_clusters': self.with_clusters,
+                          'counts_only': self.counts_only,
+                          'groups': dict(self.groups)}, filename)
+
+    @classmethod
+    def load(cls, filename):
+        state = util.pickle_load(filename)
+        aggregator = cls(state['is_dp_chains'], state['with_clusters'], state['counts_only'])
+        aggregator.groups.update(state['groups'])
+        return aggregator
+
+
+def _aggregate_shard_file(args):
+    shard_filename, is_dp_chains, with_clusters, counts_only = args
+    aggregator = ChainAggregator(is_dp_chains, with_clusters, counts_only)
+    aggregator.consume(util.iter_pickle_shard_file(shard_filename))
+    return aggregator
+
+def aggregate_pickle_shards(name, is_dp_chains=True, with_clusters=True, counts_only=False, num_workers=1):
+    '''
+        Input: the name chains were sharded under by hp_narrative_chains.write_hpff_chain_shards(), and the number of worker processes
+        Output: one ChainAggregator over all of the shards.  Each shard is aggregated on its own and the partial aggregates
+                are merged in shard order, so the result is the same for any num_workers.
+    '''
+    jobs = [(shard_filename, is_dp_chains, with_clusters, counts_only) for shard_filename in util.get_shard_filenames(name)]
+    aggregator = ChainAggregator(is_dp_chains, with_clusters, counts_only)
+    if num_workers <= 1:
+        for partial in map(_aggregate_shard_file, jobs):
+            aggregator.merge(partial)
+        return aggregator
+
+    import multiprocessing
+    with multiprocessing.Pool(num_workers) as pool:
+        for partial in pool.imap(_aggregate_shard_file, jobs):
+            aggregator.merge(partial)
+    return aggregator
@@ -0,0 +1,294 @@
+'''
+	event_pmi.py
+
+	Objective: Event pair statistics of the narrative chains, as in Chambers and Jurafsky (2008): how often two
+	           (verb, dependency) events share a coreferring entity, the PMI of every pair, and the ranking of the
+	           candidate next events of a character by the sum of their PMI with the events it already has.
+
+	           Events are the ones chain_aggregator.get_event() gives.  Co-occurrence is counted inside a chapter
+	           (one list appended to the pickle shards by hp_narrative_chains.write_hpff_chain_shards()), where the
+	           coref clusters are meaningful: every pair of events of the same entity in the chapter counts once, in
+	           both directions, unless the two events are the same.  window limits the pairs to events at most window
+	           apart in the entity's events (default_window), so a main character with thousands of events in a chapter
+	           adds a linear number of pairs instead of a quadratic one; window=None pairs every two events.
+
+	           Events are interned into a vocab.Vocabulary and the pairs are buffered as two int arrays, which are added
+	           into a scipy.sparse event x event matrix every max_pending_pairs pairs, so memory is bounded by the
+	           number of distinct pairs instead of the size of the corpus.  Every shard file can be counted in its own
+	           process; the partial counts are merged in shard order (their event ids are mapped into the merged
+	           vocabulary), so the result is the same for any number of workers.
+
+	Methods:	EventPairCounts(is_dp_chains=True, with_clusters=True, window=default_window, max_pending_pairs=default_max_pending_pairs)
+				count_pickle_shards(name, is_dp_chains=True, with_clusters=True, window=default_window, num_workers=1)
+				pmi_matrix(counts, min_count=1, positive=False)
+				ChainScorer(events, pmi)
+
+	Usage:	python event_pmi.py <CHAINS_NAME> [--sr] [--NNPs] [--window N] [--workers N] [--min-count N] [--positive] [--save NAME] [--rank EVENTS] [--top K]
+	Example:python event_pmi.py hpff_dp_narrative_chains_with_cluster_nums.txt --workers 8 --save hpff_dp_event_pmi --rank "said|nsubj,looked|nsubj"
+'''
+
+import numpy as np
+import scipy.sparse
+
+import chain_aggregator
+import util
+import vocab
+
+## pairs buffered before they are added into the count matrix
+default_max_pending_pairs = 1 << 22
+
+## events of an entity in a chapter are paired with the next default_window of its events, so an entity with n events
+## adds at most n * default_window pairs instead of n^2 / 2
+default_window = 50
+
+
+def _pair_indices(num_events, window):
+    ## the (i, j) positions, i < j, of the pairs among num_events events at most window apart (any distance for None),
+    ## built one offset at a time so only the pairs inside the window are ever allocated
+    max_offset = num_events - 1 if window is None else min(window, num_events - 1)
+    if max_offset < 1:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    i = np.concatenate([np.arange(num_events - offset) for offset in range(1, max_offset + 1)])
+    j = i + np.repeat(np.arange(1, max_offset + 1), num_events - np.arange(1, max_offset + 1))
+    return i, j
+
+
+class EventPairCounts(object):
+    '''
+        events - vocab.Vocabulary of the (verb, dependency) events, an event's id is its row and column in the matrix
+        matrix - scipy.sparse.csr_matrix, entry [i, j] the number of times events i and j shared an entity in a chapter
+
+        Usage:
+            counts = EventPairCounts()
+            for chapter_chains in util.iter_pickle_shard_appends(shard_filename):
+                counts.consume_chapter(chapter_chains)
+            counts.merge(other_counts)
+            pmi = pmi_matrix(counts.get_matrix())
+    '''
+
+    def __init__(self, is_dp_chains=True, with_clusters=True, window=default_window, max_pending_pairs=default_max_pending_pairs):
+        if window is not None and window < 1:
+            raise ValueError('window must be at least 1, or None to pair every two events, not %r' % (window,))
+        self.is_dp_chains = is_dp_chains
+        self.with_clusters = with_clusters
+        self.window = window
+        self.max_pending_pairs = max_pending_pairs
+        self.events = vocab.Vocabulary()
+        self.matrix = scipy.sparse.csr_matrix((0, 0), dtype=np.int64)
+        self.pending = []
+        self.num_pending = 0
+
+    def _iter_chains(self, chapter_chains):
+        ## the chains that make one event each, see ChainAggregator.consume()
+        if not self.is_dp_chains:
+            return chapter_chains
+        return (event for chain in chapter_chains if chain != '<none>' for event in chain)
+
+    def consume_chapter(self, chapter_chains):
+        '''
+            Input: the chains of one chapter, as one of the four lists of a hp_narrative_chains.iter_hpff_chapter_chains() record
+        '''
+        entity_events = {}
+        for chain in self._iter_chains(chapter_chains):
+            entity = chain_aggregator.get_entity(chain, self.is_dp_chains)
+            if self.with_clusters and not entity.startswith('COREF_CLUSTER'):
+                continue
+            event = chain_aggregator.get_event(chain, self.is_dp_chains)
+            if event is not None:
+                entity_events.setdefault(entity, []).append(self.events.intern(event))
+
+        for event_ids in entity_events.values():
+            if len(event_ids) < 2:
+                continue
+            event_ids = np.array(event_ids, dtype=np.int64)
+            i, j = _pair_indices(len(event_ids), self.window)
+            sources = event_ids[i]
+            targets = event_ids[j]
+            different = sources != targets
+            self.add_pairs(sources[different], targets[different])
+
+    def add_pairs(self, sources, targets):
+        '''
+            Input: int arrays of the event ids of co-occurring events, each pair is counted in both directions
+        '''
+        self.pending.append((sources, targets))
+        self.num_pending += len(sources)
+        if self.num_pending >= self.max_pending_pairs:
+            self.flush()
+
+    def _resize(self):
+        num_events = len(self.events)
+        if self.matrix.shape != (num_events, num_events):
+            self.matrix.resize((num_events, num_events))
+
+    def flush(self):
+        '''
+            Adds the buffered pairs into the matrix
+        '''
+        self._resize()
+        if not self.pending:
+            return
+        sources = np.concatenate([pair[0] for pair in self.pending])
+        targets = np.concatenate([pair[1] for pair in self.pending])
+        self.pending = []
+        self.num_pending = 0
+        num_events = len(self.events)
+        ## duplicate (source, target) entries are summed when converting to csr
+        pairs = scipy.sparse.coo_matrix((np.ones(2 * len(sources), dtype=np.int64), (np.concatenate([sources, targets]), np.concatenate([targets, sources]))),
+                                        shape=(num_events, num_events)).tocsr()
+        self.matrix = self.matrix + pairs
+
+    def get_matrix(self):
+        '''
+            Output: the count matrix with every pair consumed so far
+        '''
+        self.flush()
+        return self.matrix
+
+    def merge(self, other):
+        '''
+            Input: counts of the same kind, over the chapters that come after the ones these counts have seen
+        '''
+        if (other.is_dp_chains, other.with_clusters, other.window) != (self.is_dp_chains, self.with_clusters, self.window):
+            raise ValueError('can only merge event pair counts of the same kind')
+        ## other's event ids in this vocabulary
+        renumber = np.fromiter(map(self.events.intern, other.events.strings), dtype=np.int64, count=len(other.events))
+        coo = other.get_matrix().tocoo()
+        self.flush()
+        num_events = len(self.events)
+        other_matrix = scipy.sparse.coo_matrix((coo.data, (renumber[coo.row], renumber[coo.col])), shape=(num_events, num_events)).tocsr()
+        self.matrix = self.matrix + other_matrix
+
+    def save(self, name):
+        '''
+            Writes the count matrix to outDir + name + '.npz' and the events to name + '.events.json'
+        '''
+        scipy.sparse.save_npz(util.outDir + name + '.npz', self.get_matrix())
+        util.write_json([chain_aggregator.event_to_string(event) for event in self.events.strings], name + '.events.json')
+
+    @classmethod
+    def load(cls, name, is_dp_chains=True, with_clusters=True, window=default_window):
+        counts = cls(is_dp_chains, with_clusters, window)
+        counts.events = vocab.Vocabulary(tuple(event.rsplit('|', 1)) for event in util.load_json(name + '.events.json'))
+        counts.matrix = scipy.sparse.load_npz(util.outDir + name + '.npz').tocsr()
+        return counts
+
+
+def _count_shard_file(args):
+    shard_filename, is_dp_chains, with_clusters, window = args
+    counts = EventPairCounts(is_dp_chains, with_clusters, window)
+    for chapter_chains in util.iter_pickle_shard_appends(shard_filename):
+        counts.consume_chapter(chapter_chains)
+    counts.flush()
+    return counts
+
+def count_pickle_shards(name, is_dp_chains=True, with_clusters=True, window=default_window, num_workers=1):
+    '''
+        Input: the name chains were sharded under by hp_narrative_chains.write_hpff_chain_shards(), and the number of worker processes
+        Output: one EventPairCounts over all of the shards.  Each shard is counted on its own and the partial counts are
+                merged in shard order, so the result is the same for any num_workers.
+    '''
+    jobs = [(shard_filename, is_dp_chains, with_clusters, window) for shard_filename in util.get_shard_filenames(name)]
+    counts = EventPairCounts(is_dp_chains, with_clusters, window)
+    if num_workers <= 1:
+        for partial in map(_count_shard_file, jobs):
+            counts.merge(partial)
+        return counts
+
+    import multiprocessing
+    with multiprocessing.Pool(num_workers) as pool:
+        for partial in pool.imap(_count_shard_file, jobs):
+            counts.merge(partial)
+    return counts
+
+def pmi_matrix(counts, min_count=1, positive=False):
+    '''
+        Input:  a symmetric count matrix from EventPairCounts.get_matrix(), the count a pair needs to get a PMI, and
+                whether to keep only the positive PMIs
+        Output: scipy.sparse.csr_matrix of the same shape, entry [i, j] log(P(i, j) / (P(i) P(j))) with
+                P(i, j) = C(i, j) / sum C and P(i) = sum_j C(i, j) / sum C, for the pairs with a count of at least min_count
+    '''
+    counts = counts.tocsr()
+    total = counts.sum()
+    marginals = np.asarray(counts.sum(axis=1)).ravel().astype(np.float64)
+    coo = counts.tocoo()
+    keep = coo.data >= min_count
+    rows, cols, pair_counts = coo.row[keep], coo.col[keep], coo.data[keep].astype(np.float64)
+    pmi = np.log(pair_counts * total / (marginals[rows] * marginals[cols])) if len(pair_counts) else np.zeros(0)
+    if positive:
+        rows, cols, pmi = rows[pmi > 0], cols[pmi > 0], pmi[pmi > 0]
+    return scipy.sparse.csr_matrix((pmi, (rows, cols)), shape=counts.shape)
+
+
+class ChainScorer(object):
+    '''
+        Ranks the events that could come next in a character's chain by the sum of their PMI with the chain's events
+        (the narrative cloze score of Chambers and Jurafsky).  Only the rows of the chain's events are read.
+
+        Usage:
+            counts = count_pickle_shards('hpff_dp_narrative_chains_with_cluster_nums.txt', num_workers=8)
+            scorer = ChainScorer(counts.events.strings, pmi_matrix(counts.get_matrix()))
+            scorer.rank([('said', 'nsubj'), ('looked', 'nsubj')], k=10)     ## [(('smiled', 'nsubj'), 3.1), ...]
+    '''
+
+    def __init__(self, events, pmi):
+        self.events = list(events)
+        self.event_ids = {event: event_id for event_id, event in enumerate(self.events)}
+        self.pmi = pmi.tocsr()
+
+    def score(self, chain_events):
+        '''
+            Input:  the events of a chain ((verb, dependency) tuples; events never seen are ignored)
+            Output: (candidate event ids, their scores), the candidates being the events that share an entity with
+                    at least one of the chain's events
+        '''
+        chain_ids = [self.event_ids[event] for event in chain_events if event in self.event_ids]
+        rows = self.pmi[chain_ids]
+        candidates = np.unique(rows.indices)
+        scores = np.asarray(rows.sum(axis=0)).ravel()
+        return candidates, scores[candidates]
+
+    def rank(self, chain_events, k=10, exclude_chain=True):
+        '''
+            Output: the k best candidates as [(event, score), ...], best first.  With exclude_chain the chain's own
+                    events are not candidates.
+        '''
+        candidates, scores = self.score(chain_events)
+        if exclude_chain:
+            chain_ids = np.array([self.event_ids[event] for event in chain_events if event in self.event_ids], dtype=np.int64)
+            keep = ~np.isin(candidates, chain_ids)
+            candidates, scores = candidates[keep], scores[keep]
+        if len(candidates) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return [(self.events[event_id], score) for event_id, score in zip(candidates[order].tolist(), scores[order].tolist())]
+
+
+if __name__ == '__main__' :
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Event pair counts, PMI and next event ranking from sharded narrative chains.')
+    parser.add_argument('chains_name', help='the name the chains were sharded under in util.outDir, e.g. hpff_dp_narrative_chains_with_cluster_nums.txt')
+    parser.add_argument('--sr', action='store_true', help='the chains are sem role chains (default: dep parse chains)')
+    parser.add_argument('--NNPs', action='store_true', help='count the events of every entity, not only of coref clusters')
+    parser.add_argument('--window', type=int, default=default_window, help='only pair events at most this far apart in an entity\'s events of a chapter (0 pairs every two events)')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes that count shards')
+    parser.add_argument('--min-count', type=int, default=1, help='count a pair needs to get a PMI')
+    parser.add_argument('--positive', action='store_true', help='keep only the positive PMIs')
+    parser.add_argument('--save', help='write the counts (NAME.npz, NAME.events.json) and the PMI matrix (NAME.pmi.npz) to the out dir')
+    parser.add_argument('--rank', help='comma separated verb|dependency events of a chain to rank the next events for')
+    parser.add_argument('--top', type=int, default=10, help='number of ranked events to print')
+    args = parser.parse_args()
+
+    counts = count_pickle_shards(args.chains_name, not args.sr, not args.NNPs, args.window or None, args.workers)
+    matrix = counts.get_matrix()
+    pmi = pmi_matrix(matrix, args.min_count, args.positive)
+    print('%d events, %d event pairs, %d with a PMI' % (len(counts.events), matrix.nnz // 2, pmi.nnz // 2))
+    if args.save:
+        counts.save(args.save)
+        scipy.sparse.save_npz(util.outDir + args.save + '.pmi.npz', pmi)
+    if args.rank:
+        scorer = ChainScorer(counts.events.strings, pmi)
+        for event, score in scorer.rank([tuple(event.rsplit('|', 1)) for event in args.rank.split(',')], args.top):
+            print('%8.3f  %s' % (score, chain_aggregator.event_to_string(event)))
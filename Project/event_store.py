@@ -0,0 +1,240 @@
+'''
+	event_store.py
+
+	Objective: Columnar storage for the narrative events extracted by hp_narrative_chains.py, so the analysis notebooks can
+	           load the whole corpus of events in seconds instead of unpickling nested tuples or parsing json.
+
+	           Each of the four chain lists is a table.  A table is a directory of append-only column files, one raw
+	           int32/int64 array per column, read back with np.memmap (no parsing, no copies).  Words, dependency labels /
+	           SRL tags, and chapter keys are interned (a vocab.Vocabulary each): the columns hold ids into three append-only
+	           string lists (one json encoded string per line).  Every event row carries its story number, chapter and chain number, so
+	           the chains can be regrouped exactly as they were extracted.
+
+	           dp tables:  one row per event tuple ((i, f, g), (word, dep), (father word, dep), (grandfather word, dep))
+	           sr tables:  one row per (tag, word) pair of a chain
+
+	Methods:	EventStoreWriter(directory, resume_state=None)
+				EventStore(directory)
+
+	Usage:	store = event_store.EventStore('out/hpff_events')
+			sr = store.table('sr_NNPs')                      ## dict of column name -> memmapped array
+			harry = store.words.index('Harry')
+			verbs = sr['word'][(sr['tag'] == store.tags.index('B-V'))]
+			for chain in store.iter_chains('sr_NNPs'): ...   ## the same chains util.iter_pickle_shards() gives
+'''
+
+import json
+import os
+from array import array
+
+import numpy as np
+
+import vocab
+
+dp_columns = [('story', 'i'), ('chapter', 'i'), ('chain', 'q'),
+              ('entity_position', 'i'), ('father_position', 'i'), ('grandfather_position', 'i'),
+              ('entity_word', 'i'), ('father_word', 'i'), ('grandfather_word', 'i'),
+              ('entity_dep', 'i'), ('father_dep', 'i'), ('grandfather_dep', 'i')]
+sr_columns = [('story', 'i'), ('chapter', 'i'), ('chain', 'q'), ('tag', 'i'), ('word', 'i')]
+
+## tables in the order of the four chain lists of a chapter record from hp_narrative_chains.iter_hpff_chapter_chains()
+tables = [('dp_cluster_nums', dp_columns),
+          ('dp_NNPs', dp_columns),
+          ('sr_cluster_nums', sr_columns),
+          ('sr_NNPs', sr_columns)]
+
+vocabularies = ['words', 'tags', 'chapters']
+
+numpy_dtypes = {'i': np.int32, 'q': np.int64}
+
+
+def _column_filename(directory, table_name, column):
+    return os.path.join(directory, '%s.%s.bin' % (table_name, column))
+
+def _vocabulary_filename(directory, vocabulary):
+    return os.path.join(directory, '%s.txt' % (vocabulary))
+
+def _read_vocabulary(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename, 'r', encoding='utf-8') as fin:
+        return [json.loads(line) for line in fin]
+
+
+class EventStoreWriter(object):
+    '''
+        Appends the chains of each chapter to the tables of an event store.  Every file is append-only, so the state
+        from get_state() (the size of every file) is enough to cut a store back to a checkpoint and continue: pass it as resume_state.
+
+        Usage:
+            with EventStoreWriter('out/hpff_events') as writer:
+                for record in hp_narrative_chains.iter_hpff_chapter_chains(filename):
+                    writer.add_chapter(*record)
+    '''
+
+    def __init__(self, directory, resume_state=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        for filename in self._filenames():
+            if resume_state is None:
+                open(filename, 'wb').close()
+                continue
+            ## sizes are keyed by the name of the file in the store, so the store can be resumed under another path
+            checkpointed = resume_state['sizes'].get(os.path.basename(filename))
+            size = os.path.getsize(filename) if os.path.exists(filename) else 0
+            if checkpointed is None or checkpointed > size:
+                raise ValueError('%s is %d bytes, the checkpoint has %s for it: it was written for another event store' % (filename, size, checkpointed))
+            if os.path.exists(filename):
+                os.truncate(filename, checkpointed)
+
+        self.vocabularies = {}
+        self.fouts = {}
+        for vocabulary in vocabularies:
+            self.vocabularies[vocabulary] = vocab.Vocabulary(_read_vocabulary(_vocabulary_filename(directory, vocabulary)))
+            self.fouts[vocabulary] = open(_vocabulary_filename(directory, vocabulary), 'a', encoding='utf-8')
+        for table_name, columns in tables:
+            for column, typecode in columns:
+                self.fouts[(table_name, column)] = open(_column_filename(directory, table_name, column), 'ab')
+        self.next_chain = dict(resume_state['next_chain']) if resume_state is not None else {table_name: 0 for table_name, columns in tables}
+
+    def _filenames(self):
+        filenames = [_vocabulary_filename(self.directory, vocabulary) for vocabulary in vocabularies]
+        for table_name, columns in tables:
+            filenames.extend(_column_filename(self.directory, table_name, column) for column, typecode in columns)
+        return filenames
+
+    def intern(self, vocabulary, string):
+        strings = self.vocabularies[vocabulary]
+        string_id = strings.ids.get(string)
+        if string_id is None:
+            string_id = strings.intern(string)
+            self.fouts[vocabulary].write(json.dumps(string) + '\n')
+        return string_id
+
+    def _write_columns(self, table_name, buffers):
+        for column, values in buffers.items():
+            values.tofile(self.fouts[(table_name, column)])
+
+    def add_dp_chains(self, table_name, story, chapter, chapter_chains):
+        '''
+            Input: the table, the story number and chapter key, and the chapter's dep parse chains (as get_narrative_chains_from_dep_parsing() returns them)
+        '''
+        buffers = {column: array(typecode) for column, typecode in dp_columns}
+        chapter_id = self.intern('chapters', chapter)
+        for chain in chapter_chains:
+            if chain == '<none>':
+                continue
+            chain_id = self.next_chain[table_name]
+            self.next_chain[table_name] += 1
+            for (positions, entity, father, grandfather) in chain:
+                buffers['story'].append(story)
+                buffers['chapter'].append(chapter_id)
+                buffers['chain'].append(chain_id)
+                buffers['entity_position'].append(positions[0])
+                buffers['father_position'].append(positions[1])
+                buffers['grandfather_position'].append(positions[2])
+                buffers['entity_word'].append(self.intern('words', entity[0]))
+                buffers['father_word'].append(self.intern('words', father[0]))
+                buffers['grandfather_word'].append(self.intern('words', grandfather[0]))
+                buffers['entity_dep'].append(self.intern('tags', entity[1]))
+                buffers['father_dep'].append(self.intern('tags', father[1]))
+                buffers['grandfather_dep'].append(self.intern('tags', grandfather[1]))
+        self._write_columns(table_name, buffers)
+
+    def add_sr_chains(self, table_name, story, chapter, chapter_chains):
+        '''
+            Input: the table, the story number and chapter key, and the chapter's sem role chains (as get_narrative_chains_from_sem_roles() returns them)
+        '''
+        buffers = {column: array(typecode) for column, typecode in sr_columns}
+        chapter_id = self.intern('chapters', chapter)
+        for chain in chapter_chains:
+            chain_id = self.next_chain[table_name]
+            self.next_chain[table_name] += 1
+            for tag, word in chain:
+                buffers['story'].append(story)
+                buffers['chapter'].append(chapter_id)
+                buffers['chain'].append(chain_id)
+                buffers['tag'].append(self.intern('tags', tag))
+                buffers['word'].append(self.intern('words', word))
+        self._write_columns(table_name, buffers)
+
+    def add_chapter(self, story, chapter, dp_chains_with_cluster_nums, dp_chains_with_NNPs, sr_chains_with_cluster_nums, sr_chains_with_NNPs):
+        '''
+            Input: a chapter record, as yielded by hp_narrative_chains.iter_hpff_chapter_chains()
+        '''
+        self.add_dp_chains('dp_cluster_nums', story, chapter, dp_chains_with_cluster_nums)
+        self.add_dp_chains('dp_NNPs', story, chapter, dp_chains_with_NNPs)
+        self.add_sr_chains('sr_cluster_nums', story, chapter, sr_chains_with_cluster_nums)
+        self.add_sr_chains('sr_NNPs', story, chapter, sr_chains_with_NNPs)
+
+    def get_state(self):
+        '''
+            Flushes every file and returns {'sizes', 'next_chain'} (sizes by file name in the directory), the point a resumed writer cuts the store back to
+        '''
+        for fout in self.fouts.values():
+            fout.flush()
+            os.fsync(fout.fileno())
+        return {'sizes': {os.path.basename(filename): os.path.getsize(filename) for filename in self._filenames()},
+                'next_chain': dict(self.next_chain)}
+
+    def close(self):
+        for fout in self.fouts.values():
+            fout.close()
+        self.fouts = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class EventStore(object):
+    '''
+        Read side of an event store.  Columns are memory mapped, so opening a store costs the same for any corpus size.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.words = _read_vocabulary(_vocabulary_filename(directory, 'words'))
+        self.tags = _read_vocabulary(_vocabulary_filename(directory, 'tags'))
+        self.chapters = _read_vocabulary(_vocabulary_filename(directory, 'chapters'))
+
+    def column(self, table_name, column):
+        typecode = dict(dict(tables)[table_name])[column]
+        filename = _column_filename(self.directory, table_name, column)
+        if os.path.getsize(filename) == 0:
+            return np.empty(0, dtype=numpy_dtypes[typecode])
+        return np.memmap(filename, dtype=numpy_dtypes[typecode], mode='r')
+
+    def table(self, table_name):
+        '''
+            Output: dict of column name -> memmapped array for every column of the table
+        '''
+        return {column: self.column(table_name, column) for column, typecode in dict(tables)[table_name]}
+
+    def iter_chains(self, table_name, chains_per_batch=10000):
+        '''
+            Output: yields the chains of the table as the same tuples and lists they were extracted as, in order.
+                    Chapters without dep parse events (the '<none>' placeholders) have no rows, so they aren't yielded.
+                    Rows are turned back into strings chains_per_batch chains at a time.
+        '''
+        columns = self.table(table_name)
+        chain_ids = columns['chain']
+        if len(chain_ids) == 0:
+            return
+        chain_starts = np.concatenate(([0], np.flatnonzero(np.diff(chain_ids)) + 1, [len(chain_ids)])).tolist()
+        words, tags = self.words, self.tags
+        is_dp = table_name.startswith('dp')
+        row_columns = [column for column, typecode in dp_columns[3:]] if is_dp else ['tag', 'word']
+
+        for batch_start in range(0, len(chain_starts) - 1, chains_per_batch):
+            bounds = chain_starts[batch_start:batch_start + chains_per_batch + 1]
+            first_row = bounds[0]
+            rows = list(zip(*[columns[column][first_row:bounds[-1]].tolist() for column in row_columns]))
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                if is_dp:
+                    yield [((i, f, g), (words[w], tags[d]), (words[fw], tags[fd]), (words[gw], tags[gd]))
+                           for (i, f, g, w, fw, gw, d, fd, gd) in rows[start - first_row:end - first_row]]
+                else:
+                    yield [(tags[tag], words[word]) for tag, word in rows[start - first_row:end - first_row]]
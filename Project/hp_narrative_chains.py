@@ -6,27 +6,34 @@
 	Inspiration:	Chambers and Jurafsky, 2008 -  Unsupervised learning of Narrative Event Chains{https://www.aclweb.org/anthology/P08-1090.pdf}
 					Chambers and jurafsky, 2009 - Unsupervised Learning of Narrative Schemas and their Participants{https://www.aclweb.org/anthology/P09-1068.pdf}
 
-	Methods:	get_word_to_sentence_mapping_locations(dependency_parses, chapter_num, story)
-				get_corrected_indices(orig_doc, coref_doc)
-                get_cluster_num_to_NNP_map(clusters, coref_doc)
-                get_sentences_replaced_with_clusters(original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, clusters, coref_document)
-				get_narrative_chains_from_dep_parsing(dependency_parses, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs)
-				get_narrative_chains_from_sem_roles(semantic_roles, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs)
-                run_hpff_chains(filename)
-                hpff_analysis(narrative_chains, is_dp_chains=True, with_clusters=True)
+	Methods:	get_word_to_sentence_mapping_locations(dependency_parses, chapter_num, story, vocabulary=None)
+				get_corrected_indices(orig_doc, coref_doc, vocabulary=None)
+                get_cluster_num_to_NNP_map(clusters, coref_doc, tagger=None)
+                replace_cluster_spans(original_document, original_sentences, sentence_starting_positions, clusters, corrected_indices, cluster_num_to_NNP_map, vocabulary=None)
+                get_sentences_replaced_with_clusters(original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, clusters, coref_document, vocabulary=None)
+				get_narrative_chains_from_dep_parsing(dependency_parses, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs, target_tags=batch_extract.default_dp_relations, all_sentences=False)
+				get_narrative_chains_from_sem_roles(semantic_roles, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs, target_tags=batch_extract.default_srl_tags, all_sentences=False)
+                get_chapter_narrative_chains(idx, story, chapter)
+                get_story_narrative_chains(idx, line, json_backend='auto', lazy_json=False)
+                get_worker_settings()
+                imap_stories(lines, num_workers=1, max_pending=None, json_backend='auto', lazy_json=False)
+                iter_hpff_chapter_chains(filename, num_workers=1, start_story=0, story_ids=None, json_backend='auto', lazy_json=False, prefetch=True)
+                run_hpff_chains(filename, num_workers=1, story_ids=None, json_backend='auto', lazy_json=False, prefetch=True)
+                write_hpff_chain_shards(filename, num_workers=1, max_shard_bytes=util.default_max_shard_bytes, checkpoint_every=100, resume=False, story_ids=None, json_backend='auto', lazy_json=False, event_store_dir=None, prefetch=True)
+                hpff_analysis(narrative_chains, is_dp_chains=True, with_clusters=True, counts_only=False)
 
     Folders:    code/
                 data/
                 out/
                 vectors/
 
-    Usage:  python hp_narrative_schemas.py <HPFF_FILENAME> <HPCANON_FILENAME>
-    Example:python hp_narrative_schemas.py HPFF-small.json HPCanon-full.json	
+    Usage:  python hp_narrative_schemas.py <HPFF_FILENAME> <HPCANON_FILENAME> [--workers N] [--max-shard-bytes BYTES] [--checkpoint-every N] [--resume] [--stories START:END] [--json-backend BACKEND] [--lazy-json] [--event-store DIR] [--counts-only] [--no-prefetch] [--dp-relations LABELS] [--dp-all-sentences] [--sr-spans] [--sr-roles ROLES] [--sr-all-sentences] [--out-dir DIR] [--compress gzip|zstd] [--stats-every SECONDS] [--stats FILE] [--profile FILE] [--profile-sampler]
+    Example:python hp_narrative_schemas.py HPFF-small.json HPCanon-full.json --workers 8	
 
-    Output files:   'hpff_dp_narrative_chains_with_cluster_nums.txt'
-                    'hpff_dp_narrative_chains_with_NNPs.txt'
-                    'hpff_sr_narrative_chains_with_cluster_nums.txt'
-                    'hpff_sr_narrative_chains_with_NNPs.txt'
+    Output files:   'hpff_dp_narrative_chains_with_cluster_nums.txt.00000', ...  (append-only pickle shards, see util.iter_pickle_shards)
+                    'hpff_dp_narrative_chains_with_NNPs.txt.00000', ...
+                    'hpff_sr_narrative_chains_with_cluster_nums.txt.00000', ...
+                    'hpff_sr_narrative_chains_with_NNPs.txt.00000', ...
                     'hpff_dp_narrative_chains_counts_clusters.txt'
                     'hpff_dp_narrative_chains_counts_NNPs.txt'
                     'hpff_sr_narrative_chains_counts_clusters.txt'
@@ -35,54 +42,49 @@
 
 import collections
 from collections import *
+import contextlib
 import json
 import os, sys
 import codecs
 import pickle as pkl
-import nltk 
-nltk.download('punkt')
-nltk.download('averaged_perceptron_tagger')
-from nltk.corpus import stopwords 
-from nltk.tokenize import word_tokenize, sent_tokenize 
-stop_words = set(stopwords.words('english'))
-
+import numpy as np
+## nltk is only imported where it is used (the POS tagger in mention_tagger.py), and its data is downloaded once
+## with util.provision_nltk_data() rather than at import, so worker processes start quickly
 import util
+import alignment
+import mention_tagger
+import hpff_reader
+import hpff_json
+import event_store
+import chain_aggregator
+import instrumentation
+import vocab
+import batch_extract
 # import analyze_HPFF
 # import NLP_analysis
 
 baseDir = '/Users/rebeccaflores/Documents/GitHub/IFaTG/Final_Project/data/'
 
-def get_word_to_sentence_mapping_locations(dependency_parses, chapter_num, story):
+## chain files written by write_hpff_chain_shards(), in the order of the four chain lists
+hpff_chain_files = ['hpff_dp_narrative_chains_with_cluster_nums.txt',
+                    'hpff_dp_narrative_chains_with_NNPs.txt',
+                    'hpff_sr_narrative_chains_with_cluster_nums.txt',
+                    'hpff_sr_narrative_chains_with_NNPs.txt']
+## progress of write_hpff_chain_shards(), used to resume a run that was stopped partway
+hpff_chain_checkpoint = 'hpff_narrative_chains.checkpoint.json'
+
+def get_word_to_sentence_mapping_locations(dependency_parses, chapter_num, story, vocabulary=None):
     '''
-        Input: Dependency Parses for each chapter.  Dependency parses are done at the sentence level
-        Return: original_document - chapter level tokenized words for the document from the dependency parser
-                original_sentence - the original sentence level tokenized words (a list of list, where each list in the tokenized sentence out of a chapter)
-                words_to_sentence_locations - all the words are mapped to an index of the sentence it's located in
-                sentence_starting_positions - maps to the index of the word of where each sentence starts
+        Input: Dependency Parses for each chapter.  Dependency parses are done at the sentence level.  Words are interned
+               into vocabulary (default: vocab.get_default_vocabulary()), see alignment.get_word_to_sentence_arrays().
+        Return: original_document - chapter level tokenized words for the document from the dependency parser (int32 array of word ids)
+                original_sentence - the original sentence level tokenized words (a list of word id arrays, one per sentence of the chapter)
+                words_to_sentence_locations - all the words are mapped to an index of the sentence it's located in (int array)
+                sentence_starting_positions - maps to the index of the word of where each sentence starts (int array)
                 Returning a chapter level dependency parse to use for coreference resolution and word to sentence mappings
     '''
 
-    original_document = []
-    original_sentences = []
-    # compute the word offsets for each sentence.
-    word_offset = 0
-    # record what sentence each word is in
-    words_to_sentence_locations = [] 
-    sentence_starting_positions = []
-    for sent_num, dep_parse in enumerate(dependency_parses):
-        dep_parse['word_offset'] = word_offset
-        words = dep_parse['words']
-        sentence_starting_positions.append(word_offset)
-        word_offset += len(words) 
-        original_sentences.append(words)
-        for i in range(len(words)):
-            words_to_sentence_locations.append(sent_num)
-            original_document.append(words[i]) ## appending sentence level words as if it were appended at the chapter level
-        # print('sentence_starting_positions: ', sentence_starting_positions)
-        # print('word_offset: ', word_offset)
-        # print('original_sentences: ', original_sentences)
-        # print('words_to_sentence_locations: ', words_to_sentence_locations)
-        # print('original_document: ', original_document)
+    original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions = alignment.get_word_to_sentence_arrays(dependency_parses, vocabulary)
     story['chapters'][chapter_num]['words_to_sentence_locations'] = words_to_sentence_locations
 
     return original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, story
@@ -99,67 +101,47 @@ def get_word_to_sentence_mapping_locations(dependency_parses, chapter_num, story
     to match where it actually should be replaced at the sentence level.
 '''
 
-def get_corrected_indices(orig_doc, coref_doc):
+def get_corrected_indices(orig_doc, coref_doc, vocabulary=None):
     '''
-        Input: orig_doc, coref doc
+        Input: orig_doc (word ids), coref doc (strings), and the vocabulary of the word ids
         Output: For every Chapter, coref_document (at the chapter level) is corrected to adapt to the sentence level, so mentions can
                 be replaced correctly in the original dep parse sentence level document.  You need sentence level replacement of the cluster
                 mention because it needs to correspond to other tools from dep parse that are also done at the sentence level.
+                The offsets are worked out with alignment.get_corrected_index_array() and returned as a list, since they are
+                looked up one span at a time.  Words that don't line up are reported together once per chapter.
     '''
 
-    j = 0
-    corrected_indices = []
-    for i in range(len(coref_doc)):
-        corrected_indices.append(j-i)
-        if coref_doc[i].strip() != '':
-    #    print("'%s', '%s'" % (original_doc[j].strip(), coref_doc[i].strip()))
-            if orig_doc[j] != coref_doc[i]:
-                print('\n\n')
-                print('problematic words: ', orig_doc[j], coref_doc[i] )
-                print('*************')
-                print("Mismatch starting at ", i)
-                print(orig_doc[j+1], coref_doc[i+1])
-                print('*************')
-                print('\n\n')
-                # break
-            j += 1
-
-    return corrected_indices
-
-def get_cluster_num_to_NNP_map(clusters, coref_doc):
+    corrected_indices, mismatches = alignment.get_corrected_index_array(orig_doc, coref_doc, vocabulary)
+    alignment.report_mismatches(mismatches)
+
+    return corrected_indices.tolist()
+
+def get_cluster_num_to_NNP_map(clusters, coref_doc, tagger=None):
     '''
         Input: the clusters and its associated coref_document for the chapter.  
                Each iterations through the story chapters has a new cluster to proper noun map.  This index map will be used to resolve the 
                nodes later on for event sequencing in get_narrative_chains_from_dep_parsing() and get_narrative_chains_from_sem_roles().  But
                first they correct prounoun for that cluster needs to be replaced at each mention in the document in get_sentences_replaced_with_clusters().
+               The mentions of every cluster are tagged together through tagger, a mention_tagger.MentionTagger (default: the
+               one shared by the process), which caches the tag of every mention it has seen.
         Output: An index map where the key is the cluster num and the value is it's associated proper noun
     '''
-    
-    document = []
-    for i in range(len(coref_doc)):
-        document.extend([coref_doc[i].strip()])
 
-    cluster_num_to_NNP_dict = defaultdict(lambda:[])
+    if tagger is None:
+        tagger = mention_tagger.get_default_tagger()
+
+    document = [word.strip() for word in coref_doc]
+
     filtered_cluster_num_to_NNP_dict = defaultdict()
     target_tags = ['NNP', 'NN','NNS', 'VB', 'VBD', 'VBP', 'PRP$', 'PRP']
 
-    for cluster_num, cluster in enumerate(clusters):
-        mentions = []
-        for [i, j] in cluster:
-            #print(i, '\t', j, '\t', " ".join(document[i:j+1]))
-            mention = " ".join(document[i:j+1])
-            mentions.append(mention)
-        # print(cluster_num, ":", ", ".join(mentions))
-        cluster_num_to_NNP_dict[cluster_num].extend(mentions)
+    cluster_mentions = []
+    for cluster in clusters:
+        mentions = [" ".join(document[i:j+1]) for [i, j] in cluster]
+        cluster_mentions.append([x for x in mentions if x != '' and x != ' '])
 
-    # print('this is the dict after the first pass')
-    # for key, val in cluster_num_to_NNP_dict.items():
-    #     print(key, '\t', val)
+    for cluster, tagged in enumerate(tagger.tag_clusters(cluster_mentions)):
 
-    for cluster, mentions in cluster_num_to_NNP_dict.items():
-
-        filtered_mentions = [x for x in mentions if x != '' and x != ' ']
-        tagged = nltk.pos_tag(filtered_mentions)
         names = [x for (x,y) in tagged]
         pos_tags = [y for (x,y) in tagged]
         matches = [i for i in range(len(pos_tags)) if pos_tags[i] in target_tags]
@@ -189,90 +171,90 @@ def get_cluster_num_to_NNP_map(clusters, coref_doc):
 
             filtered_cluster_num_to_NNP_dict[cluster] = "COREF_CLUSTER_" + str(cluster)
 
-    # print('This is the final dictionary map on line 193:')
-    # for key,val in filtered_cluster_num_to_NNP_dict.items():
-    #     print(key, '\t', val)
     return filtered_cluster_num_to_NNP_dict
 
-def get_sentences_replaced_with_clusters(original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, clusters, coref_document):
+def replace_cluster_spans(original_document, original_sentences, sentence_starting_positions, clusters, corrected_indices, cluster_num_to_NNP_map, vocabulary=None):
     '''
-        Input: original_document, original_sentences, words to sentence mappings, sentence starting positions, clusters, coref_document
-        Output: Find where the coref_doc is inconsistent (sometimes they add extra spaces in the tokenization of the document)
-                Correct the indices from the coref_document to match the correct-indices from the original document (from dependency parsing)
-                Then, that's mapped to the words_to_sentence locations to replace the clusters at the sentence level
-                Cluster references replace the characters they refer to at the sentence level
+        Input: the chapter level word ids, the sentence level word ids, where each sentence starts in the chapter, the clusters,
+               the corrected indices from get_corrected_indices(), the cluster num to NNP map from get_cluster_num_to_NNP_map()
+               and the vocabulary of the word ids (default: vocab.get_default_vocabulary())
+        Output: the sentences and the document with every cluster mention replaced, once with "COREF_CLUSTER_<num>" and once with
+                the cluster's NNP.  Which cluster a word is replaced with is worked out once per chapter in a label array, and
+                the cluster ids are written with one array assignment per document.  The documents are returned as word id
+                arrays.  The sentences are lists of the vocabulary's strings (the extraction reads them one word at a time),
+                sliced out of the document decoded once, so a word is one string object in all the chains.
     '''
-    # print('\n\n')
-    # print('*************')
-    # print('this is what the clusters look like: ')
-    # for cluster in clusters:
-    #     print(cluster)
-    # print('len of coref document: ', len(coref_document))
-    # print('example of whole coref document: ', coref_document)
-    # print('*************')
-    # print('\n\n')
-    import copy
-
-    corrected_indices = get_corrected_indices(original_document, coref_document)
-    cluster_num_to_NNP_map = get_cluster_num_to_NNP_map(clusters, coref_document)
-
-    doc_replaced_with_cluster_nums = copy.deepcopy(original_document) ## tokenized words created from the sentence level tokens appended into chapter level tokens
-    doc_replaced_with_NNPs = copy.deepcopy(original_document)
-    sentences_replaced_with_cluster_nums = copy.deepcopy(original_sentences) ## original sentence level lists of the chapter, tokenized words created from the sentence level tokens appended into chapter level tokens
-    sentences_replaced_with_NNPs = copy.deepcopy(original_sentences)
-
-    corrected_spans = []
-    for cluster_num, cluster in enumerate(clusters):
 
-        possible_entities = cluster_num_to_NNP_map[cluster_num]
+    if vocabulary is None:
+        vocabulary = vocab.get_default_vocabulary()
 
-        
-        ## for every span in the cluster
+    ## the cluster each word of the chapter is replaced with, -1 if it isn't.  Spans are written in the same order as
+    ## they used to be replaced in place, so a word in more than one span still ends up with the last cluster
+    num_words = len(original_document)
+    labels = np.full(num_words, -1, dtype=np.int32)
+    for cluster_num, cluster in enumerate(clusters):
         for [i, j] in cluster:
-
             corrected_i = i + corrected_indices[i]
             corrected_j = j + corrected_indices[j]
+            if corrected_j >= num_words:
+                raise IndexError('list assignment index out of range')
+            if corrected_j >= corrected_i:
+                labels[corrected_i:corrected_j+1] = cluster_num
+
+    cluster_ids = vocabulary.encode(["COREF_CLUSTER_" + str(cluster_num) for cluster_num in range(len(clusters))])
+    NNP_ids = vocabulary.encode([cluster_num_to_NNP_map[cluster_num] for cluster_num in range(len(clusters))])
+
+    replaced = np.flatnonzero(labels >= 0)
+    replaced_labels = labels[replaced]
+    doc_replaced_with_cluster_nums = np.array(original_document, dtype=vocab.id_dtype)
+    doc_replaced_with_cluster_nums[replaced] = cluster_ids[replaced_labels]
+    doc_replaced_with_NNPs = np.array(original_document, dtype=vocab.id_dtype)
+    doc_replaced_with_NNPs[replaced] = NNP_ids[replaced_labels]
+
+    words_with_cluster_nums = vocabulary.decode(doc_replaced_with_cluster_nums)
+    words_with_NNPs = vocabulary.decode(doc_replaced_with_NNPs)
+    sentences_replaced_with_cluster_nums = []
+    sentences_replaced_with_NNPs = []
+    for start, sentence in zip(sentence_starting_positions.tolist(), original_sentences):
+        sentences_replaced_with_cluster_nums.append(words_with_cluster_nums[start:start + len(sentence)])
+        sentences_replaced_with_NNPs.append(words_with_NNPs[start:start + len(sentence)])
 
-            ## where the actual clusters should be replaced in the coref document
-            corrected_spans.append([corrected_i, corrected_j])
-
-            for position_in_doc in range(corrected_i, corrected_j+1):
-
-
-                ## document level replacements in you need
-                doc_replaced_with_cluster_nums[position_in_doc] =  "COREF_CLUSTER_" + str(cluster_num)
-                doc_replaced_with_NNPs[position_in_doc] = cluster_num_to_NNP_map[cluster_num]
-
-                # Below is the sentence level replacements and the logic explained at each step
-                '''
-                    1. Get the sentence position of the span we're on [i,j]
-                    2. Retrieve the actual sentence from the deepcopy of the original sentences
-                    3. Get the word position from the sentence position of the span we're on
-                    4. Replace that span in the sentence (in this case, all words associated in that span) with the cluster we're on
-                '''
-
-                curr_sentence_location_of_this_word = words_to_sentence_locations[position_in_doc]
-
-                sentence_with_clusters = sentences_replaced_with_cluster_nums[curr_sentence_location_of_this_word] ## sentence level replacements
-                sentence_with_NNPs = sentences_replaced_with_NNPs[curr_sentence_location_of_this_word] ## sentence level replacements
-
-                position_of_word_in_the_sentence = position_in_doc - sentence_starting_positions[curr_sentence_location_of_this_word]
+    return sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs, doc_replaced_with_cluster_nums, doc_replaced_with_NNPs
 
-                sentence_with_clusters[position_of_word_in_the_sentence] = "COREF_CLUSTER_" + str(cluster_num)
-                sentence_with_NNPs[position_of_word_in_the_sentence] = cluster_num_to_NNP_map[cluster_num]
+def get_sentences_replaced_with_clusters(original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, clusters, coref_document, vocabulary=None):
+    '''
+        Input: original_document, original_sentences (word ids), words to sentence mappings, sentence starting positions, clusters, coref_document,
+               and the vocabulary of the word ids
+        Output: Find where the coref_doc is inconsistent (sometimes they add extra spaces in the tokenization of the document)
+                Correct the indices from the coref_document to match the correct-indices from the original document (from dependency parsing)
+                Then, that's mapped to the words_to_sentence locations to replace the clusters at the sentence level
+                Cluster references replace the characters they refer to at the sentence level
+    '''
 
+    stats = instrumentation.get_stats()
+    with stats.stage('index_correction') as stage:
+        corrected_indices = get_corrected_indices(original_document, coref_document, vocabulary)
+        stage.tokens = len(coref_document)
+    with stats.stage('cluster_naming') as stage:
+        cluster_num_to_NNP_map = get_cluster_num_to_NNP_map(clusters, coref_document)
+        stage.tokens = sum(len(cluster) for cluster in clusters)
+    with stats.stage('span_replacement') as stage:
+        replaced = replace_cluster_spans(original_document, original_sentences, sentence_starting_positions, clusters, corrected_indices, cluster_num_to_NNP_map, vocabulary)
+        stage.tokens = len(original_document)
 
-    return sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs, doc_replaced_with_cluster_nums, doc_replaced_with_NNPs
+    return replaced
 
-def get_narrative_chains_from_dep_parsing(dependency_parses, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs):
+def get_narrative_chains_from_dep_parsing(dependency_parses, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs, target_tags=batch_extract.default_dp_relations, all_sentences=False):
     '''
-        Input: dependency_parses and sentences_replaced_with_cluster_nums from coref resolution.  
-        Return: Event extraction for this chapter
+        Input: dependency_parses and sentences_replaced_with_cluster_nums from coref resolution, the dependency labels that
+               make an event, and whether to keep the events of every sentence instead of only the last sentence's
+        Return: Event extraction for this chapter.  This is the sentence by sentence version of
+                batch_extract.DependencyExtractor, used for the chapters it can't lay out in arrays.
     ''' 
 
     narrative_chains_with_clusters = []
     narrative_chains_with_NNPs = []
-    target_tags = ['nn','nsubj', 'nsubjpass','amod', 'advcl','poss', 'conj', 'dobj'] ##['nn''nsubj', 'poss','admod', 'advcl'] maybe take out 'root' later
+    ##['nn''nsubj', 'poss','admod', 'advcl'] maybe take out 'root' later
     # problematic_sents = ["\"ME??!!", "\"No!", "\"NO!", "-Flashback-"]
     # words = []
 
@@ -327,8 +309,12 @@ def get_narrative_chains_from_dep_parsing(dependency_parses, sentences_replaced_
             # print('1) no entities to resolve!')
             continue
 
+        if all_sentences:
+            narrative_chains_with_clusters.append(curr_chain_with_clusters)
+            narrative_chains_with_NNPs.append(curr_chain_with_NNPs)
+
     # print('2) curr_chain_with_clusters: \t', curr_chain_with_clusters)
-    if curr_chain_with_clusters:
+    if not all_sentences and curr_chain_with_clusters:
         narrative_chains_with_clusters.append(curr_chain_with_clusters)
         narrative_chains_with_NNPs.append(curr_chain_with_NNPs)
 
@@ -345,22 +331,25 @@ def get_narrative_chains_from_dep_parsing(dependency_parses, sentences_replaced_
 #for i, word in enumerate(original_document):
 #  print(word, '\t', doc_replaced_with_cluster_nums[i])
 
-def get_narrative_chains_from_sem_roles(semantic_roles, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs):
+def get_narrative_chains_from_sem_roles(semantic_roles, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs, target_tags=batch_extract.default_srl_tags, all_sentences=False):
     '''
-        Input: semantic_roles from nlp analysis and sentences_replaced_with_cluster_nums from coref resolution
-        output: return semantic roles for this chapter
+        Input: semantic_roles from nlp analysis and sentences_replaced_with_cluster_nums from coref resolution, the tags
+               whose words are kept, and whether to keep the chains of every sentence instead of only the last sentence's
+        output: return semantic roles for this chapter.  This is the tag by tag version of batch_extract.SemanticRoleExtractor.
     ''' 
 
+    narrative_chains_with_clusters = []
+    narrative_chains_with_NNPs = []
     for sentence, curr_sent_with_clusters, curr_sent_with_NNPs in zip(semantic_roles, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs):
         verbs = sentence['verbs']
         mod_words = curr_sent_with_clusters ## semantic_roles['words']
         orig_words = curr_sent_with_NNPs
         # print('verbs: ', verbs)
         # print('mod_words: ', mod_words)
-        target_tags = ['B-ARG0', 'B-V', 'B-ARG1','ARGM-GOL'] ## 'I-ARG1', 
 
-        narrative_chains_with_clusters = []
-        narrative_chains_with_NNPs = []
+        if not all_sentences:
+            narrative_chains_with_clusters = []
+            narrative_chains_with_NNPs = []
         for verb in verbs:
             temp_with_clusters = []
             temp_with_NNPs =[]
@@ -384,64 +373,198 @@ def get_narrative_chains_from_sem_roles(semantic_roles, sentences_replaced_with_
 
     return narrative_chains_with_clusters, narrative_chains_with_NNPs
 
-def run_hpff_chains(filename): 
+def get_chapter_narrative_chains(idx, story, chapter):
+    '''
+        Input: the line number of the story in the HPFF nlp file, the decoded story, and the chapter key
+        Output: the dep parse and sem role narrative chains for the chapter as four lists (dp with cluster nums, dp with NNPs,
+                sr with cluster nums, sr with NNPs).  If the chapter is missing some of its nlp the chains found before
+                the TypeError are kept and the rest are left empty.
+    '''
+
+    dp_chapter_chains_with_clusters = []
+    dp_chapter_chains_with_NNPs = []
+    sr_chapter_chains_with_clusters = []
+    sr_chapter_chains_with_NNPs = []
+    dependency_parses = clusters = coref_document = semantic_roles = None
+    stats = instrumentation.get_stats()
+    stats.chapters += 1
+    vocabulary = vocab.get_default_vocabulary()
+
+    try:
+        dependency_parses = story['chapters'][chapter]['nlp']['dependency_parses'] ## dependecy parses are at the sentence level
+        clusters = story['chapters'][chapter]['nlp']['coref']['clusters'] ## clusters are at the chapter level
+        coref_document = story['chapters'][chapter]['nlp']['coref']['document'] ## document is at the chapter level.  It's one single list of tokenized words - including punctuation - at the chapter level
+        semantic_roles = story['chapters'][chapter]['nlp']['semantic_roles']
+        with stats.stage('word_to_sentence') as stage:
+            original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, story = get_word_to_sentence_mapping_locations(dependency_parses, chapter, story, vocabulary)
+            stage.tokens = len(original_document)
+        stats.tokens += len(original_document)
+        sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs, document_replaced_with_cluster_nums, document_replaced_with_NNPs = get_sentences_replaced_with_clusters(original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, clusters, coref_document, vocabulary)
+
+        ## events based off dependency parsing, for the whole chapter at once unless it can't be laid out in arrays
+        with stats.stage('dp_extraction') as stage:
+            dp_extractor = batch_extract.get_default_dp_extractor()
+            dp_chains = dp_extractor.extract(dependency_parses, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs)
+            if dp_chains is None:
+                dp_chains = get_narrative_chains_from_dep_parsing(dependency_parses, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs, dp_extractor.relations, dp_extractor.all_sentences)
+            dp_chapter_chains_with_clusters, dp_chapter_chains_with_NNPs = dp_chains
+            stage.tokens = len(original_document)
+
+        ## events based off semantic role labeling
+        with stats.stage('srl_extraction') as stage:
+            sr_chapter_chains_with_clusters, sr_chapter_chains_with_NNPs = batch_extract.get_default_srl_extractor().extract(semantic_roles, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs)
+            stage.tokens = len(original_document)
+
+    except TypeError:
+        print('one of these values are emtpy! You are on chapter %s on story line %d and len(story[chapters]) %d' % (chapter, idx, len(story['chapters'])))
+        print('dep_parse: ', dependency_parses==None)
+        print('clusters: ', clusters==None)
+        print('coref_doc: ', coref_document==None)
+        print('sem_roles: ', semantic_roles==None)
+        print('story: ', story==None)
+        print('story[chapters]', story['chapters']==None)
+        print('story[chapters][chapter]', story['chapters'][chapter]==None)
+        print('story[chapters][chapter][nlp]', story['chapters'][chapter]['nlp']==None)
+        print('story[chapters][chapter][nlp][coref]', story['chapters'][chapter]['nlp']['coref']==None)
+
+    return dp_chapter_chains_with_clusters, dp_chapter_chains_with_NNPs, sr_chapter_chains_with_clusters, sr_chapter_chains_with_NNPs
+
+def get_story_narrative_chains(idx, line, json_backend='auto', lazy_json=False):
+    '''
+        Input: the line number of the story in the HPFF nlp file, the raw json line for that story, and the json backend
+               and lazy mode to decode it with (see hpff_json.get_decoder())
+        Output: a list with one (chapter, dp with cluster nums, dp with NNPs, sr with cluster nums, sr with NNPs) tuple
+                per chapter, in chapter order.  Returns None if the line is not valid json.
+                This is the unit of work run_hpff_chains() hands to its worker processes.
+    '''
+
+    stats = instrumentation.get_stats()
+    try:
+        with stats.stage('json_decode'):
+            story = hpff_json.get_decoder(json_backend, lazy_json)(line)
+    except ValueError: ## json.decoder.JSONDecodeError, or the error of the other json backends
+        print('You\'ve got a json error! i.e. - Extra data: line 1 column 292980 (char 292979)')
+        print('line:\t%d\tlength of line: %d' % (idx,len(line)))
+        print('type: ', type(line))
+        return None
+    stats.stories += 1
+
+    ## chapter level
+    story_chains = []
+    for chapter in story['chapters']:
+        story_chains.append((chapter,) + get_chapter_narrative_chains(idx, story, chapter))
+
+    return story_chains
+
+def _get_story_narrative_chains_worker(args):
+    ## Pool workers are handed a single picklable argument, and send back the stage timings of the story with its chains
+    stats = instrumentation.get_stats()
+    stats.reset()
+    story_chains = get_story_narrative_chains(*args)
+    return story_chains, stats.get_state()
+
+def get_worker_settings():
+    '''
+        Output: the extraction settings of this process (the default extractors set from the command line), which Pool
+                workers are given explicitly: a worker that isn't forked (spawn, forkserver) re-imports the modules and
+                would start from their defaults (e.g. bench_hpff.py --simple-tagger would tag with the nltk tagger)
+    '''
+    return {'dp_extractor': batch_extract.get_default_dp_extractor(),
+            'srl_extractor': batch_extract.get_default_srl_extractor(),
+            'tagger': mention_tagger.get_default_tagger()}
+
+def _init_worker(settings):
+    ## Pool initializer, installs the settings from get_worker_settings() of the parent
+    batch_extract.set_default_dp_extractor(settings['dp_extractor'])
+    batch_extract.set_default_srl_extractor(settings['srl_extractor'])
+    mention_tagger.set_default_tagger(settings['tagger'])
+
+def imap_stories(lines, num_workers=1, max_pending=None, json_backend='auto', lazy_json=False):
+    '''
+        Input:  an iterable of (idx, line) pairs from the HPFF nlp file and the number of worker processes to use.
+                max_pending bounds how many stories are handed out ahead of the one being returned (default 4 per worker),
+                so the gzip file is never read into memory faster than the workers can parse it.
+                json_backend and lazy_json are passed on to get_story_narrative_chains().  The workers are set up with
+                get_worker_settings() of this process, whatever the multiprocessing start method.
+        Output: yields (idx, story_chains) in the same order as lines, where story_chains is the output of get_story_narrative_chains()
+                The stage timings of the workers are merged into instrumentation.get_stats() of this process.
+    '''
+
+    if num_workers <= 1:
+        ## round trip through pickle the same way results come back from the pool, so strings are shared
+        ## the same way in both paths and pickle_dump() writes the same bytes for any num_workers
+        for idx, line in lines:
+            yield idx, pkl.loads(pkl.dumps(get_story_narrative_chains(idx, line, json_backend, lazy_json)))
+        return
+
+    import multiprocessing
+    if max_pending is None:
+        max_pending = 4 * num_workers
+
+    stats = instrumentation.get_stats()
+    pending = collections.deque()
+    with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(get_worker_settings(),)) as pool:
+        for idx, line in lines:
+            pending.append((idx, pool.apply_async(_get_story_narrative_chains_worker, ((idx, line, json_backend, lazy_json),))))
+            if len(pending) >= max_pending:
+                done_idx, result = pending.popleft()
+                story_chains, worker_stats = result.get()
+                stats.merge(worker_stats)
+                yield done_idx, story_chains
+        while pending:
+            done_idx, result = pending.popleft()
+            story_chains, worker_stats = result.get()
+            stats.merge(worker_stats)
+            yield done_idx, story_chains
+
+def iter_hpff_chapter_chains(filename, num_workers=1, start_story=0, story_ids=None, json_backend='auto', lazy_json=False, prefetch=True):
+    '''
+        Input: the HPFF nlp file, the number of worker processes that extract the stories, the line number of the first
+               story to extract (earlier lines are skipped without being decoded), and optionally the story numbers to extract.
+               If the file was indexed with hpff_reader.build_story_index() the stories are read directly instead of
+               decompressing the file up to them.  json_backend and lazy_json pick the story decoder, see hpff_json.get_decoder().
+               With prefetch the lines are read and decompressed in a background thread while the stories already read are
+               extracted (see hpff_reader.prefetch_story_lines()).  filename can also be a directory or glob pattern of shards.
+        Output: yields (idx, chapter, dp with cluster nums, dp with NNPs, sr with cluster nums, sr with NNPs) for every chapter
+                as soon as its story is extracted, in file order.  Nothing is kept once a chapter has been yielded.
+    '''
+
+    if prefetch:
+        lines = hpff_reader.prefetch_story_lines(filename, start_story, story_ids)
+    else:
+        lines = hpff_reader.iter_story_lines(filename, start_story, story_ids)
+    for idx, story_chains in imap_stories(lines, num_workers, json_backend=json_backend, lazy_json=lazy_json):
+        if story_chains is None:
+            continue
+        for chapter_chains in story_chains:
+            yield (idx,) + chapter_chains
+
+        print('Story %d successfully finished!' % (idx))
+        instrumentation.get_stats().maybe_log()
+
+def run_hpff_chains(filename, num_workers=1, story_ids=None, json_backend='auto', lazy_json=False, prefetch=True):
     '''
         Objective: Gather all the events from HPFF
+        Input: the gzipped HPFF nlp file, the number of worker processes that extract the stories, and optionally the story
+               numbers to extract (default all).  Stories are merged back in file order, so the returned lists are the same for any num_workers.
+               json_backend and lazy_json pick the story decoder, see hpff_json.get_decoder().  prefetch reads the file in a
+               background thread, see iter_hpff_chapter_chains().
         Return: to list objects for narrative events extracted using dep parse and sem role labeling separately
-                both files are written to pickle files.
+                both files are written to pickle files.  Use write_hpff_chain_shards() for corpora that don't fit in memory.
     '''
-    import gzip
-    json_nlp_filename = filename
 
     dp_narrative_chains_with_cluster_nums = []
     dp_narrative_chains_with_NNPs = []
     sr_narrative_chains_with_cluster_nums = []
     sr_narrative_chains_with_NNPs = []
 
-    with gzip.open(json_nlp_filename) as json_file:
-        for idx, line in enumerate(json_file):
-            try:
-                story = json.loads(line)
-            except json.decoder.JSONDecodeError:
-                print('You\'ve got a json error! i.e. - Extra data: line 1 column 292980 (char 292979)')
-                print('line:\t%d\tlength of line: %d' % (idx,len(line)))
-                print('type: ', type(line))
-                continue
-            ## chapter level
-            for chapter in story['chapters']:
-                try:
-                    dependency_parses = story['chapters'][chapter]['nlp']['dependency_parses'] ## dependecy parses are at the sentence level
-                    clusters = story['chapters'][chapter]['nlp']['coref']['clusters'] ## clusters are at the chapter level
-                    coref_document = story['chapters'][chapter]['nlp']['coref']['document'] ## document is at the chapter level.  It's one single list of tokenized words - including punctuation - at the chapter level
-                    semantic_roles = story['chapters'][chapter]['nlp']['semantic_roles']
-                    original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, story = get_word_to_sentence_mapping_locations(dependency_parses, chapter, story)
-                    sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs, document_replaced_with_cluster_nums, document_replaced_with_NNPs = get_sentences_replaced_with_clusters(original_document, original_sentences, words_to_sentence_locations, sentence_starting_positions, clusters, coref_document)
-
-                    ## events based off dependency parsing
-                    dp_chapter_chains_with_clusters, dp_chapter_chains_with_NNPs = get_narrative_chains_from_dep_parsing(dependency_parses, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs)
-                    dp_narrative_chains_with_cluster_nums.extend(dp_chapter_chains_with_clusters)
-                    dp_narrative_chains_with_NNPs.extend(dp_chapter_chains_with_NNPs)
-                    
-                    ## events based off semantic role labeling
-                    sr_chapter_chains_with_clusters, sr_chapter_chains_with_NNPs = get_narrative_chains_from_sem_roles(semantic_roles, sentences_replaced_with_cluster_nums, sentences_replaced_with_NNPs)
-                    sr_narrative_chains_with_cluster_nums.extend(sr_chapter_chains_with_clusters)
-                    sr_narrative_chains_with_NNPs.extend(sr_chapter_chains_with_NNPs)
-
-                except TypeError:
-                    print('one of these values are emtpy! You are on chapter %s on story line %d and len(story[chapters]) %d' % (chapter, idx, len(story['chapters'])))
-                    print('dep_parse: ', dependency_parses==None)
-                    print('clusters: ', clusters==None)
-                    print('coref_doc: ', coref_document==None)
-                    print('sem_roles: ', semantic_roles==None)
-                    print('story: ', story==None)
-                    print('line: ', line==None)
-                    print('story[chapters]', story['chapters']==None)
-                    print('story[chapters][chapter]', story['chapters'][chapter]==None)
-                    print('story[chapters][chapter][nlp]', story['chapters'][chapter]['nlp']==None)
-                    print('story[chapters][chapter][nlp][coref]', story['chapters'][chapter]['nlp']['coref']==None)
-                    continue
-
-            print('Story %d successfully finished!' % (idx))
+    stats = instrumentation.get_stats()
+    for idx, chapter, dp_chapter_chains_with_clusters, dp_chapter_chains_with_NNPs, sr_chapter_chains_with_clusters, sr_chapter_chains_with_NNPs in iter_hpff_chapter_chains(filename, num_workers, story_ids=story_ids, json_backend=json_backend, lazy_json=lazy_json, prefetch=prefetch):
+        with stats.stage('output'):
+            dp_narrative_chains_with_cluster_nums.extend(dp_chapter_chains_with_clusters)
+            dp_narrative_chains_with_NNPs.extend(dp_chapter_chains_with_NNPs)
+            sr_narrative_chains_with_cluster_nums.extend(sr_chapter_chains_with_clusters)
+            sr_narrative_chains_with_NNPs.extend(sr_chapter_chains_with_NNPs)
 
     print('length of dep_parse_narrative_chains using cluster nums: %d' % (len(dp_narrative_chains_with_cluster_nums))) ##819 changed to 379
     print('length of dep_parse_narrative_chains using NNPs: %d' % (len(dp_narrative_chains_with_NNPs))) ##819 changed to 379
@@ -449,105 +572,174 @@ def run_hpff_chains(filename):
     print('length of sem_role_narrative_chains using NNPs: %d' % (len(sr_narrative_chains_with_NNPs))) ##872
 
 
-    return dp_narrative_chains_with_cluster_nums, dp_narrative_chains_with_NNPs, sr_narrative_chains_with_cluster_nums, sr_narrative_chains_with_NNPs 
+    return dp_narrative_chains_with_cluster_nums, dp_narrative_chains_with_NNPs, sr_narrative_chains_with_cluster_nums, sr_narrative_chains_with_NNPs
 
-def hpff_analysis(narrative_chains, is_dp_chains=True, with_clusters=True):
+def write_hpff_chain_shards(filename, num_workers=1, max_shard_bytes=util.default_max_shard_bytes, checkpoint_every=100, resume=False, story_ids=None, json_backend='auto', lazy_json=False, event_store_dir=None, prefetch=True):
+    '''
+        Objective: Same events as run_hpff_chains(), but every chapter's chains are appended to the shard files of
+                   hpff_chain_files as soon as they are extracted, so memory use depends on the chapter, not the corpus.
+                   Every checkpoint_every stories the shards are flushed and the next story to extract is saved to
+                   hpff_chain_checkpoint.  With resume=True a run picks up from the last checkpoint: shards are cut back
+                   to their checkpointed length and the stories before it are skipped without being decoded.
+        Input: the gzipped HPFF nlp file, the number of worker processes, the size a shard grows to before the next one
+               is started, how many stories to extract between checkpoints, whether to resume from the last checkpoint,
+               optionally the story numbers to extract (a resumed run must be given the same ones), and the story decoder
+               (json_backend and lazy_json, see hpff_json.get_decoder()).  If event_store_dir is given the events are also
+               written to a columnar event_store.EventStore there, with their story and chapter, and checkpointed with the shards.
+               prefetch reads the file in a background thread, see iter_hpff_chapter_chains().
+        Return: the number of chains written to each of hpff_chain_files.  Read them back with util.iter_pickle_shards(name).
+    '''
+
+    checkpoint = util.load_checkpoint(hpff_chain_checkpoint) if resume else None
+    if checkpoint is not None and checkpoint['filename'] != os.path.abspath(filename):
+        raise ValueError('%s was written for %s, not %s' % (hpff_chain_checkpoint, checkpoint['filename'], filename))
+    if checkpoint is not None and event_store_dir is not None and checkpoint.get('event_store') is None:
+        raise ValueError('%s was written without an event store, resume without --event-store or start over without --resume' % (hpff_chain_checkpoint))
+    story_ids = list(story_ids) if story_ids is not None else None
+    if checkpoint is not None and checkpoint.get('story_ids') != story_ids:
+        raise ValueError('%s was written for other stories, resume with the same --stories or start over without --resume' % (hpff_chain_checkpoint))
+
+    if checkpoint is None:
+        ## a checkpoint left by an earlier run doesn't match the shards this run starts over, so it goes before the first shard is written
+        util.remove_checkpoint(hpff_chain_checkpoint)
+        start_story = 0
+        counts = [0] * len(hpff_chain_files)
+        writers = [util.PickleShardWriter(name, max_shard_bytes) for name in hpff_chain_files]
+        store_writer = event_store.EventStoreWriter(event_store_dir) if event_store_dir is not None else None
+    else:
+        start_story = checkpoint['next_story']
+        counts = checkpoint['counts']
+        writers = [util.PickleShardWriter(name, max_shard_bytes, state) for name, state in zip(hpff_chain_files, checkpoint['shards'])]
+        store_writer = event_store.EventStoreWriter(event_store_dir, checkpoint['event_store']) if event_store_dir is not None else None
+        print('Resuming from story %d' % (start_story))
+
+    def save_checkpoint(next_story):
+        util.write_checkpoint({'filename': os.path.abspath(filename),
+                               'next_story': next_story,
+                               'story_ids': story_ids,
+                               'counts': counts,
+                               'shards': [writer.get_state() for writer in writers],
+                               'event_store': store_writer.get_state() if store_writer is not None else None}, hpff_chain_checkpoint)
+
+    ## every story before the one being read has been fully written once a new story index shows up
+    last_checkpoint = curr_story = start_story
+    stats = instrumentation.get_stats()
+    try:
+        for record in iter_hpff_chapter_chains(filename, num_workers, start_story, story_ids, json_backend, lazy_json, prefetch):
+            with stats.stage('output'):
+                if record[0] != curr_story:
+                    curr_story = record[0]
+                    if curr_story - last_checkpoint >= checkpoint_every:
+                        save_checkpoint(curr_story)
+                        last_checkpoint = curr_story
+                for i, chapter_chains in enumerate(record[2:]):
+                    if chapter_chains:
+                        writers[i].append(chapter_chains)
+                        counts[i] += len(chapter_chains)
+                if store_writer is not None:
+                    store_writer.add_chapter(*record)
+        save_checkpoint(curr_story + 1)
+    finally:
+        for writer in writers:
+            writer.close()
+        if store_writer is not None:
+            store_writer.close()
+
+    for name, count in zip(hpff_chain_files, counts):
+        print('%s: %d chains' % (name, count))
+
+    return counts
+
+def hpff_analysis(narrative_chains, is_dp_chains=True, with_clusters=True, counts_only=False):
     '''
         Input:  narrative chains extracted either from dep parse or semantic roles.  The booleans is_dp_chains identifies
                 whether the data was extracted from dep parse or semantic roles.  The boolean with_clusters identifies if
                 the nodes are created with the cluster num of with the actual name of the entitiy
         Output: Return the narrative chains dependings on the different factors described in the input.
+                With counts_only, only how often each entity takes part in each event is returned (see chain_aggregator.py,
+                which also aggregates chains incrementally and merges partial aggregates).
     '''
 
-    # for chapter_num, chapter_chains in enumerate(narrative_chains[100:110]): 
-    #     if chapter_chains == '<none>': 
-    #         continue 
-    #     for narrative_chain in chapter_chains: 
-    #         print('\n') 
-    #         print(len(narrative_chain), narrative_chain)
-
-    narrative_chain_counts = defaultdict(lambda: [])
-
-    if is_dp_chains:
-
-        if with_clusters:
-
-            for chapter_num, chapter_chains in enumerate(narrative_chains): 
-                if chapter_chains == '<none>': 
-                    continue 
-                for narrative_chain in chapter_chains: 
-                    # print('\n') 
-                    # print(len(narrative_chain), narrative_chain)
-                    cluster_mention = narrative_chain[1][0]
-                    if cluster_mention.startswith('COREF_CLUSTER'):
-                        narrative_chain_counts[cluster_mention].append(narrative_chain)
-
-            return narrative_chain_counts
-
-        else:
-
-            for chapter_num, chapter_chains in enumerate(narrative_chains): 
-                if chapter_chains == '<none>': 
-                    continue 
-                for narrative_chain in chapter_chains: 
-                    # print('\n') 
-                    # print(len(narrative_chain), narrative_chain)
-                    cluster_mention = narrative_chain[1][0]
-                    narrative_chain_counts[cluster_mention].append(narrative_chain)
-
-            return narrative_chain_counts
-    else:
-
-        if with_clusters:
-
-            for chain in narrative_chains:
-                cluster_mention = chain[0][1]
-                if cluster_mention.startswith('COREF_CLUSTER'):
-                    narrative_chain_counts[cluster_mention].append(chain)
-
-            return narrative_chain_counts 
-
-        else:
-
-            for chain in narrative_chains:
-                cluster_mention = chain[0][1]
-                narrative_chain_counts[cluster_mention].append(chain)
-
-            return narrative_chain_counts
+    aggregator = chain_aggregator.ChainAggregator(is_dp_chains, with_clusters, counts_only)
+    aggregator.consume(narrative_chains)
+    return aggregator.get_result()
 
 
 
 if __name__ == '__main__' :
 
-    ## Load Data
-    hpff_filename = sys.argv[1]
-    # hpcanon_filename = sys.argv[2]
-
-
-    ###################################################
-    # HPFF
-    ###################################################
-
-    ## Get Narrative Chains
-    hpff_dp_narrative_chains_with_cluster_nums, hpff_dp_narrative_chains_with_NNPs, hpff_sr_narrative_chains_with_cluster_nums, hpff_sr_narrative_chains_with_NNPs = run_hpff_chains(hpff_filename)
-    util.pickle_dump(hpff_dp_narrative_chains_with_cluster_nums, 'hpff_dp_narrative_chains_with_cluster_nums.txt')
-    util.pickle_dump(hpff_dp_narrative_chains_with_NNPs, 'hpff_dp_narrative_chains_with_NNPs.txt')
-    util.pickle_dump(hpff_sr_narrative_chains_with_cluster_nums, 'hpff_sr_narrative_chains_with_cluster_nums.txt')
-    util.pickle_dump(hpff_sr_narrative_chains_with_NNPs, 'hpff_sr_narrative_chains_with_NNPs.txt')
-    # print(hpff_sr_narrative_chains_with_cluster_nums[100:110])
-    # print(hpff_sr_narrative_chains_with_NNPs[100:110])
-    print('Finished pickle dump...')
+    import argparse
+    parser = argparse.ArgumentParser(description='Extract narrative chains from the HPFF nlp file.')
+    parser.add_argument('hpff_filename', help='the HPFF nlp file, or a directory / glob pattern of its shards')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes that extract stories')
+    parser.add_argument('--max-shard-bytes', type=int, default=util.default_max_shard_bytes, help='size an output shard grows to before the next one is started')
+    parser.add_argument('--checkpoint-every', type=int, default=100, help='number of stories extracted between checkpoints')
+    parser.add_argument('--resume', action='store_true', help='continue from the last checkpoint instead of starting over')
+    parser.add_argument('--json-backend', default='auto', choices=['auto'] + hpff_json.backend_names, help='json decoder for the story lines (auto picks the fastest installed one)')
+    parser.add_argument('--lazy-json', action='store_true', help='only materialize the nlp fields the extractor reads')
+    parser.add_argument('--event-store', help='also write the events to a columnar event store in this directory (see event_store.py)')
+    parser.add_argument('--no-prefetch', action='store_true', help='read the file in the main thread instead of a background reader thread')
+    parser.add_argument('--dp-relations', help='comma separated dependency labels that make a dp event (default: %s)' % (','.join(batch_extract.default_dp_relations)))
+    parser.add_argument('--dp-all-sentences', action='store_true', help='keep the dp events of every sentence of a chapter, not only of its last sentence')
+    parser.add_argument('--sr-spans', action='store_true', help='make the sr chains out of whole argument spans (one (B-role, head entity) pair per span) instead of single B- words')
+    parser.add_argument('--sr-roles', help='comma separated roles of the spans kept with --sr-spans (default: %s)' % (','.join(batch_extract.default_srl_roles)))
+    parser.add_argument('--sr-all-sentences', action='store_true', help='keep the sr chains of every sentence of a chapter, not only of its last sentence')
+    parser.add_argument('--counts-only', action='store_true', help='group only per entity event counts instead of whole chains')
+    parser.add_argument('--out-dir', help='directory the shards, checkpoint and json files are written to (default: util.outDir)')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'], help='compress the grouped json files')
+    parser.add_argument('--stats-every', type=float, help='print a line of per stage timings every this many seconds')
+    parser.add_argument('--stats', help='write the per stage timings as json to this file in the out dir')
+    parser.add_argument('--profile', help='profile the run (main process only) into this file')
+    parser.add_argument('--profile-sampler', action='store_true', help='profile by sampling stacks (collapsed stack output) instead of with cProfile')
+    parser.add_argument('--stories', help='only extract these stories, START:END or a comma separated list (fast if the file was indexed with hpff_reader.py)')
+    args = parser.parse_args()
+    if args.out_dir:
+        util.set_dirs(out_dir=args.out_dir)
+    json_suffix = {None: '', 'gzip': '.gz', 'zstd': '.zst'}[args.compress]
+    if args.dp_relations or args.dp_all_sentences:
+        dp_relations = args.dp_relations.split(',') if args.dp_relations else batch_extract.default_dp_relations
+        batch_extract.set_default_dp_extractor(batch_extract.DependencyExtractor(dp_relations, args.dp_all_sentences))
+    if args.sr_spans or args.sr_roles or args.sr_all_sentences:
+        sr_roles = args.sr_roles.split(',') if args.sr_roles else batch_extract.default_srl_roles
+        batch_extract.set_default_srl_extractor(batch_extract.SemanticRoleExtractor(roles=sr_roles, all_sentences=args.sr_all_sentences, spans=args.sr_spans))
+    stats = instrumentation.get_stats()
+    stats.log_every = args.stats_every
+    ## the profile is written however the run ends, failed and interrupted runs included
+    with contextlib.ExitStack() as profiler:
+        if args.profile:
+            profiler.enter_context(instrumentation.profile(util.outDir + args.profile, args.profile_sampler))
+
+        ## Load Data
+        hpff_filename = args.hpff_filename
+        # hpcanon_filename = sys.argv[2]
+
+
+        ###################################################
+        # HPFF
+        ###################################################
+
+        ## Get Narrative Chains
+        ## chains are streamed to sharded pickle files instead of being held in memory for the whole corpus
+        story_ids = hpff_reader.parse_story_ids(args.stories) if args.stories else None
+        write_hpff_chain_shards(hpff_filename, args.workers, args.max_shard_bytes, args.checkpoint_every, args.resume, story_ids, args.json_backend, args.lazy_json, args.event_store, not args.no_prefetch)
+        # print(hpff_sr_narrative_chains_with_cluster_nums[100:110])
+        # print(hpff_sr_narrative_chains_with_NNPs[100:110])
+        print('Finished pickle dump...')
     
-    ## Group Similar Narrative Chains Together
-    hpff_dp_narrative_chains_counts_clusters = hpff_analysis(hpff_dp_narrative_chains_with_cluster_nums, True, True)
-    hpff_dp_narrative_chains_counts_NNPs = hpff_analysis(hpff_dp_narrative_chains_with_NNPs, True, False)
-    hpff_sr_narrative_chains_counts_clusters = hpff_analysis(hpff_sr_narrative_chains_with_cluster_nums, False, True)
-    hpff_sr_narrative_chains_counts_NNPs = hpff_analysis(hpff_sr_narrative_chains_with_NNPs, False, False)
-    util.write_json(hpff_dp_narrative_chains_counts_clusters,'hpff_dp_narrative_chains_counts_clusters.txt')
-    util.write_json(hpff_dp_narrative_chains_counts_NNPs,'hpff_dp_narrative_chains_counts_NNPs.txt')
-    util.write_json(hpff_sr_narrative_chains_counts_clusters, 'hpff_sr_narrative_chains_counts_clusters.txt')
-    util.write_json(hpff_sr_narrative_chains_counts_NNPs, 'hpff_sr_narrative_chains_counts_NNPs.txt')
-    print('Finished json dump...')
+        ## Group Similar Narrative Chains Together
+        ## shards are grouped in parallel and the partial groups merged in shard order
+        hpff_dp_narrative_chains_counts_clusters = chain_aggregator.aggregate_pickle_shards('hpff_dp_narrative_chains_with_cluster_nums.txt', True, True, args.counts_only, args.workers).get_result()
+        hpff_dp_narrative_chains_counts_NNPs = chain_aggregator.aggregate_pickle_shards('hpff_dp_narrative_chains_with_NNPs.txt', True, False, args.counts_only, args.workers).get_result()
+        hpff_sr_narrative_chains_counts_clusters = chain_aggregator.aggregate_pickle_shards('hpff_sr_narrative_chains_with_cluster_nums.txt', False, True, args.counts_only, args.workers).get_result()
+        hpff_sr_narrative_chains_counts_NNPs = chain_aggregator.aggregate_pickle_shards('hpff_sr_narrative_chains_with_NNPs.txt', False, False, args.counts_only, args.workers).get_result()
+        util.write_json(hpff_dp_narrative_chains_counts_clusters,'hpff_dp_narrative_chains_counts_clusters.txt' + json_suffix)
+        util.write_json(hpff_dp_narrative_chains_counts_NNPs,'hpff_dp_narrative_chains_counts_NNPs.txt' + json_suffix)
+        util.write_json(hpff_sr_narrative_chains_counts_clusters, 'hpff_sr_narrative_chains_counts_clusters.txt' + json_suffix)
+        util.write_json(hpff_sr_narrative_chains_counts_NNPs, 'hpff_sr_narrative_chains_counts_NNPs.txt' + json_suffix)
+        print('Finished json dump...')
+    print(stats.format_line())
+    if args.stats:
+        util.write_json(stats.summary(), args.stats)
     
 
     # import util
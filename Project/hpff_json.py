@@ -0,0 +1,114 @@
+'''
+	hpff_json.py
+
+	Objective: Decode the story lines of the HPFF nlp file.  Some lines are over 500KB, and json.loads() on them is most of
+	           the time spent before any extraction happens, so the decoder is pluggable: orjson or pysimdjson are used when
+	           they are installed and the standard library json module otherwise.
+
+	           lazy=True only materializes what run_hpff_chains() reads, chapters[*].nlp.{dependency_parses, coref, semantic_roles}.
+	           With simdjson the rest of the story is never turned into python objects; with the other backends it is
+	           decoded and then dropped right away.
+
+	           orjson and simdjson reject the NaN / Infinity literals the json module accepts, so a line they fail on is
+	           decoded again with json.loads(): every backend gives the same stories, and fails on the same lines.
+
+	Methods:	get_available_backends()
+				get_decoder(backend='auto', lazy=False)
+
+	Usage:	decode_story = hpff_json.get_decoder('auto', lazy=True)
+			story = decode_story(line)
+'''
+
+import functools
+import json
+
+## backends in the order 'auto' tries them
+backend_names = ['orjson', 'simdjson', 'json']
+
+## the only parts of a story run_hpff_chains() reads
+nlp_fields = ['dependency_parses', 'coref', 'semantic_roles']
+
+
+def _import_backend(backend):
+    if backend == 'json':
+        return json
+    try:
+        return __import__(backend)
+    except ImportError:
+        return None
+
+def get_available_backends():
+    return [backend for backend in backend_names if _import_backend(backend) is not None]
+
+def _materialize(value):
+    ## simdjson hands back proxies for arrays and objects
+    if hasattr(value, 'as_dict'):
+        return value.as_dict()
+    if hasattr(value, 'as_list'):
+        return value.as_list()
+    return value
+
+def _project_story(story):
+    '''
+        Input: a decoded story (dict, or a simdjson Object)
+        Output: a new story dict that only has chapters[*].nlp.{dependency_parses, coref, semantic_roles}.  Missing keys
+                and null values are kept missing and null, so the extractor fails the same way on broken chapters.
+    '''
+    chapters = {}
+    for chapter, chapter_data in story['chapters'].items():
+        if chapter_data is None:
+            chapters[chapter] = None
+            continue
+        if 'nlp' not in chapter_data:
+            chapters[chapter] = {}
+            continue
+        nlp = chapter_data['nlp']
+        if nlp is None:
+            chapters[chapter] = {'nlp': None}
+            continue
+        chapters[chapter] = {'nlp': {field: _materialize(nlp[field]) for field in nlp_fields if field in nlp}}
+    return {'chapters': chapters}
+
+def _with_json_fallback(decode_story, lazy):
+    ## a line the faster backend rejects (e.g. one with NaN) is left to json.loads(), which raises if it's really broken
+    def decode_story_or_fall_back(line):
+        try:
+            return decode_story(line)
+        except ValueError:
+            story = json.loads(line)
+            return _project_story(story) if lazy else story
+    return decode_story_or_fall_back
+
+@functools.lru_cache(maxsize=None)
+def get_decoder(backend='auto', lazy=False):
+    '''
+        Input:  backend, one of 'auto', 'orjson', 'simdjson' or 'json', and whether to only materialize the fields the extractor reads
+        Output: a function taking a story line (bytes or str) and returning the story dict.  Lines orjson or simdjson
+                reject are decoded again with json.loads(), so every backend accepts the same lines and raises
+                json.JSONDecodeError (a ValueError) on a line that isn't valid json.
+    '''
+
+    if backend == 'auto':
+        backend = get_available_backends()[0]
+    module = _import_backend(backend)
+    if module is None:
+        raise ImportError('json backend %s is not installed' % (backend))
+
+    if backend == 'simdjson':
+        parser = module.Parser()
+        if lazy:
+            def decode_story(line):
+                return _project_story(parser.parse(line))
+        else:
+            def decode_story(line):
+                return _materialize(parser.parse(line))
+        return _with_json_fallback(decode_story, lazy)
+
+    if lazy:
+        def decode_story(line):
+            return _project_story(module.loads(line))
+    else:
+        decode_story = module.loads
+    if backend == 'json':
+        return decode_story
+    return _with_json_fallback(decode_story, lazy)
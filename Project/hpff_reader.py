@@ -0,0 +1,318 @@
+'''
+	hpff_reader.py
+
+	Objective: Random access to the stories (one json object per line) of the HPFF nlp file, so single stories, samples and
+	           slices of the corpus can be read without decompressing everything before them.
+
+	           A gzip stream can only be decompressed from the start, so build_story_index() rewrites a .json.gz file into
+	           blocks: each block is its own gzip member holding whole story lines (about block_bytes of them), in the
+	           same way BGZF does for BAM files.  The blocked file is still a normal gzip file (gzip.open and zcat read
+	           concatenated members), and next to it an index records, for every story line, the block it is in and where
+	           the line starts inside the block.  Uncompressed .json files are indexed in place by byte offset.
+
+	           A corpus can also be given as shards: a directory or a glob pattern of .json / .json.gz files, read in
+	           sorted filename order with the story numbers running on from one shard to the next.
+
+	           prefetch_story_lines() reads the lines in a background thread into a bounded queue, so gzip inflation
+	           (zlib releases the GIL) and line splitting overlap with the json decoding and extraction of the stories
+	           already read.  Lines are queued in batches to keep the per line locking cost down.
+
+	Methods:	get_index_filename(filename)
+				build_story_index(src, dest=None, block_bytes=1 << 20, compresslevel=6)
+				StoryReader(filename)
+				get_shard_filenames(filename)
+				iter_story_lines(filename, start_story=0, story_ids=None)
+				prefetch_lines(lines, max_batches=default_prefetch_batches, batch_size=default_prefetch_batch_size)
+				prefetch_story_lines(filename, start_story=0, story_ids=None, max_batches=default_prefetch_batches, batch_size=default_prefetch_batch_size)
+				parse_story_ids(spec)
+
+	Usage:	python hpff_reader.py build <HPFF_FILENAME> [<BLOCKED_FILENAME>]
+			python hpff_reader.py get <BLOCKED_FILENAME> <STORY_NUM>
+	Example:python hpff_reader.py build HPFF-large.json.gz HPFF-large.blocked.json.gz
+'''
+
+import glob
+import gzip
+import itertools
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import zlib
+
+## the reader thread of prefetch_lines() stays at most max_batches * batch_size lines ahead
+default_prefetch_batches = 16
+default_prefetch_batch_size = 8
+
+
+def get_index_filename(filename):
+    return filename + '.idx'
+
+def build_story_index(src, dest=None, block_bytes=1 << 20, compresslevel=6):
+    '''
+        Input:  src, the HPFF nlp file (.gz or uncompressed), and dest, where the blocked copy of a .gz src is written
+                (default: src with .json.gz replaced by .blocked.json.gz).  Blocks are cut after the story line that
+                brings them to block_bytes of uncompressed text.
+        Output: the filename the index was built for (dest for gzip input, src otherwise).  The index is written to
+                get_index_filename() of that file.
+    '''
+
+    is_gzip = src.endswith('.gz')
+    blocks = []   ## [compressed offset, compressed length] of every block
+    stories = []  ## [block, offset in the block, length] of every story line; block is -1 for uncompressed files
+
+    if not is_gzip:
+        offset = 0
+        with open(src, 'rb') as fin:
+            for line in fin:
+                stories.append([-1, offset, len(line)])
+                offset += len(line)
+        indexed_filename = src
+
+    else:
+        if dest is None:
+            dest = src[:-len('.json.gz')] + '.blocked.json.gz' if src.endswith('.json.gz') else src[:-len('.gz')] + '.blocked.gz'
+        buffer = []
+        buffer_len = 0
+        with gzip.open(src, 'rb') as fin, open(dest, 'wb') as fout:
+
+            def flush_block():
+                member = gzip.compress(b''.join(buffer), compresslevel)
+                blocks.append([fout.tell(), len(member)])
+                fout.write(member)
+
+            for line in fin:
+                stories.append([len(blocks), buffer_len, len(line)])
+                buffer.append(line)
+                buffer_len += len(line)
+                if buffer_len >= block_bytes:
+                    flush_block()
+                    buffer = []
+                    buffer_len = 0
+            if buffer:
+                flush_block()
+        indexed_filename = dest
+
+    with open(get_index_filename(indexed_filename), 'w') as fout:
+        json.dump({'blocks': blocks, 'stories': stories}, fout)
+
+    print('Indexed %d stories in %d blocks: %s' % (len(stories), len(blocks), indexed_filename))
+    return indexed_filename
+
+
+class StoryReader(object):
+    '''
+        Reads single story lines out of a file indexed by build_story_index().  The last decompressed block is kept,
+        so reading the stories of a block one after another only decompresses it once.
+
+        Usage:
+            with StoryReader('HPFF-large.blocked.json.gz') as reader:
+                line = reader.get_line(18000)
+                for idx, line in reader.iter_lines(reader.sample(0.01)):
+                    story = json.loads(line)
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(get_index_filename(filename), 'r') as fin:
+            index = json.load(fin)
+        self.blocks = index['blocks']
+        self.stories = index['stories']
+        self.fin = open(filename, 'rb')
+        self.cached_block_num = None
+        self.cached_block = None
+
+    def __len__(self):
+        return len(self.stories)
+
+    def get_block(self, block_num):
+        if block_num != self.cached_block_num:
+            offset, length = self.blocks[block_num]
+            self.fin.seek(offset)
+            self.cached_block = zlib.decompress(self.fin.read(length), 16 + zlib.MAX_WBITS)
+            self.cached_block_num = block_num
+        return self.cached_block
+
+    def get_line(self, story_num):
+        '''
+            Output: the raw json line (bytes) of story story_num, the same bytes gzip.open() would give for that line
+        '''
+        block_num, offset, length = self.stories[story_num]
+        if block_num < 0:
+            self.fin.seek(offset)
+            return self.fin.read(length)
+        return self.get_block(block_num)[offset:offset + length]
+
+    def iter_lines(self, story_ids):
+        '''
+            Output: yields (story_num, line) for every story in story_ids, in the order given
+        '''
+        for story_num in story_ids:
+            yield story_num, self.get_line(story_num)
+
+    def sample(self, fraction, seed=5):
+        '''
+            Output: a sorted random sample of about fraction of the story numbers
+        '''
+        rng = random.Random(seed)
+        return sorted(rng.sample(range(len(self)), int(round(fraction * len(self)))))
+
+    def close(self):
+        self.fin.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def get_shard_filenames(filename):
+    '''
+        Output: the files of the corpus filename, in story order: the sorted .json / .json.gz files of a directory, the
+                sorted matches of a glob pattern, or [filename]
+    '''
+    if os.path.isdir(filename):
+        return sorted(os.path.join(filename, name) for name in os.listdir(filename) if name.endswith(('.json', '.jsonl', '.json.gz', '.jsonl.gz')))
+    if glob.has_magic(filename):
+        return sorted(name for name in glob.glob(filename) if not name.endswith('.idx'))
+    return [filename]
+
+def _iter_shard_lines(filenames):
+    for filename in filenames:
+        opener = gzip.open if filename.endswith('.gz') else open
+        with opener(filename, 'rb') as json_file:
+            for line in json_file:
+                yield line
+
+def iter_story_lines(filename, start_story=0, story_ids=None):
+    '''
+        Input:  the HPFF nlp file (or a directory / glob pattern of shards, see get_shard_filenames()), the first story
+                to read, and optionally the story numbers to read
+        Output: yields (story_num, line) in file order.  If filename has an index the stories are read directly,
+                otherwise the file is read front to back and the other lines are skipped without being decoded.
+                A story in story_ids past the end of the file raises a ValueError: before anything is read with an
+                index, after the stories before it without one.
+    '''
+
+    if story_ids is not None:
+        story_ids = [story_num for story_num in sorted(set(story_ids)) if story_num >= start_story]
+
+    filenames = get_shard_filenames(filename)
+    if not filenames:
+        raise FileNotFoundError('no story files match %s' % (filename))
+
+    reader = None
+    if len(filenames) == 1:
+        try:
+            reader = StoryReader(filenames[0])
+        except FileNotFoundError:
+            pass
+
+    if reader is not None:
+        with reader:
+            if story_ids is None:
+                story_ids = range(start_story, len(reader))
+            elif story_ids and story_ids[-1] >= len(reader):
+                raise ValueError('story %d is past the end of %s' % (next(story_num for story_num in story_ids if story_num >= len(reader)), filename))
+            for story_num, line in reader.iter_lines(story_ids):
+                yield story_num, line
+        return
+
+    wanted = set(story_ids) if story_ids is not None else None
+    last_story = story_ids[-1] if story_ids else -1
+    num_stories = start_story
+    lines = _iter_shard_lines(filenames)
+    try:
+        for story_num, line in itertools.islice(enumerate(lines), start_story, None):
+            num_stories = story_num + 1
+            if wanted is not None:
+                if story_num > last_story:
+                    break
+                if story_num not in wanted:
+                    continue
+            yield story_num, line
+        if num_stories <= last_story:
+            raise ValueError('story %d is past the end of %s' % (next(story_num for story_num in story_ids if story_num >= num_stories), filename))
+    finally:
+        lines.close()
+
+def _read_ahead(lines, batches, batch_size, stop):
+    ## runs in the reader thread; every put gives up once the consumer has stopped
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    batch = []
+    try:
+        for item in lines:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                if not put(batch):
+                    return
+                batch = []
+        if batch and not put(batch):
+            return
+        put(None)
+    except BaseException as error:
+        ## the items read before the error still reach the consumer
+        if not batch or put(batch):
+            put(error)
+    finally:
+        if hasattr(lines, 'close'):
+            lines.close()
+
+def prefetch_lines(lines, max_batches=default_prefetch_batches, batch_size=default_prefetch_batch_size):
+    '''
+        Input:  an iterable, e.g. iter_story_lines(), that is iterated in a background thread.  At most max_batches
+                batches of batch_size items are read ahead of the consumer.
+        Output: yields the items of lines in order.  An exception raised while reading is raised here, and the
+                thread is stopped if the generator is closed before the end.
+    '''
+    batches = queue.Queue(max_batches)
+    stop = threading.Event()
+    thread = threading.Thread(target=_read_ahead, args=(iter(lines), batches, batch_size, stop), daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            if isinstance(batch, BaseException):
+                raise batch
+            for item in batch:
+                yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def prefetch_story_lines(filename, start_story=0, story_ids=None, max_batches=default_prefetch_batches, batch_size=default_prefetch_batch_size):
+    '''
+        Output: the (story_num, line) pairs of iter_story_lines(), read and decompressed in a background thread
+    '''
+    return prefetch_lines(iter_story_lines(filename, start_story, story_ids), max_batches, batch_size)
+
+def parse_story_ids(spec):
+    '''
+        Input: a story selection from the command line, either 'START:END' or a comma separated list of story numbers
+        Output: the list of story numbers it selects
+    '''
+    if ':' in spec:
+        start, end = spec.split(':')
+        return list(range(int(start), int(end)))
+    return [int(story_num) for story_num in spec.split(',')]
+
+if __name__ == '__main__' :
+
+    if sys.argv[1] == 'build':
+        build_story_index(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    elif sys.argv[1] == 'get':
+        with StoryReader(sys.argv[2]) as reader:
+            sys.stdout.write(reader.get_line(int(sys.argv[3])).decode('utf-8'))
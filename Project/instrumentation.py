@@ -0,0 +1,225 @@
+'''
+	instrumentation.py
+
+	Objective: Per stage timings of the narrative chain extraction in hp_narrative_chains.py, to see which stage to scale.
+
+	           Every stage of a chapter (see stages) is timed with a PipelineStats, along with how many calls and tokens
+	           went through it, and the stories, chapters and tokens processed overall.  Worker processes time into their
+	           own PipelineStats and send it back with each story, where it is merged into the one of the main process.
+	           The stats can be printed as a log line every log_every seconds and written out as a json summary
+	           (seconds, share of the time, throughput and peak RSS per stage / process).
+
+	           profile() wraps a run in cProfile, or in a sampling profiler that records the main thread's stack every
+	           interval seconds and writes them as collapsed stacks (the input format of flamegraph.pl and speedscope).
+	           Either one only sees the main process.
+
+	Methods:	PipelineStats(log_every=None)
+				get_stats()
+				get_peak_rss()
+				profile(filename, sampler=False, interval=0.005)
+
+	Usage:	stats = instrumentation.get_stats()
+			with stats.stage('dp_extraction') as stage:
+				...
+				stage.tokens = len(words)
+			print(stats.format_line())
+			util.write_json(stats.summary(), 'hpff_narrative_chains.stats.json')
+'''
+
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+
+## the stages of hp_narrative_chains.py, in pipeline order
+stages = ['json_decode', 'word_to_sentence', 'index_correction', 'cluster_naming', 'span_replacement', 'dp_extraction', 'srl_extraction', 'output']
+
+
+def get_peak_rss():
+    '''
+        Output: the peak resident set size of this process in bytes, or None where the resource module doesn't exist
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## kilobytes on linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageTimer(object):
+    '''
+        Times one pass through a stage; set tokens inside the with block to count them
+    '''
+    __slots__ = ('record', 'tokens', 'start')
+
+    def __init__(self, record):
+        self.record = record
+        self.tokens = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record = self.record
+        record[0] += time.perf_counter() - self.start
+        record[1] += 1
+        record[2] += self.tokens
+
+
+class PipelineStats(object):
+    '''
+        Accumulates [seconds, calls, tokens] per stage and the stories, chapters and tokens processed.
+    '''
+
+    def __init__(self, log_every=None):
+        self.log_every = log_every
+        self.reset()
+
+    def reset(self):
+        self.stages = collections.OrderedDict((name, [0.0, 0, 0]) for name in stages)
+        self.stories = 0
+        self.chapters = 0
+        self.tokens = 0
+        self.worker_peak_rss = None
+        self.start_time = time.time()
+        self.last_log_time = self.start_time
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = [0.0, 0, 0]
+        return StageTimer(self.stages[name])
+
+    def get_state(self):
+        '''
+            Output: picklable counters, what a worker process sends back to be merged
+        '''
+        return {'stages': dict(self.stages),
+                'stories': self.stories,
+                'chapters': self.chapters,
+                'tokens': self.tokens,
+                'peak_rss': get_peak_rss()}
+
+    def merge(self, state):
+        '''
+            Input: the get_state() of another PipelineStats, e.g. from a worker process
+        '''
+        for name, (seconds, calls, tokens) in state['stages'].items():
+            record = self.stages.setdefault(name, [0.0, 0, 0])
+            record[0] += seconds
+            record[1] += calls
+            record[2] += tokens
+        self.stories += state['stories']
+        self.chapters += state['chapters']
+        self.tokens += state['tokens']
+        if state['peak_rss'] is not None:
+            self.worker_peak_rss = max(self.worker_peak_rss or 0, state['peak_rss'])
+
+    def summary(self):
+        '''
+            Output: json serializable summary: wall time, totals and throughput, peak RSS, and for every stage its
+                    seconds, share of the staged time, calls, tokens and tokens per second.  Stage seconds are summed
+                    over the worker processes, so with several workers they add up to more than the wall time.
+        '''
+        wall_seconds = time.time() - self.start_time
+        staged_seconds = sum(record[0] for record in self.stages.values())
+        summary = {'wall_seconds': wall_seconds,
+                   'stories': self.stories,
+                   'chapters': self.chapters,
+                   'tokens': self.tokens,
+                   'stories_per_second': self.stories / wall_seconds if wall_seconds else 0.0,
+                   'chapters_per_second': self.chapters / wall_seconds if wall_seconds else 0.0,
+                   'tokens_per_second': self.tokens / wall_seconds if wall_seconds else 0.0,
+                   'peak_rss': get_peak_rss(),
+                   'worker_peak_rss': self.worker_peak_rss,
+                   'stages': collections.OrderedDict()}
+        for name, (seconds, calls, tokens) in self.stages.items():
+            summary['stages'][name] = {'seconds': seconds,
+                                       'share': seconds / staged_seconds if staged_seconds else 0.0,
+                                       'calls': calls,
+                                       'tokens': tokens,
+                                       'tokens_per_second': tokens / seconds if seconds else 0.0}
+        return summary
+
+    def format_line(self):
+        '''
+            Output: one line of totals, throughput, peak RSS and the seconds of each stage
+        '''
+        summary = self.summary()
+        peak_rss = max(summary['peak_rss'] or 0, summary['worker_peak_rss'] or 0)
+        parts = ['%d stories %d chapters %d tokens in %.1fs (%.1f stories/s, %.0f tokens/s, peak rss %.0f MB)'
+                 % (self.stories, self.chapters, self.tokens, summary['wall_seconds'], summary['stories_per_second'],
+                    summary['tokens_per_second'], peak_rss / 2.0**20)]
+        parts.extend('%s %.1fs' % (name, stage['seconds']) for name, stage in summary['stages'].items() if stage['calls'])
+        return ' | '.join(parts)
+
+    def maybe_log(self):
+        '''
+            Prints format_line() if log_every seconds have passed since the last time
+        '''
+        if self.log_every is None:
+            return
+        now = time.time()
+        if now - self.last_log_time >= self.log_every:
+            self.last_log_time = now
+            print(self.format_line())
+
+
+_stats = None
+
+def get_stats():
+    '''
+        Output: the PipelineStats of this process (every worker process has its own)
+    '''
+    global _stats
+    if _stats is None:
+        _stats = PipelineStats()
+    return _stats
+
+
+def _sample_stacks(thread_id, interval, samples, stop):
+    while not stop.is_set():
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        if stack:
+            samples[';'.join(reversed(stack))] += 1
+        stop.wait(interval)
+
+@contextlib.contextmanager
+def profile(filename, sampler=False, interval=0.005):
+    '''
+        Input:  where to write the profile, and whether to sample stacks every interval seconds instead of running cProfile
+        Output: writes cProfile stats (read with pstats) or collapsed stacks ('frame;frame;frame count' per line)
+                to filename once the with block is done
+    '''
+    if not sampler:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            profiler.dump_stats(filename)
+        return
+
+    samples = collections.Counter()
+    stop = threading.Event()
+    thread = threading.Thread(target=_sample_stacks, args=(threading.get_ident(), interval, samples, stop), daemon=True)
+    thread.start()
+    try:
+        yield samples
+    finally:
+        stop.set()
+        thread.join()
+        with open(filename, 'w') as fout:
+            for stack, count in samples.most_common():
+                fout.write('%s %d\n' % (stack, count))
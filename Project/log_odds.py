@@ -0,0 +1,215 @@
+'''
+	log_odds.py
+
+	Objective: Word and verb level log odds between two raw text corpora (hpc_raw_text.txt and hpff_raw_text.txt), the
+	           computation of the log_odds_*.ipynb notebooks, fast enough for the full fan fiction corpus.
+
+	           Lines are tokenized like the notebooks (nltk.word_tokenize, lowercased, alphanumeric tokens only).  For verb
+	           counts the tokens are POS tagged in batches instead of one nltk.tag.pos_tag([word]) call per word:
+	                tag_in_context=False   every word is tagged on its own, as the notebooks did, through the cached
+	                                       mention_tagger.MentionTagger (each distinct word is tagged once)
+	                tag_in_context=True    the tokens of each line are tagged together as a sentence, many lines per tagger call
+	           Verbs are lemmatized through a cache, and the file is split into line aligned byte ranges counted in parallel.
+
+	           log_odds_table() works on NumPy arrays over the joint vocabulary and optionally smooths with an informative
+	           Dirichlet prior (Monroe, Colaresi and Quinn, 2008 - Fightin' Words), which also gives z-scores.
+
+	Methods:	lemmatize_verb(word)
+				tokenize_line(line)
+				get_file_chunks(filename, num_chunks)
+				count_lines(lines, verbs_only=False, tag_in_context=False, lemmatize=True, lines_per_batch=1000)
+				count_corpus(filename, num_workers=1, verbs_only=False, tag_in_context=False, lemmatize=True, lines_per_batch=1000)
+				log_odds_table(counts_a, counts_b, prior=None, prior_scale=1.0)
+				get_sorted_log_odds(vocab, scores, n=None)
+
+	Usage:	python log_odds.py <CORPUS_A> <CORPUS_B> [--workers N] [--verbs] [--in-context] [--prior] [--top N] [--out FILE]
+	Example:python log_odds.py data/hpff_raw_text.txt data/hpc_raw_text.txt --workers 8 --verbs --prior
+'''
+
+import collections
+import functools
+import io
+import os
+
+import numpy as np
+
+import mention_tagger
+import util
+
+verb_tags = frozenset(['VB', 'VBD', 'VBG', 'VBN', 'VBP', 'VBZ'])
+
+_lemmatizer = None
+
+
+@functools.lru_cache(maxsize=None)
+def lemmatize_verb(word):
+    global _lemmatizer
+    if _lemmatizer is None:
+        from nltk.stem import WordNetLemmatizer
+        _lemmatizer = WordNetLemmatizer()
+    return _lemmatizer.lemmatize(word, 'v')
+
+def tokenize_line(line):
+    '''
+        Output: the lowercased alphanumeric tokens of the line, as the notebooks counted them
+    '''
+    import nltk
+    return [word.lower() for word in nltk.word_tokenize(line.strip()) if word.isalnum()]
+
+def get_file_chunks(filename, num_chunks):
+    '''
+        Output: [(start, end), ...] byte ranges that cover the file, each starting at the beginning of a line
+    '''
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, 'rb') as fin:
+        for chunk_num in range(1, num_chunks):
+            fin.seek(max(bounds[-1], size * chunk_num // num_chunks))
+            fin.readline()
+            bounds.append(min(fin.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+def _iter_chunk_lines(filename, start, end):
+    with open(filename, 'rb') as fin:
+        fin.seek(start)
+        while fin.tell() < end:
+            line = fin.readline()
+            if not line:
+                break
+            line = line.decode('utf-8', errors='ignore')
+            ## the notebooks read the corpus in text mode, where '\r\n' and a lone '\r' end lines too
+            if '\r' in line:
+                for text_line in io.StringIO(line, newline=None):
+                    yield text_line
+            else:
+                yield line
+
+def _count_batch(counts, batch, verbs_only, tag_in_context, lemmatize, tagger):
+    if not verbs_only:
+        for words in batch:
+            counts.update(words)
+        return
+    if tag_in_context:
+        tagged_words = [tagged for tagged_sentence in tagger.get_tag_sents()(batch) for tagged in tagged_sentence]
+    else:
+        words = [word for sentence in batch for word in sentence]
+        tagged_words = zip(words, tagger.tag_mentions(words))
+    for word, tag in tagged_words:
+        if tag in verb_tags:
+            counts[lemmatize_verb(word) if lemmatize else word] += 1
+
+def count_lines(lines, verbs_only=False, tag_in_context=False, lemmatize=True, lines_per_batch=1000):
+    '''
+        Input:  an iterable of raw text lines
+        Output: Counter of the tokens (verbs_only=False) or of the verbs, lemmatized unless lemmatize=False
+    '''
+    tagger = mention_tagger.get_default_tagger()
+    counts = collections.Counter()
+    batch = []
+    for line in lines:
+        words = tokenize_line(line)
+        if words:
+            batch.append(words)
+        if len(batch) >= lines_per_batch:
+            _count_batch(counts, batch, verbs_only, tag_in_context, lemmatize, tagger)
+            batch = []
+    if batch:
+        _count_batch(counts, batch, verbs_only, tag_in_context, lemmatize, tagger)
+    return counts
+
+def _count_chunk(args):
+    filename, start, end, verbs_only, tag_in_context, lemmatize, lines_per_batch = args
+    return count_lines(_iter_chunk_lines(filename, start, end), verbs_only, tag_in_context, lemmatize, lines_per_batch)
+
+def count_corpus(filename, num_workers=1, verbs_only=False, tag_in_context=False, lemmatize=True, lines_per_batch=1000):
+    '''
+        Input:  a raw text corpus, one or more sentences per line, and the number of worker processes
+        Output: Counter over the whole file (see count_lines()).  The file is cut into num_workers * 4 line aligned chunks,
+                counted in parallel and merged in file order.
+    '''
+    num_chunks = max(1, num_workers * 4) if num_workers > 1 else 1
+    jobs = [(filename, start, end, verbs_only, tag_in_context, lemmatize, lines_per_batch) for start, end in get_file_chunks(filename, num_chunks)]
+    counts = collections.Counter()
+    if num_workers <= 1:
+        for partial in map(_count_chunk, jobs):
+            counts.update(partial)
+        return counts
+
+    import multiprocessing
+    with multiprocessing.Pool(num_workers) as pool:
+        for partial in pool.imap(_count_chunk, jobs):
+            counts.update(partial)
+    return counts
+
+def log_odds_table(counts_a, counts_b, prior=None, prior_scale=1.0):
+    '''
+        Input:  counts_a, counts_b - word -> count (e.g. Counters from count_corpus())
+                prior - None for the plain log odds of the notebooks, 'auto' to use counts_a + counts_b as the
+                        informative Dirichlet prior, or a word -> count dict of background counts.  The prior is
+                        rescaled to sum to prior_scale times the size of the joint vocabulary.
+        Output: vocab - list of the words in counts_a or counts_b
+                log_odds - float array, log odds of each word in a versus b (positive: more typical of a).  Without a
+                           prior this is log(count_a / total_a) - log(count_b / total_b), -inf/inf where a count is 0.
+                z_scores - float array, log odds divided by their standard deviation (None without a prior)
+    '''
+    vocab = list(counts_a)
+    vocab.extend(word for word in counts_b if word not in counts_a)
+    y_a = np.fromiter((counts_a.get(word, 0) for word in vocab), dtype=np.float64, count=len(vocab))
+    y_b = np.fromiter((counts_b.get(word, 0) for word in vocab), dtype=np.float64, count=len(vocab))
+    n_a = y_a.sum()
+    n_b = y_b.sum()
+
+    if prior is None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_odds = (np.log(y_a) - np.log(n_a)) - (np.log(y_b) - np.log(n_b))
+        return vocab, log_odds, None
+
+    if prior == 'auto':
+        alpha = y_a + y_b
+    else:
+        alpha = np.fromiter((prior.get(word, 0) for word in vocab), dtype=np.float64, count=len(vocab))
+    ## every word gets some prior mass, so nothing is divided by zero
+    alpha = alpha + 0.01
+    alpha *= prior_scale * len(vocab) / alpha.sum()
+    alpha_0 = alpha.sum()
+
+    log_odds = (np.log(y_a + alpha) - np.log(n_a + alpha_0 - y_a - alpha)) - (np.log(y_b + alpha) - np.log(n_b + alpha_0 - y_b - alpha))
+    variance = 1.0 / (y_a + alpha) + 1.0 / (y_b + alpha)
+    z_scores = log_odds / np.sqrt(variance)
+    return vocab, log_odds, z_scores
+
+def get_sorted_log_odds(vocab, scores, n=None):
+    '''
+        Output: [(word, score), ...] for the n highest scores (all of them if n is None), highest first, like the
+                log_odds_tuples of the notebooks.  nan scores are left out.
+    '''
+    order = np.argsort(-scores, kind='stable')
+    order = order[~np.isnan(scores[order])]
+    if n is not None:
+        order = order[:n]
+    return [(vocab[i], float(scores[i])) for i in order]
+
+
+if __name__ == '__main__' :
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Log odds of the words or verbs of one raw text corpus against another.')
+    parser.add_argument('corpus_a')
+    parser.add_argument('corpus_b')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes counting file chunks')
+    parser.add_argument('--verbs', action='store_true', help='count lemmatized verbs instead of all words')
+    parser.add_argument('--in-context', action='store_true', help='POS tag whole lines instead of each word on its own')
+    parser.add_argument('--prior', action='store_true', help='smooth with an informative Dirichlet prior and rank by z-score')
+    parser.add_argument('--top', type=int, default=50, help='number of words printed')
+    parser.add_argument('--out', help='also write every (word, score) pair, highest first, as JSON Lines to this file in util.outDir')
+    args = parser.parse_args()
+
+    counts_a = count_corpus(args.corpus_a, args.workers, args.verbs, args.in_context)
+    counts_b = count_corpus(args.corpus_b, args.workers, args.verbs, args.in_context)
+    vocab, log_odds, z_scores = log_odds_table(counts_a, counts_b, 'auto' if args.prior else None)
+    sorted_log_odds = get_sorted_log_odds(vocab, z_scores if args.prior else log_odds)
+    for word, score in sorted_log_odds[:args.top]:
+        print('%s\t%.4f' % (word, score))
+    if args.out:
+        util.write_json_lines(sorted_log_odds, args.out)
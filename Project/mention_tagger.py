@@ -0,0 +1,130 @@
+'''
+	mention_tagger.py
+
+	Objective: POS tag coref mentions for get_cluster_num_to_NNP_map() without calling nltk.pos_tag() once per cluster.
+	           The same mentions ("Harry", "he", "Hermione") come up over and over across the corpus, so each mention is tagged
+	           once, on its own, and its tag is kept in a bounded LRU cache.  All the mentions of a chapter (or of as many
+	           chapters as you hand to tag_clusters() at once) that aren't cached yet are tagged in a single tagger call.
+
+	           A mention is tagged as a one word sentence, so its tag doesn't depend on which other mentions are in its cluster.
+
+	Methods:	MentionTagger(maxsize=100000, tag_sents=None)
+				get_default_tagger()
+				set_default_tagger(tagger)
+
+	Usage:	tagger = mention_tagger.get_default_tagger()
+			tagged_clusters = tagger.tag_clusters([['Harry', 'he', 'the boy'], ['Hermione', 'she']])
+			print(tagger.stats())
+'''
+
+import collections
+
+
+class MentionTagger(object):
+    '''
+        Tags mentions through an LRU cache of mention -> POS tag.  tag_sents tags a list of tokenized sentences
+        (default: the nltk perceptron tagger, loaded on first use and kept for the life of the object).  A pickled
+        MentionTagger (e.g. handed to a worker process) keeps tag_sents if it was given, but not the cache, the counters
+        or the loaded nltk tagger.
+    '''
+
+    def __init__(self, maxsize=100000, tag_sents=None):
+        self.maxsize = maxsize
+        self.tag_sents = tag_sents
+        self.loaded_tag_sents = False
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.tagger_calls = 0
+
+    def get_tag_sents(self):
+        '''
+            Output: the function tagging a list of tokenized sentences, loading the nltk tagger on the first call
+        '''
+        if self.tag_sents is None:
+            from nltk.tag.perceptron import PerceptronTagger
+            try:
+                self.tag_sents = PerceptronTagger().tag_sents
+                self.loaded_tag_sents = True
+            except LookupError:
+                raise LookupError("the nltk perceptron tagger is not installed, run util.provision_nltk_data() (python util.py provision) first")
+        return self.tag_sents
+
+    def __getstate__(self):
+        return {'maxsize': self.maxsize, 'tag_sents': None if self.loaded_tag_sents else self.tag_sents}
+
+    def __setstate__(self, state):
+        self.__init__(state['maxsize'], state['tag_sents'])
+
+    def _tag_uncached(self, mentions):
+        tag_sents = self.get_tag_sents()
+        self.tagger_calls += 1
+        return [tagged[0][1] for tagged in tag_sents([[mention] for mention in mentions])]
+
+    def tag_mentions(self, mentions):
+        '''
+            Input: a list of mention strings
+            Output: the list of their POS tags
+        '''
+        tags = {}
+        uncached = {}
+        for mention in mentions:
+            if mention in self.cache:
+                self.cache.move_to_end(mention)
+                tags[mention] = self.cache[mention]
+                self.hits += 1
+            else:
+                self.misses += 1
+                uncached[mention] = None
+
+        if uncached:
+            for mention, tag in zip(uncached, self._tag_uncached(list(uncached))):
+                tags[mention] = tag
+                self.cache[mention] = tag
+                if len(self.cache) > self.maxsize:
+                    self.cache.popitem(last=False)
+
+        return [tags[mention] for mention in mentions]
+
+    def tag_clusters(self, cluster_mentions):
+        '''
+            Input: a list of mention lists, one per cluster
+            Output: a list of (mention, tag) lists, one per cluster, in the shape nltk.pos_tag() returns them
+        '''
+        flat_tags = self.tag_mentions([mention for mentions in cluster_mentions for mention in mentions])
+        tagged_clusters = []
+        offset = 0
+        for mentions in cluster_mentions:
+            tagged_clusters.append(list(zip(mentions, flat_tags[offset:offset + len(mentions)])))
+            offset += len(mentions)
+        return tagged_clusters
+
+    def stats(self):
+        '''
+            Output: the cache counters, {'hits', 'misses', 'hit_rate', 'tagger_calls', 'size'}
+        '''
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'tagger_calls': self.tagger_calls,
+                'size': len(self.cache)}
+
+
+_default_tagger = None
+
+def get_default_tagger():
+    '''
+        Output: the MentionTagger shared by everything in this process (every worker process has its own)
+    '''
+    global _default_tagger
+    if _default_tagger is None:
+        _default_tagger = MentionTagger()
+    return _default_tagger
+
+def set_default_tagger(tagger):
+    '''
+        Input: the MentionTagger get_default_tagger() returns from now on (hp_narrative_chains.imap_stories() hands it to its workers)
+    '''
+    global _default_tagger
+    _default_tagger = tagger
@@ -0,0 +1,149 @@
+'''
+	sentiment.py
+
+	Objective: Character sentiment from the verbs of their sem role chains, as in networks.ipynb, without building a
+	           TextBlob for every verb occurrence.
+
+	           Every distinct verb lemma is scored once with TextBlob and kept in a persistent lookup table
+	           (PolarityCache, a json file in util.outDir), so later runs only score verbs they haven't seen.  The characters'
+	           verbs come from verb_graph.VerbGraph as int arrays of verb ids, so the per character mean, variance and
+	           histogram are a few np.bincount() reductions over all characters at once.
+
+	           networks.ipynb averaged the polarity of every TextBlob sentence of every verb.  A verb is stored as its
+	           mean sentence polarity and its number of sentences (almost always 1, 0 if TextBlob finds no sentence), and
+	           polarities are weighted by that number, so the character means are the same as the notebook's.
+
+	Methods:	score_verb(verb)
+				PolarityCache(filename=default_cache_filename)
+				get_character_sentiment(narrative_chain_counts, cache=None, bins=10)
+
+	Usage:	python sentiment.py <RESULTS_FILENAME> [--bins N] [--out FILE]
+	Example:python sentiment.py hpff_sr_narrative_chains_counts_NNPs_large.txt --out hpff_character_sentiment.txt
+'''
+
+import json
+import os
+
+import numpy as np
+
+import util
+import verb_graph
+
+default_cache_filename = 'verb_polarity.json'
+
+
+def score_verb(verb):
+    '''
+        Output: [mean polarity of the TextBlob sentences of verb, number of sentences]
+    '''
+    from textblob import TextBlob
+    polarities = [sentence.sentiment.polarity for sentence in TextBlob(verb).sentences]
+    if not polarities:
+        return [0.0, 0]
+    return [sum(polarities) / len(polarities), len(polarities)]
+
+
+class PolarityCache(object):
+    '''
+        Persistent verb -> [polarity, number of sentences] table, kept in outDir + filename.
+
+        Usage:
+            cache = PolarityCache()
+            polarities, weights = cache.get_arrays(graph.verbs)
+            cache.save()
+    '''
+
+    def __init__(self, filename=default_cache_filename):
+        self.filename = filename
+        self.scores = {}
+        self.changed = False
+        if os.path.exists(util.outDir + filename):
+            with util.open_input(filename) as fin:
+                self.scores = json.load(fin)
+
+    def get_arrays(self, verbs):
+        '''
+            Input: a list of verbs, e.g. the vocabulary of a VerbGraph
+            Output: float array of their polarities and float array of their weights (number of sentences), scoring the
+                    verbs that aren't in the table yet
+        '''
+        for verb in verbs:
+            if verb not in self.scores:
+                self.scores[verb] = score_verb(verb)
+                self.changed = True
+        polarities = np.fromiter((self.scores[verb][0] for verb in verbs), dtype=np.float64, count=len(verbs))
+        weights = np.fromiter((self.scores[verb][1] for verb in verbs), dtype=np.float64, count=len(verbs))
+        return polarities, weights
+
+    def save(self):
+        if self.changed:
+            util.write_json(self.scores, self.filename)
+            self.changed = False
+
+
+def get_character_sentiment(narrative_chain_counts, cache=None, bins=10):
+    '''
+        Input:  the output of hpff_analysis() for sem role chains (or a verb_graph.VerbGraph built from it), a PolarityCache
+                (default: the one in default_cache_filename, saved afterwards), and the number of histogram bins over [-1, 1]
+        Output: dict of
+                    'characters' - list of the characters
+                    'mean', 'variance' - float arrays, the polarity of each character's verbs (nan without scored verbs)
+                    'count' - float array, the number of polarities behind the mean
+                    'histogram' - (characters, bins) float array of polarity counts
+                    'bin_edges' - the bins + 1 edges of the histogram
+    '''
+    if isinstance(narrative_chain_counts, verb_graph.VerbGraph):
+        graph = narrative_chain_counts
+    else:
+        graph = verb_graph.VerbGraph.from_narrative_chains(narrative_chain_counts)
+    save_cache = cache is None
+    if cache is None:
+        cache = PolarityCache()
+    polarities, weights = cache.get_arrays(graph.verbs)
+    if save_cache:
+        cache.save()
+
+    characters = list(graph.sequences)
+    if characters:
+        verb_ids = np.concatenate([graph.sequences[character] for character in characters])
+    else:
+        verb_ids = np.zeros(0, dtype=np.int32)
+    character_ids = np.repeat(np.arange(len(characters)), [len(graph.sequences[character]) for character in characters])
+
+    verb_polarities = polarities[verb_ids]
+    verb_weights = weights[verb_ids]
+    count = np.bincount(character_ids, weights=verb_weights, minlength=len(characters))
+    total = np.bincount(character_ids, weights=verb_polarities * verb_weights, minlength=len(characters))
+    total_squares = np.bincount(character_ids, weights=verb_polarities * verb_polarities * verb_weights, minlength=len(characters))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        variance = np.maximum(total_squares / count - mean * mean, 0.0)
+
+    bin_edges = np.linspace(-1.0, 1.0, bins + 1)
+    ## polarity 1.0 goes in the last bin, like np.histogram
+    bin_ids = np.clip(np.searchsorted(bin_edges, verb_polarities, side='right') - 1, 0, bins - 1)
+    histogram = np.bincount(character_ids * bins + bin_ids, weights=verb_weights, minlength=len(characters) * bins).reshape(len(characters), bins)
+
+    return {'characters': characters,
+            'mean': mean,
+            'variance': variance,
+            'count': count,
+            'histogram': histogram,
+            'bin_edges': bin_edges}
+
+
+if __name__ == '__main__' :
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Per character sentiment of the verbs of grouped sem role narrative chains.')
+    parser.add_argument('results_filename', help='json written by hpff_analysis(), in util.outDir')
+    parser.add_argument('--bins', type=int, default=10, help='number of histogram bins over [-1, 1]')
+    parser.add_argument('--out', default='character_sentiment.txt', help='json file the per character statistics are written to')
+    args = parser.parse_args()
+
+    sentiment = get_character_sentiment(util.load_results(args.results_filename), bins=args.bins)
+    util.write_json({character: {'mean': float(sentiment['mean'][i]),
+                                 'variance': float(sentiment['variance'][i]),
+                                 'count': float(sentiment['count'][i]),
+                                 'histogram': sentiment['histogram'][i].tolist()}
+                     for i, character in enumerate(sentiment['characters'])}, args.out)
@@ -5,55 +5,86 @@
 
     Objective: Utility functions for reading and writing data.
 
-    Methods:    write_outfile(filename, results, subjectLine=None, append_write)
-                write_json(filename, your_dict, append_write)
+    Methods:    provision_nltk_data(download_dir=None)
+                get_stop_words()
+                get_timestamp()
+                set_dirs(base_dir=None, out_dir=None, data_dir=None)
+                get_compression(filename, compression='infer')
+                open_output(filename, mode='w', compression='infer', atomic=True, buffer_size=default_buffer_size, encoding='utf-8')
+                open_input(filename, compression='infer', encoding='utf-8')
+                write_outfile(filename, results, subjectLine=None, append_write)
+                iter_json_chunks(your_dict)
+                write_json(filename, your_dict, compression='infer', atomic=True)
+                write_json_lines(records, filename, compression='infer', atomic=True)
+                iter_json_lines(filename, compression='infer')
                 load_json(src)
                 quick_write(filename, results, subjectLine=None, append_write)
                 pretty_print_json(filename)
-                read_hp_cannons()
+                get_professor_aliases(tokens)
+                iter_canon_book_parts(filename, aliases=None)
+                read_canon_book(filename, with_aliases=True)
+                iter_hp_canon_chapters(filenames=None, num_workers=1, aliases=None)
+                read_hp_cannons(num_workers=1)
+                get_punctuation_table(punctuation=string.punctuation)
+                TextNormalizer(stop_words=None, punctuation=string.punctuation, tokenizer=None)
+                get_default_normalizer()
                 remove_stop_words(text)
                 remove_punctuation(text)
                 tokenize_text(text)
                 get_hp_datasets(chapters)
                 pickle_dump(data, dest)
                 pickle_load(src)
+                get_shard_filenames(name)
+                PickleShardWriter(name, max_shard_bytes, resume_state=None)
+                write_checkpoint(state, filename)
+                load_checkpoint(filename)
+                remove_checkpoint(filename)
+                iter_pickle_shard_appends(filename)
+                iter_pickle_shard_file(filename)
+                iter_pickle_shards(name)
+                iter_json_dict_items(filename, compression='infer', read_size=default_buffer_size)
+                check_json_dict_chunking(read_sizes=(1, 2, 3, 5, 7, 64))
+                ResultsFile(filename, compression='infer')
+                load_results(filename)
 
     Folders:    code/
                 data/
                 out/
                 vectors/
 
-    Usage:   
+    Usage:      python util.py provision [DOWNLOAD_DIR]     ## one time download of the nltk data
+                python util.py check-json                   ## regression check of the chunked json dict reader
 '''
 
 import csv          
 import re
+import contextlib
+import gzip
+import io
+import mmap
+import gc
+import glob
 import os, sys
 import tarfile
 import json
 import pickle as pkl
-import pytz
+import functools
 from datetime import datetime
 import string
 from string import punctuation
 
-
-import nltk
-from nltk.tokenize import sent_tokenize
-from nltk.corpus import stopwords
-from nltk.data import load
-from nltk.tokenize.casual import TweetTokenizer
-from nltk.tokenize import word_tokenize
-nltk.download('stopwords')
-
-stop_words = stopwords.words('english')
-
-dateTimeObj = datetime.now(pytz.timezone("America/New_York"))
+## nltk and pytz are slow to import and nltk data is never downloaded at import time, so importing util (in every
+## worker process and notebook) stays cheap.  Resources are loaded on first use; run provision_nltk_data() once per
+## machine (python util.py provision) to download them.
+nltk_resources = ['stopwords', 'punkt', 'averaged_perceptron_tagger', 'wordnet']
 
 baseDir = '/nlp/data/irebecca/IFaTG/Final_Project/'
 outDir = '/nlp/data/irebecca/IFaTG/Final_Project/out/'
 dataDir = '/nlp/data/irebecca/IFaTG/Final_Project/data/'
 outDir = '/nlp/data/irebecca/IFaTG/Final_Project/out_small/'
+baseDir = os.environ.get('IFATG_BASE_DIR', baseDir)
+outDir = os.environ.get('IFATG_OUT_DIR', outDir)
+dataDir = os.environ.get('IFATG_DATA_DIR', dataDir)
 
 # baseDir = '/Users/rebeccaflores/Documents/GitHub/IFaTG/Final_Project/'
 # outDir = '/Users/rebeccaflores/Documents/GitHub/IFaTG/Final_Project/out/'
@@ -75,38 +106,216 @@ outDir = '/nlp/data/irebecca/IFaTG/Final_Project/out_small/'
                         vectors/
 '''
 
+###################################################
+# Lazily loaded resources
+###################################################
+
+def provision_nltk_data(download_dir=None):
+    '''
+        Downloads the nltk data the project uses (nltk_resources).  Run once per machine, e.g. before starting
+        a batch job on nodes without network access, instead of at every import.
+    '''
+    import nltk
+    for resource in nltk_resources:
+        nltk.download(resource, download_dir=download_dir)
+
+@functools.lru_cache(maxsize=None)
+def get_stop_words():
+    '''
+        Output: the nltk english stop words, loaded on the first call
+    '''
+    from nltk.corpus import stopwords
+    try:
+        return stopwords.words('english')
+    except LookupError:
+        raise LookupError("nltk stopwords are not installed, run util.provision_nltk_data() (python util.py provision) first")
+
+@functools.lru_cache(maxsize=None)
+def get_timestamp():
+    '''
+        Output: the New York time of the first call, written at the top of every outfile
+    '''
+    import pytz
+    return datetime.now(pytz.timezone("America/New_York"))
+
+@functools.lru_cache(maxsize=None)
+def get_tweet_tokenizer():
+    from nltk.tokenize.casual import TweetTokenizer
+    return TweetTokenizer()
+
+def __getattr__(name):
+    ## util.stop_words and util.dateTimeObj are still there for old code, they just aren't computed at import time
+    if name == 'stop_words':
+        return get_stop_words()
+    if name == 'dateTimeObj':
+        return get_timestamp()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
 ###################################################
 # Functions for reading and writing files
 ###################################################
 
 
+default_buffer_size = 1024 * 1024
+
+def set_dirs(base_dir=None, out_dir=None, data_dir=None):
+    '''
+        Changes baseDir, outDir and/or dataDir (also set by the IFATG_BASE_DIR, IFATG_OUT_DIR and IFATG_DATA_DIR
+        environment variables) for every reader and writer in this module
+    '''
+    global baseDir, outDir, dataDir
+    if base_dir is not None:
+        baseDir = os.path.join(base_dir, '')
+    if out_dir is not None:
+        outDir = os.path.join(out_dir, '')
+    if data_dir is not None:
+        dataDir = os.path.join(data_dir, '')
+
+def get_compression(filename, compression='infer'):
+    '''
+        Output: 'gzip', 'zstd' or None.  With 'infer', taken from the filename ('.gz', '.zst')
+    '''
+    if compression != 'infer':
+        return compression
+    if filename.endswith('.gz'):
+        return 'gzip'
+    if filename.endswith('.zst'):
+        return 'zstd'
+    return None
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('zstd compression needs the zstandard package')
+    return zstandard
+
+@contextlib.contextmanager
+def open_output(filename, mode='w', compression='infer', atomic=True, buffer_size=default_buffer_size, encoding='utf-8'):
+    '''
+        Input:  a filename under outDir, mode 'w' or 'a' (text) or 'wb' or 'ab' (binary), the compression (see get_compression())
+        Output: a buffered file object to write to, compressed on the fly.  With atomic (only for 'w' modes) everything is
+                written to filename + '.tmp', which replaces filename once the with block finishes without an exception,
+                so a reader never sees a half written file and a failed dump leaves the old file in place.
+
+        Usage:
+            with util.open_output('hpff_sr_narrative_chains_counts_NNPs.txt.gz') as f:
+                f.write(...)
+    '''
+    path = outDir + filename
+    compression = get_compression(filename, compression)
+    atomic = atomic and mode.startswith('w')
+    write_path = path + '.tmp' if atomic else path
+    binary_mode = mode[0] + 'b'
+
+    raw = open(write_path, binary_mode, buffering=buffer_size)
+    fout = raw
+    try:
+        if compression == 'gzip':
+            fout = compressed = gzip.GzipFile(fileobj=raw, mode=binary_mode)
+        elif compression == 'zstd':
+            fout = compressed = _import_zstandard().ZstdCompressor().stream_writer(raw, closefd=False)
+        elif compression is None:
+            compressed = None
+        else:
+            raise ValueError('unknown compression %s' % (compression))
+        if 'b' not in mode:
+            fout = io.TextIOWrapper(fout, encoding=encoding)
+
+        yield fout
+
+        ## flush every layer down to the file, leaving the file itself open to be synced
+        if 'b' not in mode:
+            fout.flush()
+            fout.detach()
+        if compressed is not None:
+            compressed.close()
+        raw.flush()
+        if atomic:
+            os.fsync(raw.fileno())
+    except BaseException:
+        try:
+            fout.close()
+        except Exception:
+            pass
+        raw.close()
+        if atomic and os.path.exists(write_path):
+            os.remove(write_path)
+        raise
+    raw.close()
+    if atomic:
+        os.replace(write_path, path)
+
+def open_input(filename, compression='infer', encoding='utf-8'):
+    '''
+        Output: a text file object for a (possibly compressed, see get_compression()) file under outDir
+    '''
+    path = outDir + filename
+    compression = get_compression(filename, compression)
+    if compression == 'gzip':
+        return gzip.open(path, 'rt', encoding=encoding)
+    if compression == 'zstd':
+        return io.TextIOWrapper(_import_zstandard().ZstdDecompressor().stream_reader(open(path, 'rb')), encoding=encoding)
+    return open(path, 'r', encoding=encoding)
+
 def write_outfile(results, filename, append_write, subjectLine=None, ):
     '''
     Input: A results list ['this is an', 'example'] or [45,67,23,0,1]
     Output: write each item of the list on a new line
     '''
 
-    with open(outDir + filename, append_write) as f:
-        f.write('*** New File ' + str(dateTimeObj) + '***\n\n')
+    with open_output(filename, append_write) as f:
+        f.write('*** New File ' + str(get_timestamp()) + '***\n\n')
         if subjectLine is not None:
             f.write('subjectLine: ' + subjectLine + '\n\n')
-        for item in results:
-            f.write(str(item) + '\n')
+        f.writelines(str(item) + '\n' for item in results)
         f.write('\n\n')
 
-    f.close()
 
-
-def write_json(your_dict, filename):
+def iter_json_chunks(your_dict):
+    '''
+        Output: yields json.dumps(your_dict) in pieces, one dict entry at a time, so a large dict is never held
+                as one json string.  Each entry is still encoded by the fast C encoder.
+    '''
+    if not isinstance(your_dict, dict):
+        yield json.dumps(your_dict)
+        return
+    yield '{'
+    separator = ''
+    for key, value in your_dict.items():
+        ## dumping a one entry dict converts the key the same way json.dumps() does
+        yield separator + json.dumps({key: value})[1:-1]
+        separator = ', '
+    yield '}'
+
+def write_json(your_dict, filename, compression='infer', atomic=True):
     '''
     Input: A your_dict dict {}
-    Output: A string if your dictionary written to a file
+    Output: A string if your dictionary written to a file (streamed, see iter_json_chunks() and open_output())
     '''
 
-    with open(outDir + filename, 'w') as f:
-        f.write(json.dumps(your_dict))
+    with open_output(filename, 'w', compression, atomic) as f:
+        f.writelines(iter_json_chunks(your_dict))
 
-    f.close()
+def write_json_lines(records, filename, compression='infer', atomic=True):
+    '''
+        Input:  a dict, written as one {key: value} object per line, or an iterable of json serializable records, one per line
+        Output: a JSON Lines file, read back with iter_json_lines()
+    '''
+    if isinstance(records, dict):
+        records = ({key: value} for key, value in records.items())
+    with open_output(filename, 'w', compression, atomic) as f:
+        f.writelines(json.dumps(record) + '\n' for record in records)
+
+def iter_json_lines(filename, compression='infer'):
+    '''
+        Output: yields the records of a JSON Lines file.  For a dict written by write_json_lines():
+                    your_dict = {key: value for record in iter_json_lines(filename) for key, value in record.items()}
+    '''
+    with open_input(filename, compression) as fin:
+        for line in fin:
+            yield json.loads(line)
 
 def load_json(filename):
     '''
@@ -114,7 +323,7 @@ def load_json(filename):
         Output: python dictionary object
     '''
 
-    with open(outDir + filename, 'r') as fin:
+    with open_input(filename) as fin:
         print('File Path: ', outDir + filename)
         data = json.load(fin)
 
@@ -127,16 +336,14 @@ def quick_write(results, filename, append_write, subjectLine=None, ):
     Output: writes the whole string to a line
     '''
 
-    with open(outDir + filename,append_write) as f:
-        f.write('*** New File ' + str(dateTimeObj) + '***\n\n')
+    with open_output(filename, append_write) as f:
+        f.write('*** New File ' + str(get_timestamp()) + '***\n\n')
         if subjectLine is not None:
             f.write('subjectLine: ' + subjectLine + '\n\n')
 
         f.write(str(results) + '\n')
         f.write('\n')
 
-    f.close()
-
 def pretty_print_json(filename):
 
     counter = 0
@@ -150,44 +357,106 @@ def pretty_print_json(filename):
             story = json.loads(line)
             print(json.dumps(story, indent=4))
 
-def read_hp_cannons():
+## the seven books, in order, under baseDir
+hp_canon_files = ['data/Harry Potter 1 - Sorcerer\'s Stone.txt',
+                  'data/Harry Potter 2 - Chamber of Secrets.txt',
+                  'data/Harry Potter 3 - The Prisoner Of Azkaban.txt',
+                  'data/Harry Potter 4 - The Goblet Of Fire.txt',
+                  'data/Harry Potter 5 - Order of the Phoenix.txt',
+                  'data/Harry Potter 6 - The Half Blood Prince.txt',
+                  'data/Harry Potter 7 - Deathly Hollows.txt']
+
+chapter_heading = re.compile("^Chapter", re.IGNORECASE)
+
+def get_professor_aliases(tokens):
+    '''
+        Input: a tokenized line
+        Output: 'Professor <next token>' for every 'Professor' in the line that has a token after it
+    '''
+    return [token + " " + tokens[i + 1] for i, token in enumerate(tokens[:-1]) if token == 'Professor']
+
+def iter_canon_book_parts(filename, aliases=None):
+    '''
+        Input: the path of one book, and optionally a list the 'Professor' aliases of the book are appended to
+        Output: yields the text before the first chapter heading, then the text of every chapter, the last one included.
+                Lines are streamed and each part is joined once (every line as ' ' + line, as read_hp_cannons always did).
+    '''
+    lines = []
+    with open(filename, "r", encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.strip()
+            ## only lines that contain 'Professor' can have an alias, so only those are tokenized
+            if aliases is not None and 'Professor' in line:
+                aliases.extend(get_professor_aliases(tokenize_text(line)))
+            if chapter_heading.match(line):
+                yield ''.join(lines)
+                lines = []
+            else:
+                lines.append(' ' + line)
+    yield ''.join(lines)
+
+def read_canon_book(filename, with_aliases=True):
+    '''
+        Output: (parts, aliases) of one book, see iter_canon_book_parts().  Runs in the worker processes of iter_hp_canon_chapters().
+    '''
+    aliases = [] if with_aliases else None
+    parts = list(iter_canon_book_parts(filename, aliases))
+    return parts, aliases
+
+def iter_hp_canon_chapters(filenames=None, num_workers=1, aliases=None):
+    '''
+        Input: the book paths (default: hp_canon_files under baseDir), the number of books read in parallel, and optionally
+               a list the 'Professor' aliases are appended to, in book order
+        Output: yields every chapter as one string, in book order.  The text before a book's first chapter heading stays
+                with the chapter it follows (the last chapter of the book before, or the first item for the first book).
+    '''
+    if filenames is None:
+        filenames = [baseDir + filename for filename in hp_canon_files]
+
+    if num_workers <= 1:
+        def iter_books():
+            for filename in filenames:
+                book_aliases = [] if aliases is not None else None
+                yield iter_canon_book_parts(filename, book_aliases), book_aliases
+        books = iter_books()
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(num_workers)
+        books = pool.imap(functools.partial(read_canon_book, with_aliases=aliases is not None), filenames)
+
+    ## the pool is shut down however the generator ends: exhausted, closed early by the consumer, or by an exception
+    try:
+        carried_text = ''
+        for parts, book_aliases in books:
+            previous_part = None
+            for part in parts:
+                if previous_part is None:
+                    previous_part = carried_text + part
+                else:
+                    yield previous_part
+                    previous_part = part
+            carried_text = previous_part
+            ## the serial generator fills book_aliases while its parts are read, so they are only added once the book is done
+            if aliases is not None:
+                aliases.extend(book_aliases)
+        yield carried_text
+    finally:
+        if num_workers > 1:
+            pool.terminate()
+            pool.join()
+
+def read_hp_cannons(num_workers=1):
   '''
     Reads in the Harry Potter dataset of original cannons, and breaks it up into a list of strings
 
     Returns:
         chapter_text, a list of strings, where each item in the list is one chapter from hp cannons
+        aliases, every 'Professor <name>' in the books
   '''
-  chapters = []
   aliases = []
-  chapter_text = ''
-  harry_potter_files = [baseDir + 'data/Harry Potter 1 - Sorcerer\'s Stone.txt',
-                        baseDir + 'data/Harry Potter 2 - Chamber of Secrets.txt',
-                        baseDir + 'data/Harry Potter 3 - The Prisoner Of Azkaban.txt', 
-                        baseDir + 'data/Harry Potter 4 - The Goblet Of Fire.txt', 
-                        baseDir + 'data/Harry Potter 5 - Order of the Phoenix.txt', 
-                        baseDir + 'data/Harry Potter 6 - The Half Blood Prince.txt', 
-                        baseDir + 'data/Harry Potter 7 - Deathly Hollows.txt'] 
-
-  for filename in harry_potter_files:                       
-    with open(filename, "r",encoding='utf-8', errors='ignore') as f:
-        for line in f.readlines():
-            line = line.strip()
-            toy = tokenize_text(line)
-            for token in toy:
-                if token == 'Professor':
-                    check = toy.index(token) + 1
-                    if check >= len(toy):
-                        continue
-                    else:
-                        aliases.append(token + " " + toy[check])
-            if re.findall("^Chapter",line,re.IGNORECASE):
-                chapters.append(chapter_text)
-                chapter_text = ''
-            else:
-                ## As long as chapter not in the line, append the line to chapter_text
-                chapter_text += (' ' + line)
-  
-  ## Each element in chapters[] is a whole string chapter out of the harry potter books  
+  chapters = list(iter_hp_canon_chapters(num_workers=num_workers, aliases=aliases))
+
+  ## Each element in chapters[] is a whole string chapter out of the harry potter books
   return chapters, aliases
 
 def write_hp_cannons(chapters):
@@ -203,22 +472,96 @@ def write_hp_cannons(chapters):
 # Functions to Clean Data
 ################################################### 
 
+def get_punctuation_table(punctuation=string.punctuation):
+    '''
+        Output: frozenset of every substring of punctuation (the empty string included), so a set lookup filters
+                exactly the words the old `word not in string.punctuation` substring test did, e.g. ',' and '()' but not '!!'
+    '''
+    return frozenset(punctuation[i:j] for i in range(len(punctuation) + 1) for j in range(i, len(punctuation) + 1))
+
+class TextNormalizer(object):
+    '''
+        Tokenizes and filters text with one tokenizer instance and frozenset stop word / punctuation tables.  The batch
+        methods take lists (or any iterable) of lines or tokenized sentences and return generators.
+
+        Usage:
+            normalizer = TextNormalizer()
+            words = normalizer.remove_stop_words(normalizer.tokenize('Harry looked at the wand'))
+            for words in normalizer.normalize_lines(open(filename)):
+                ...
+    '''
+
+    def __init__(self, stop_words=None, punctuation=string.punctuation, tokenizer=None):
+        ## the nltk stop words and the tokenizer are loaded on first use
+        self._stop_words = frozenset(stop_words) if stop_words is not None else None
+        self.punctuation = get_punctuation_table(punctuation)
+        self._tokenizer = tokenizer
+
+    @property
+    def stop_words(self):
+        if self._stop_words is None:
+            self._stop_words = frozenset(get_stop_words())
+        return self._stop_words
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = get_tweet_tokenizer()
+        return self._tokenizer
+
+    def tokenize(self, text):
+        return self.tokenizer.tokenize(text)
+
+    def remove_stop_words(self, words):
+        '''
+            Output: the words lowercased, without stop words
+        '''
+        stop_words = self.stop_words
+        return [word for word in (t.lower() for t in words) if word not in stop_words]
+
+    def remove_punctuation(self, words):
+        punctuation = self.punctuation
+        return [word for word in words if word not in punctuation]
+
+    def normalize(self, text):
+        '''
+            Output: the text tokenized, without punctuation and stop words, lowercased
+        '''
+        return self.remove_stop_words(self.remove_punctuation(self.tokenize(text)))
+
+    def tokenize_lines(self, lines):
+        tokenize = self.tokenizer.tokenize
+        return (tokenize(line) for line in lines)
+
+    def remove_stop_words_batch(self, sentences):
+        return (self.remove_stop_words(words) for words in sentences)
+
+    def remove_punctuation_batch(self, sentences):
+        return (self.remove_punctuation(words) for words in sentences)
+
+    def normalize_lines(self, lines):
+        return (self.normalize(line) for line in lines)
+
+_default_normalizer = None
+
+def get_default_normalizer():
+    '''
+        Output: the TextNormalizer the module level functions below share
+    '''
+    global _default_normalizer
+    if _default_normalizer is None:
+        _default_normalizer = TextNormalizer()
+    return _default_normalizer
+
 def remove_stop_words(text):
-    lowered_words = [t.lower() for t in text]
-    filtered_words = [t for t in lowered_words if t not in stop_words]
-    return filtered_words
+    return get_default_normalizer().remove_stop_words(text)
 
 def remove_punctuation(text):
     ## remove punctuation
-
-    filtered_words = [word for word in text if word not in string.punctuation]
-    # filtered_words = [word for word in filtered_words if word not in doubles]
-    
-    return filtered_words
+    return get_default_normalizer().remove_punctuation(text)
 
 def tokenize_text(text):
-    tknzr = TweetTokenizer()
-    return tknzr.tokenize(text)
+    return get_default_normalizer().tokenize(text)
 
 
 
@@ -267,8 +610,384 @@ def pickle_dump(data, dest):
 
 def pickle_load(filename):
     with open(outDir + filename, 'rb') as fin:
-        print('filepath: ', outDir + source)
+        print('filepath: ', outDir + filename)
         data = pkl.load(fin)
     ## order = len(list(data.keys())[0])
     return data ##, order
-    
+
+default_max_shard_bytes = 256 * 1024 * 1024
+
+def get_shard_filenames(name):
+    '''
+        Input: the name the shards were written under, i.e. 'hpff_sr_narrative_chains_with_NNPs.txt'
+        Output: the paths of its shards in outDir, in the order they were written
+    '''
+    return sorted(glob.glob(glob.escape(outDir + name) + '.[0-9][0-9][0-9][0-9][0-9]'))
+
+class PickleShardWriter(object):
+    '''
+        Appends lists to outDir + name.00000, name.00001, ... one pickle frame per append(), and starts the next
+        shard once the current one is max_shard_bytes long.  Shards left over from an earlier run under the same name are removed,
+        unless resume_state (from get_state() of the earlier writer) is given: then the shards are cut back to that state and
+        appending continues from there.
+
+        Usage:
+            with PickleShardWriter('hpff_sr_narrative_chains_with_NNPs.txt') as writer:
+                for chapter_chains in chains:
+                    writer.append(chapter_chains)
+    '''
+
+    def __init__(self, name, max_shard_bytes=default_max_shard_bytes, resume_state=None):
+        self.name = name
+        self.max_shard_bytes = max_shard_bytes
+        self.shard_num = 0
+        self.fout = None
+        if resume_state is not None:
+            self.shard_num = resume_state['shard_num']
+        for filename in get_shard_filenames(name):
+            if resume_state is None or int(filename[-5:]) > self.shard_num:
+                os.remove(filename)
+        if resume_state is not None:
+            filename = self.shard_filename(self.shard_num)
+            size = os.path.getsize(filename) if os.path.exists(filename) else 0
+            ## a checkpoint past the end of the shard belongs to other shards (e.g. left over from an earlier run), cutting back to it would pad the shard with zeros
+            if resume_state['offset'] > size:
+                raise ValueError('%s is %d bytes, shorter than the %d bytes it was checkpointed at' % (filename, size, resume_state['offset']))
+            if os.path.exists(filename):
+                os.truncate(filename, resume_state['offset'])
+
+    def shard_filename(self, shard_num):
+        return outDir + self.name + '.%05d' % shard_num
+
+    def get_state(self):
+        '''
+            Flushes the current shard to disk and returns {'shard_num', 'offset'}, the point a resumed writer cuts back to
+        '''
+        if self.fout is not None:
+            self.fout.flush()
+            os.fsync(self.fout.fileno())
+        filename = self.shard_filename(self.shard_num)
+        offset = os.path.getsize(filename) if os.path.exists(filename) else 0
+        return {'shard_num': self.shard_num, 'offset': offset}
+
+    def append(self, items):
+        if self.fout is None:
+            self.fout = open(self.shard_filename(self.shard_num), 'ab')
+        pkl.dump(items, self.fout)
+        if self.fout.tell() >= self.max_shard_bytes:
+            self.fout.close()
+            self.fout = None
+            self.shard_num += 1
+
+    def close(self):
+        if self.fout is not None:
+            self.fout.close()
+            self.fout = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_checkpoint(state, filename):
+    '''
+        Input: a json serializable state dict
+        Output: writes it to outDir + filename through a temporary file and os.replace, so a crash never leaves a half written checkpoint
+    '''
+    with open_output(filename, 'w', compression=None) as f:
+        json.dump(state, f)
+
+def load_checkpoint(filename):
+    '''
+        Output: the state dict saved by write_checkpoint(), or None if there is no checkpoint yet
+    '''
+    if not os.path.exists(outDir + filename):
+        return None
+    with open(outDir + filename, 'r') as fin:
+        return json.load(fin)
+
+def remove_checkpoint(filename):
+    '''
+        Output: removes outDir + filename if there is one, so a later resume can't pick up a checkpoint of an earlier run
+    '''
+    if os.path.exists(outDir + filename):
+        os.remove(outDir + filename)
+
+def iter_pickle_shard_appends(filename):
+    '''
+        Input: the path of one shard written by PickleShardWriter
+        Output: yields every list appended to it (e.g. one chapter's chains), in the order they were written
+    '''
+    with open(filename, 'rb') as fin:
+        while True:
+            try:
+                yield pkl.load(fin)
+            except EOFError:
+                break
+
+def iter_pickle_shard_file(filename):
+    '''
+        Input: the path of one shard written by PickleShardWriter
+        Output: yields the items of every list appended to it, in the order they were written
+    '''
+    for items in iter_pickle_shard_appends(filename):
+        for item in items:
+            yield item
+
+def iter_pickle_shards(name):
+    '''
+        Input: the name the shards were written under by PickleShardWriter
+        Output: yields the items of every appended list in the order they were written, so iterating the shards
+                is the same as iterating the list that would have been extended with each append()
+    '''
+    for filename in get_shard_filenames(name):
+        for item in iter_pickle_shard_file(filename):
+            yield item
+
+
+###################################################
+# Lazily loaded result files
+###################################################
+
+_json_whitespace = re.compile(r'[ \t\n\r]*')
+_json_number_chars = frozenset('0123456789.eE+-')
+
+class _JsonChunkReader(object):
+    '''
+        A sliding window over a text file for iter_json_dict_items(): chunks of read_size chars are appended as the
+        decoder needs them and the part already decoded is dropped, so only about one value is held at a time
+    '''
+
+    def __init__(self, fin, read_size=default_buffer_size):
+        self.fin = fin
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+
+    def read_more(self, size=None):
+        ## drop what's been decoded before growing the buffer
+        if self.pos:
+            self.offset += self.pos
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.fin.read(size or self.read_size)
+        if chunk:
+            self.buffer += chunk
+        else:
+            self.eof = True
+        return bool(chunk)
+
+    def peek(self):
+        '''
+            Output: the next char that isn't whitespace (without consuming it), or '' at the end of the file
+        '''
+        while True:
+            self.pos = _json_whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.read_more():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def take(self, expected, filename):
+        char = self.peek()
+        if not char or char not in expected:
+            raise ValueError('expected %s at %d of %s' % (' or '.join(expected), self.offset + self.pos, filename))
+        self.pos += 1
+        return char
+
+    def decode(self):
+        '''
+            Output: the next json value.  A value running up to the end of the buffer may have been cut off by the
+                    chunking (a string the decoder rejects, or a number: '0.5' cut after '0.' decodes as 0, so a number
+                    also needs a char that can't continue it after it), so it's decoded again with more text read;
+                    each read at least doubles what's buffered, so a large value isn't decoded over and over
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                if self.eof or (end < len(self.buffer) and not (is_number and self.buffer[end] in _json_number_chars)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.read_more(max(self.read_size, len(self.buffer) - self.pos))
+
+def iter_json_dict_items(filename, compression='infer', read_size=default_buffer_size):
+    '''
+        Input:  a json dict under outDir, as written by write_json() (e.g. 'hpff_sr_narrative_chains_counts_NNPs.txt'), or a
+                JSON Lines file from write_json_lines() (any filename with '.jsonl' in it); read_size: chars read at a time
+        Output: yields its (key, value) pairs in file order, reading and decoding one value at a time, so neither the whole
+                dict nor the whole file is ever in memory
+    '''
+    if '.jsonl' in filename:
+        for record in iter_json_lines(filename, compression):
+            for key, value in record.items():
+                yield key, value
+        return
+
+    with open_input(filename, compression) as fin:
+        for key, value in _iter_json_dict_stream(fin, filename, read_size):
+            yield key, value
+
+def _iter_json_dict_stream(fin, filename, read_size=default_buffer_size):
+    reader = _JsonChunkReader(fin, read_size)
+    if reader.peek() != '{':
+        raise ValueError('%s is not a json dict' % (filename))
+    reader.pos += 1
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.decode()
+        reader.take(':', filename)
+        value = reader.decode()
+        yield key, value
+        if reader.take(',}', filename) == '}':
+            return
+
+def check_json_dict_chunking(read_sizes=(1, 2, 3, 5, 7, 64)):
+    '''
+        Objective: regression check for iter_json_dict_items(): decodes json dicts whose numbers (floats cut after their '.'
+                   or inside their exponent, negative and large ints) and strings straddle chunk boundaries, and a float
+                   straddling the default_buffer_size boundary, and compares them with json.loads()
+        Output: raises AssertionError on the first mismatch
+    '''
+    values = [0.5, 1e-07, -2.5e+300, 12345678901234567890, -7, 3.0, 'a\\"b', [1.25, {'x': -0.125}], True, None]
+    docs = [{'k%d' % i: value for i, value in enumerate(values)},
+            {'k%d' % i: i / 7 for i in range(50)}]
+    ## pad the first value so the first read of default_buffer_size chars ends right after the '.' of "f"
+    prefix = '{"pad": "%s", "f": ' % ('x' * (default_buffer_size - 19))
+    texts = [(json.dumps(doc), read_sizes) for doc in docs] + [(json.dumps(doc, indent=2), read_sizes) for doc in docs]
+    texts += [(prefix + '0.0001234, "g": 1.5e-07}', [default_buffer_size])]
+    for text, sizes in texts:
+        expected = list(json.loads(text).items())
+        for read_size in sizes:
+            items = list(_iter_json_dict_stream(io.StringIO(text), '<check>', read_size))
+            assert items == expected, 'read_size %d: %r != %r' % (read_size, items[:3], expected[:3])
+    print('json dict chunking ok')
+
+class ResultsFile(object):
+    '''
+        Read only, dict like view of a result file (json dict or JSON Lines, see iter_json_dict_items()) backed by a binary
+        sidecar cache: filename + '.cache' holds every value as a pickle, and filename + '.cache.idx' the key -> byte range
+        index and the size and mtime of the source.  The sidecar is built on first use and rebuilt only when the source
+        changes.  The cache is memory mapped, so opening costs the same for any file size and each value is unpickled only
+        when it is asked for.
+
+        Usage:
+            chains = util.ResultsFile('hpff_sr_narrative_chains_counts_NNPs_large.txt')
+            harry_chains = chains['Harry']
+            for entity, entity_chains in chains.items(): ...
+    '''
+
+    def __init__(self, filename, compression='infer'):
+        self.filename = filename
+        self.compression = compression
+        self.cache_filename = filename + '.cache'
+        self.index_filename = filename + '.cache.idx'
+        self.index = self._load_index()
+        if self.index is None:
+            self.index = self.build_cache()
+        self.offsets = self.index['offsets']
+        self._fin = open(outDir + self.cache_filename, 'rb')
+        ## mmap can't map an empty file
+        self._data = mmap.mmap(self._fin.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets else b''
+
+    def _source_stamp(self):
+        stat = os.stat(outDir + self.filename)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _load_index(self):
+        if not os.path.exists(outDir + self.index_filename) or not os.path.exists(outDir + self.cache_filename):
+            return None
+        with open(outDir + self.index_filename, 'rb') as fin:
+            index = pkl.load(fin)
+        if index['source'] != self._source_stamp():
+            return None
+        return index
+
+    def build_cache(self):
+        '''
+            Parses the source once and writes the sidecar.  The cache is replaced before the index, so an index always
+            describes the cache next to it.
+        '''
+        offsets = {}
+        source = self._source_stamp()
+        with open_output(self.cache_filename, 'wb', compression=None) as fout:
+            for key, value in iter_json_dict_items(self.filename, self.compression):
+                start = fout.tell()
+                pkl.dump(value, fout, protocol=pkl.HIGHEST_PROTOCOL)
+                offsets[key] = (start, fout.tell())
+        index = {'source': source, 'offsets': offsets}
+        with open_output(self.index_filename, 'wb', compression=None) as fout:
+            pkl.dump(index, fout, protocol=pkl.HIGHEST_PROTOCOL)
+        return index
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def keys(self):
+        return self.offsets.keys()
+
+    def __getitem__(self, key):
+        start, end = self.offsets[key]
+        return pkl.loads(self._data[start:end])
+
+    def get(self, key, default=None):
+        if key not in self.offsets:
+            return default
+        return self[key]
+
+    def items(self):
+        '''
+            Output: yields (key, value) in file order, unpickling one value at a time
+        '''
+        for key in self.offsets:
+            yield key, self[key]
+
+    def to_dict(self):
+        ## the garbage collector would otherwise run over and over while millions of lists are being created
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return dict(self.items())
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def close(self):
+        if self.offsets:
+            self._data.close()
+        self._fin.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def load_results(filename):
+    '''
+        Input: a result file under outDir
+        Output: the whole dict, like load_json(), but read from the binary sidecar after the first load (see ResultsFile)
+    '''
+    with ResultsFile(filename) as results:
+        return results.to_dict()
+
+
+if __name__ == '__main__' :
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'provision':
+        provision_nltk_data(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'check-json':
+        check_json_dict_chunking()
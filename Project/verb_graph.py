@@ -0,0 +1,172 @@
+'''
+	verb_graph.py
+
+	Objective: Verb transition graphs of the characters, as built in networks.ipynb and log_odds.ipynb, from the sem role
+	           narrative chains grouped by hpff_analysis() (e.g. hpff_sr_narrative_chains_counts_NNPs.txt).
+
+	           Every B-V verb of a character's chains is lemmatized once (log_odds.lemmatize_verb() caches them) and encoded
+	           as an integer id into the sorted verb vocabulary, so a character is one int array of verb ids.  The
+	           transitions are the consecutive pairs of those arrays, accumulated for all characters at once into a
+	           scipy.sparse verb x verb matrix.  networkx is only imported by to_networkx().
+
+	           As in the notebooks: only entities POS tagged NN, NNP or NNS are kept, chains of one element are skipped,
+	           characters with a single verb are dropped (it isn't a chain), and self transitions are not edges.  The
+	           vocabulary has the verbs of every kept entity.
+
+	Methods:	VerbGraph(verbs, sequences)
+				VerbGraph.from_narrative_chains(narrative_chain_counts, entity_tags=default_entity_tags, lemmatize=True, tagger=None)
+
+	Usage:	python verb_graph.py <RESULTS_FILENAME> [--graphml FILE] [--characters NAME,NAME]
+	Example:python verb_graph.py hpff_sr_narrative_chains_counts_NNPs_large.txt --graphml global_verb_network_large.graphml
+'''
+
+import numpy as np
+import scipy.sparse
+
+import log_odds
+import mention_tagger
+import util
+
+default_entity_tags = ('NN', 'NNP', 'NNS')
+
+
+class VerbGraph(object):
+    '''
+        verbs - the sorted verb vocabulary, a verb's id is its index
+        sequences - character -> int array of the ids of its verbs, in chain order
+
+        Usage:
+            graph = VerbGraph.from_narrative_chains(util.load_results('hpff_sr_narrative_chains_counts_NNPs.txt'))
+            A = graph.transition_matrix()                        ## scipy.sparse.csr_matrix, A[i, j] = count of verbs[i] -> verbs[j]
+            harry = graph.transition_matrix(['Harry'])
+            g = graph.to_networkx(character='Draco')
+    '''
+
+    def __init__(self, verbs, sequences):
+        self.verbs = verbs
+        self.sequences = sequences
+        self.verb_ids = {verb: verb_id for verb_id, verb in enumerate(verbs)}
+
+    @classmethod
+    def from_narrative_chains(cls, narrative_chain_counts, entity_tags=default_entity_tags, lemmatize=True, tagger=None):
+        '''
+            Input:  entity -> list of sem role chains ([(tag, word), ...]), as hpff_analysis() returns them or as loaded
+                    from its json file.  entity_tags - the POS tags of the entities kept (None keeps every entity).
+        '''
+        entities = list(narrative_chain_counts)
+        if entity_tags is not None:
+            if tagger is None:
+                tagger = mention_tagger.get_default_tagger()
+            entity_tags = frozenset(entity_tags)
+            entities = [entity for entity, tag in zip(entities, tagger.tag_mentions(entities)) if tag in entity_tags]
+
+        verb_lists = {}
+        for entity in entities:
+            verb_lists[entity] = [(log_odds.lemmatize_verb(elem[1]) if lemmatize else elem[1])
+                                  for chain in narrative_chain_counts[entity] if len(chain) != 1
+                                  for elem in chain if elem[0] == 'B-V']
+
+        ## encode in first seen order, then renumber so the ids follow the sorted vocabulary
+        first_seen_ids = {}
+        encoded = {entity: np.fromiter((first_seen_ids.setdefault(verb, len(first_seen_ids)) for verb in verbs), dtype=np.int32, count=len(verbs))
+                   for entity, verbs in verb_lists.items()}
+        verbs = sorted(first_seen_ids)
+        renumber = np.empty(len(first_seen_ids), dtype=np.int32)
+        renumber[[first_seen_ids[verb] for verb in verbs]] = np.arange(len(verbs), dtype=np.int32)
+
+        sequences = {entity: renumber[verb_ids] for entity, verb_ids in encoded.items() if len(verb_ids) > 1}
+        return cls(verbs, sequences)
+
+    def verb_counts(self):
+        '''
+            Output: int array, how often each verb occurs in the sequences
+        '''
+        if not self.sequences:
+            return np.zeros(len(self.verbs), dtype=np.int64)
+        return np.bincount(np.concatenate(list(self.sequences.values())), minlength=len(self.verbs))
+
+    def transition_matrix(self, characters=None, skip_self_loops=True):
+        '''
+            Input:  the characters whose transitions are added up (default: all of them)
+            Output: scipy.sparse.csr_matrix of shape (len(verbs), len(verbs)), entry [i, j] the number of times verbs[j]
+                    directly follows verbs[i]
+        '''
+        if characters is None:
+            characters = list(self.sequences)
+        sequences = [self.sequences[character] for character in characters if character in self.sequences]
+        num_verbs = len(self.verbs)
+        if not sequences:
+            return scipy.sparse.csr_matrix((num_verbs, num_verbs), dtype=np.int64)
+
+        ## all sequences end to end; a pair that starts at the last verb of a sequence crosses into the next one
+        verb_ids = np.concatenate(sequences)
+        sequence_ends = np.cumsum([len(sequence) for sequence in sequences]) - 1
+        keep = np.ones(len(verb_ids) - 1, dtype=bool)
+        keep[sequence_ends[:-1]] = False
+        sources = verb_ids[:-1][keep]
+        targets = verb_ids[1:][keep]
+        if skip_self_loops:
+            different = sources != targets
+            sources = sources[different]
+            targets = targets[different]
+
+        ## duplicate (source, target) entries are summed when converting to csr
+        return scipy.sparse.coo_matrix((np.ones(len(sources), dtype=np.int64), (sources, targets)), shape=(num_verbs, num_verbs)).tocsr()
+
+    def character_matrices(self, characters=None, skip_self_loops=True):
+        '''
+            Output: character -> transition matrix of that character alone, all in the same verb id space
+        '''
+        if characters is None:
+            characters = list(self.sequences)
+        return {character: self.transition_matrix([character], skip_self_loops) for character in characters if character in self.sequences}
+
+    def to_networkx(self, matrix=None, character=None):
+        '''
+            Input:  a transition matrix (default: the one of character, or of every character)
+            Output: networkx.DiGraph with a 'weight' on every edge.  The nodes are the verbs of character, or the whole
+                    vocabulary, like the graphs of networks.ipynb.
+        '''
+        import networkx as nx
+        if matrix is None:
+            matrix = self.transition_matrix([character] if character is not None else None)
+        graph = nx.DiGraph()
+        if character is not None:
+            node_ids = np.unique(self.sequences[character])
+        else:
+            node_ids = np.arange(len(self.verbs))
+        graph.add_nodes_from(self.verbs[verb_id] for verb_id in node_ids.tolist())
+        coo = matrix.tocoo()
+        verbs = self.verbs
+        graph.add_weighted_edges_from((verbs[i], verbs[j], int(weight)) for i, j, weight in zip(coo.row.tolist(), coo.col.tolist(), coo.data.tolist()))
+        return graph
+
+    def save(self, name, matrix=None):
+        '''
+            Writes the matrix (default: all characters) to outDir + name + '.npz' and the verb vocabulary to name + '.verbs.json'
+        '''
+        if matrix is None:
+            matrix = self.transition_matrix()
+        scipy.sparse.save_npz(util.outDir + name + '.npz', matrix)
+        util.write_json(self.verbs, name + '.verbs.json')
+
+
+if __name__ == '__main__' :
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Verb transition matrices from grouped sem role narrative chains.')
+    parser.add_argument('results_filename', help='json written by hpff_analysis(), in util.outDir')
+    parser.add_argument('--graphml', help='also write the global graph as graphml to this file')
+    parser.add_argument('--characters', help='comma separated characters to also save a matrix (and graphml) for')
+    args = parser.parse_args()
+
+    graph = VerbGraph.from_narrative_chains(util.load_results(args.results_filename))
+    print('%d verbs, %d characters' % (len(graph.verbs), len(graph.sequences)))
+    graph.save('global_verb_transitions')
+    if args.graphml:
+        import networkx as nx
+        nx.write_graphml(graph.to_networkx(), util.outDir + args.graphml)
+    for character in (args.characters.split(',') if args.characters else []):
+        graph.save('%s_verb_transitions' % (character.lower()), graph.transition_matrix([character]))
+        if args.graphml:
+            nx.write_graphml(graph.to_networkx(character=character), util.outDir + '%s_%s' % (character.lower(), args.graphml))
@@ -0,0 +1,104 @@
+'''
+	vocab.py
+
+	Objective: Integer interning of the tokens of the extraction pipeline in hp_narrative_chains.py.
+
+	           A Vocabulary gives every distinct string an int id, the first time it is seen, and keeps the one string
+	           object of each id.  The chapter level document and the replaced documents are int32 arrays of ids (the
+	           sentences are views into them), so replacing coref spans writes ids instead of building lists of strings,
+	           and the chains are decoded back to strings only when they are emitted.  Every emitted word and tag is the
+	           vocabulary's string, so a word that occurs in many chains is one object instead of one per occurrence.
+
+	           Ids are only meaningful inside the process that assigned them: every process has its own default vocabulary
+	           (get_default_vocabulary()) that grows over the whole corpus, and only strings leave a worker.
+
+	Methods:	Vocabulary(strings=())
+				get_default_vocabulary()
+
+	Usage:	vocabulary = vocab.get_default_vocabulary()
+			ids = vocabulary.encode(['Harry', 'said', 'Harry'])     ## array([0, 1, 0], dtype=int32)
+			vocabulary.decode(ids[1:])                               ## ['said', 'Harry']
+'''
+
+import numpy as np
+
+## id arrays are int32, enough for any vocabulary that fits in memory
+id_dtype = np.int32
+
+
+class Vocabulary(object):
+    '''
+        strings - the string of every id, in the order they were first seen
+        ids - string -> id
+    '''
+
+    def __init__(self, strings=()):
+        self.strings = []
+        self.ids = {}
+        for string in strings:
+            self.intern(string)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, string):
+        return string in self.ids
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+    def intern(self, string):
+        '''
+            Output: the id of string, adding it to the vocabulary if it's new
+        '''
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def canonical(self, string):
+        '''
+            Output: the vocabulary's string equal to string (interned if it's new)
+        '''
+        return self.strings[self.intern(string)]
+
+    def encode(self, strings):
+        '''
+            Input:  a list of strings
+            Output: int32 array of their ids, adding the new strings to the vocabulary
+        '''
+        ## plain dict lookups while every string is known, which is almost always once the vocabulary has warmed up
+        try:
+            return np.fromiter(map(self.ids.__getitem__, strings), dtype=id_dtype, count=len(strings))
+        except KeyError:
+            return np.fromiter(map(self.intern, strings), dtype=id_dtype, count=len(strings))
+
+    def lookup(self, strings, missing=-1):
+        '''
+            Output: int32 array of the ids of a list of strings, missing for the strings that aren't in the vocabulary
+                    (which are not added)
+        '''
+        ids = self.ids
+        return np.fromiter((ids.get(string, missing) for string in strings), dtype=id_dtype, count=len(strings))
+
+    def decode(self, string_ids):
+        '''
+            Input:  an array (or list) of ids
+            Output: the list of their strings
+        '''
+        if isinstance(string_ids, np.ndarray):
+            string_ids = string_ids.tolist()
+        return list(map(self.strings.__getitem__, string_ids))
+
+
+_default_vocabulary = None
+
+def get_default_vocabulary():
+    '''
+        Output: the Vocabulary of this process, shared by every chapter it extracts
+    '''
+    global _default_vocabulary
+    if _default_vocabulary is None:
+        _default_vocabulary = Vocabulary()
+    return _default_vocabulary